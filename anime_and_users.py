@@ -7,39 +7,146 @@ and calculating the similarity score for Animes.
 This file is Copyright (c) 2023 Hai Shi, Liam Alexander Maguire, Amelia Wu, and Sanya Chawla.
 """
 from __future__ import annotations
+import array
 import datetime
+import heapq
 import re
-from typing import Optional
+import sys
+from typing import Iterable, Optional, Sequence
 
 import python_ta
 
 import graph as g
 
 
+class Vocabulary:
+    """A table of interned words, where every word is identified by a small integer id.
+
+    Instance Attributes
+    - words: the interned word with each id
+    Representation Invariants:
+        - len(set(self.words)) == len(self.words)
+    """
+    __slots__ = ('words', '_ids', '_word_sets')
+    words: list[str]
+    _ids: dict[str, int]
+    _word_sets: Optional[dict[tuple[int, ...], tuple[tuple[int, ...], frozenset[str]]]]
+
+    def __init__(self, share_word_sets: bool) -> None:
+        """Initialize an empty vocabulary. If share_word_sets is True, equal id tuples are shared and get_words
+        returns the same frozenset for them instead of building a new one on every call.
+        """
+        self.words = []
+        self._ids = {}
+        if share_word_sets:
+            self._word_sets = {}
+        else:
+            self._word_sets = None
+
+    def get_id(self, word: str) -> int:
+        """Return the id of word, adding it to the vocabulary if it is new"""
+        if word not in self._ids:
+            self._ids[sys.intern(word)] = len(self.words)
+            self.words.append(sys.intern(word))
+        return self._ids[word]
+
+    def get_ids(self, words: Iterable[str]) -> tuple[int, ...]:
+        """Return the sorted ids of words, adding any new words to the vocabulary"""
+        ids = tuple(sorted({self.get_id(word) for word in words}))
+        if self._word_sets is None:
+            return ids
+        if ids not in self._word_sets:
+            self._word_sets[ids] = (ids, frozenset(self.words[i] for i in ids))
+        # return the tuple already in the table so that every anime with these words shares it
+        return self._word_sets[ids][0]
+
+    def get_mask(self, words: Iterable[str]) -> int:
+        """Return the bitmask with the bit of each word's id set, adding any new words to the vocabulary
+
+        >>> vocabulary = Vocabulary(share_word_sets=False)
+        >>> vocabulary.get_ids(['Action', 'Comedy', 'Drama'])
+        (0, 1, 2)
+        >>> bin(vocabulary.get_mask(['Drama', 'Action']))
+        '0b101'
+        """
+        return ids_to_mask(self.get_id(word) for word in words)
+
+    def get_words(self, ids: tuple[int, ...]) -> frozenset[str]:
+        """Return the words with the given ids
+        Preconditions:
+            - all(0 <= i < len(self.words) for i in ids)
+        """
+        if self._word_sets is not None and ids in self._word_sets:
+            return self._word_sets[ids][1]
+        return frozenset(self.words[i] for i in ids)
+
+
+def ids_to_mask(ids: Iterable[int]) -> int:
+    """Return the bitmask with the bit of each id in ids set
+
+    >>> ids_to_mask((0, 3))
+    9
+    """
+    mask = 0
+    for i in ids:
+        mask |= 1 << i
+    return mask
+
+
+# Genre combinations repeat across many anime so their word sets are shared, while titles are nearly unique
+GENRES = Vocabulary(share_word_sets=True)
+TAGS = Vocabulary(share_word_sets=False)
+
+# A single empty frozenset shared by every user without favorite animes or matching genres (CPython creates a new
+# object for every call to frozenset())
+EMPTY_SET = frozenset()
+
+# The preferences that new profiles start with, before the user changes them
+DEFAULT_PRIORITIES = {'story': 1, 'animation': 1, 'sound': 1, 'character': 1}
+DEFAULT_FAVORITE_ERA = (datetime.date(1961, 1, 1), datetime.date(2021, 1, 1))
+
+# The fewest and most episodes of an anime and the standard deviation of the episode counts of the bundled dataset,
+# without the outliers. Only used for anime that are not in a review store, which has g.StatisticsCatalogue instead.
+DEFAULT_EPISODE_SUMMARY = (1, 773, 39.64)
+
+# How many friendships away User.recommend_from_friend_graph looks for anime, how much less each friendship further
+# away counts, and how much of an anime's score comes from how many friends watched it instead of its similarity
+FRIEND_RADIUS = 2
+FRIEND_DISTANCE_DECAY = 0.5
+FRIEND_SUPPORT_WEIGHT = 0.5
+
+
 class Anime:
     """A class representing a anime node in the ReccomenderTree
 
     Private Instance Attributes
     - title: the title of the anime
     - num_episodes: the number of episodes the anime has
-    - genres: the genres of the anime
+    - genre_ids: the ids in GENRES of the genres of the anime
+    - genre_mask: the bitmask of genre_ids
     - air_dates: the dates that the anime aired between
     - UID: the unique identifier for the anime
-    - tags: the search tags for this anime
+    - tag_ids: the ids in TAGS of the search tags for this anime
     Instance Attributes
     - reviews: the reviews for this anime
+    - review_store: the ReviewStore that holds the ratings of this anime's reviews, set when the anime is inserted
+      into a ReccomenderGraph
     Representation Invariants:
         - self._num_episodes > 0
         - (self.air_dates[1] - self.air_dates[0]).days > 0
-        - len(self._tags) != 0
+        - len(self._tag_ids) != 0
     """
+    __slots__ = ('_title', '_num_episodes', '_genre_ids', '_genre_mask', '_air_dates', '_uid', 'reviews',
+                 'review_store', '_tag_ids')
     _title: str
     _num_episodes: int
-    _genres: set[str]
+    _genre_ids: tuple[int, ...]
+    _genre_mask: int
     _air_dates: tuple[datetime.date, datetime.date]
     _uid: int
     reviews: dict[User, g.Review]
-    _tags: set[str]
+    review_store: Optional[g.ReviewStore]
+    _tag_ids: tuple[int, ...]
 
     def __init__(self, title: str, num_episodes: int, genres: set[str],
                  air_dates: tuple[datetime.date, datetime.date], uid: int) -> None:
@@ -50,19 +157,29 @@ class Anime:
         """
         self._title = title
         self._num_episodes = num_episodes
-        self._genres = genres
+        self._genre_ids = GENRES.get_ids(genres)
+        self._genre_mask = ids_to_mask(self._genre_ids)
         self._air_dates = air_dates
         self._uid = uid
         self.reviews = {}
-        self._tags = g.tag_keywords_and_strip(self._title)
+        self.review_store = None
+        self._tag_ids = TAGS.get_ids(g.tag_keywords_and_strip(self._title))
 
     def get_num_episodes(self) -> int:
         """Returns the number of episodes of the anime"""
         return self._num_episodes
 
-    def get_genres(self) -> set[str]:
+    def get_genres(self) -> frozenset[str]:
         """Returns the genres of the anime"""
-        return self._genres
+        return GENRES.get_words(self._genre_ids)
+
+    def get_genre_ids(self) -> tuple[int, ...]:
+        """Returns the ids in GENRES of the genres of the anime"""
+        return self._genre_ids
+
+    def get_genre_mask(self) -> int:
+        """Returns the bitmask of the ids in GENRES of the genres of the anime"""
+        return self._genre_mask
 
     def get_uid(self) -> int:
         """Returns the UID of the anime"""
@@ -76,35 +193,40 @@ class Anime:
         """Returns the air dates of the anime"""
         return self._air_dates
 
-    def get_tags(self) -> set[str]:
+    def get_tags(self) -> frozenset[str]:
         """Returns the search tags of the anime"""
-        return self._tags
+        return TAGS.get_words(self._tag_ids)
+
+    def get_rating_totals(self) -> tuple[int, Sequence[int]]:
+        """Return the number of reviews of this anime and the sums of their ratings in the order of
+        g.RATING_CATEGORIES. The review store keeps these up to date as reviews are added or changed, so this does not
+        read any of the reviews.
+        """
+        if self.review_store is None:
+            return 0, [0] * len(g.RATING_CATEGORIES)
+        return self.review_store.get_rating_totals(self)
 
     def calculate_average_ratings(self) -> dict[str, float]:
         """Calculate the average ratings for this anime over all of its reviews.
         """
-        if self.reviews == {}:
+        count, sums = self.get_rating_totals()
+        if count == 0:
             return {'story': 0, 'animation': 0, 'sound': 0, 'character': 0, 'enjoyment': 0, 'overall': 0}
-        ratings_dict = {'story': 0, 'animation': 0, 'sound': 0, 'character': 0, 'enjoyment': 0, 'overall': 0}
-        for review in self.reviews:
-            for key in self.reviews[review].ratings:
-                ratings_dict[key] += self.reviews[review].ratings[key]
-
-        return {section: round(ratings_dict[section] / len(self.reviews), 2) for section in ratings_dict}
+        return {section: round(sums[column] / count, 2) for column, section in enumerate(g.RATING_CATEGORIES)}
 
     def get_all_path_scores_helper(self, depth: int, visited_nodes: list[Anime | User],
                                    added_ends: list[Anime | User]) -> list[list[g.Review]]:
         """Helper function for get_all_path_scores that calculates all the paths
         """
-        # NOTE: you can optionally change the depth to 5 to get much more reccomendations,
-        # but it takes more than 1 minute to calculate
+        # NOTE: changing the depth to 5 here gives much more reccomendations but takes more than 1 minute, pass a
+        # g.FrontierPathEngine(5) to g.ReccomenderGraph.get_all_path_scores instead, which takes about a second
         if depth == 3 or len(self.reviews) == 1:
             visited_reviews = []
             visited_path = []
             if visited_nodes[-1] not in added_ends and visited_nodes[-2] not in added_ends:
-                if visited_nodes[-1].__class__.__name__ == 'Anime':
+                if isinstance(visited_nodes[-1], Anime):
                     added_ends.append(visited_nodes[-1])
-                elif visited_nodes[-2].__class__.__name__ == 'Anime':
+                elif isinstance(visited_nodes[-2], Anime):
                     added_ends.append(visited_nodes[-2])
                 for i in range(0, len(visited_nodes) - 1, 2):
                     visited_reviews.append(visited_nodes[i].reviews[visited_nodes[i + 1]])
@@ -134,15 +256,20 @@ class User:
     - priorities: how much the user values each aspect of an anime
     - weights: the weights of each priority
     - favorite_era: the user's favorite era of anime
+    - matching_genres: the genres in at least half of the user's favorite and highly rated anime
+    - matching_genre_mask: the bitmask of the ids in GENRES of matching_genres
     Representation Invariants:
         - all(0 <= priorities[priority] <= 10 for priority in priorities)
         - len(self.priorities) == 5
         - len(self.favorite_animes) > 0 or len(self.reviews) > 0
     """
+    __slots__ = ('username', 'reviews', 'favorite_animes', 'matching_genres', 'matching_genre_mask', 'friends_list',
+                 'priorities', 'weights', 'favorite_era')
     username: str
     reviews: dict[Anime, g.Review]
-    favorite_animes: set[Anime]
-    matching_genres: set[str]
+    favorite_animes: set[Anime] | frozenset[Anime]
+    matching_genres: set[str] | frozenset[str]
+    matching_genre_mask: int
     friends_list: list[User]
     priorities: dict[str, int]
     weights: dict[str, float]
@@ -177,12 +304,12 @@ class User:
         self.reviews = {}
         if review is not None:
             for anime in review:
-                g.Review(self, anime, {'story': review[anime][0], 'animation': review[anime][1],
-                                       'sound': review[anime][2], 'character': review[anime][3],
-                                       'enjoyment': review[anime][4], 'overall': review[anime][5]})
+                g.Review(self, anime, review[anime][0:len(g.RATING_CATEGORIES)])
 
         self.priorities = {}
-        self.matching_genres = set()
+        # matching_genres is only ever reassigned, so users without priorities can all share one empty set
+        self.matching_genres = EMPTY_SET
+        self.matching_genre_mask = 0
         self.weights = {}
         if priority is not None:
             self.priorities = priority
@@ -193,15 +320,15 @@ class User:
                                    added_ends: list[Anime | User]) -> list[list[g.Review]]:
         """Helper function for get_all_path_scores that calculates all the paths
         """
-        # NOTE: you can optionally change the depth to 5 to get much more reccomendations,
-        # but it takes more than 1 minute to calculate
+        # NOTE: changing the depth to 5 here gives much more reccomendations but takes more than 1 minute, pass a
+        # g.FrontierPathEngine(5) to g.ReccomenderGraph.get_all_path_scores instead, which takes about a second
         if depth == 3:
             visited_reviews = []
             visited_path = []
             if len(visited_nodes) > 2 and visited_nodes[-1] not in added_ends and visited_nodes[-2] not in added_ends:
-                if visited_nodes[-1].__class__.__name__ == 'Anime':
+                if isinstance(visited_nodes[-1], Anime):
                     added_ends.append(visited_nodes[-1])
-                elif visited_nodes[-2].__class__.__name__ == 'Anime':
+                elif isinstance(visited_nodes[-2], Anime):
                     added_ends.append(visited_nodes[-2])
                 for i in range(0, len(visited_nodes) - 1, 2):
                     visited_reviews.append(visited_nodes[i].reviews[visited_nodes[i + 1]])
@@ -227,22 +354,37 @@ class User:
             - self.favorite_animes != set() or self.reviews != {}
         """
         animes = self.favorite_animes.union({ani for ani in self.reviews
-                                             if self.reviews[ani].ratings['overall'] > 4})
-        genres_count = {}
+                                             if self.reviews[ani].get_rating('overall') > 4})
+        genres_count = [0] * len(GENRES.words)
         episodes_count = 0
 
         for anime in animes:
             episodes_count += anime.get_num_episodes()
-            for genre in anime.get_genres():
-                if genre not in genres_count:
-                    genres_count[genre] = 1
-                else:
-                    genres_count[genre] += 1
-
-        self.matching_genres = {re.sub('[^a-zA-Z]+', '', gen) for gen in genres_count if
-                                genres_count[gen] >= int(len(animes) / 2)}
+            for genre_id in anime.get_genre_ids():
+                genres_count[genre_id] += 1
+
+        self.matching_genres = {re.sub('[^a-zA-Z]+', '', GENRES.words[genre_id])
+                                for genre_id in range(len(genres_count))
+                                if genres_count[genre_id] > 0 and genres_count[genre_id] >= int(len(animes) / 2)}
+        self.matching_genre_mask = GENRES.get_mask(self.matching_genres)
         self.priorities['num-episodes'] = int(episodes_count / len(animes))
 
+    def update_preferences(self, priority: dict[str, int],
+                           favorite_era: tuple[datetime.date, datetime.date]) -> None:
+        """Change this user's priorities and favorite era in place, and recalculate their matching genres, episode
+        count and priority weights the same way as when a user with these preferences is created.
+        Any 'num-episodes' in priority is ignored, since it is calculated from the user's anime.
+        Preconditions:
+            - (favorite era[1] - favorite_era[0]).days > 0
+            - all(priority[p] >= 0 for p in priority)
+            - self.favorite_animes != set() or self.reviews != {}
+        """
+        self.favorite_era = favorite_era
+        self.priorities = {category: priority[category] for category in priority if category != 'num-episodes'}
+        self.weights = {}
+        self.calculate_genre_match_avg()
+        self.calculate_priority_weights()
+
     def calculate_priority_weights(self) -> None:
         """Calculate the priority weights for each category in priority except for num_episodes
         """
@@ -266,14 +408,64 @@ class User:
         user_era_length = (self.favorite_era[1] - self.favorite_era[0]).days + 1
         date_score = round(date_overlap_delta / user_era_length, 2)
 
-        shared_members = len(self.matching_genres.intersection(anime.get_genres()))
-        total_members = len(self.matching_genres.union(anime.get_genres()))
+        shared_members = (self.matching_genre_mask & anime.get_genre_mask()).bit_count()
+        total_members = len(self.matching_genres) + len(anime.get_genre_ids()) - shared_members
         genre_match_index = round(shared_members / total_members, 2)
 
         episode_rating = round(self.calculate_episode_rating(anime), 2)
 
         return round((0.5 * weighted_avg + 0.3 * genre_match_index + 0.1 * episode_rating + 0.1 * date_score), 2) * 10
 
+    def calculate_similarity_ratings(self, catalogue: g.AnimeCatalogue,
+                                     anime_ids: Optional[Sequence[int]] = None) -> array.array:
+        """Return the similarity rating of every anime in catalogue with an id in anime_ids, or of every anime in
+        catalogue if anime_ids is None, in the same order. Each rating is exactly what calculate_similarity_rating
+        gives for that anime, but the parts that only depend on the user are worked out once for all of them and
+        the anime's features are read from the catalogue's arrays.
+        Preconditions:
+            - anime_ids is None or all(0 <= anime_id < len(catalogue) for anime_id in anime_ids)
+        """
+        if anime_ids is None:
+            anime_ids = range(len(catalogue))
+        ratings = array.array('d')
+        if len(anime_ids) == 0:
+            return ratings
+
+        weighted_columns = [(self.weights[key], g.CATEGORY_COLUMNS[key]) for key in self.priorities
+                            if key not in ('num-episodes', 'overall', 'enjoyment')]
+        era_start, era_end = self.favorite_era[0].toordinal(), self.favorite_era[1].toordinal()
+        user_era_length = era_end - era_start + 1
+        num_matching_genres = len(self.matching_genres)
+        genre_mask = self.matching_genre_mask
+        # most anime share one of a few episode counts, so each count is only rated once
+        episode_ratings = {}
+
+        for anime_id in anime_ids:
+            count, sums = catalogue.anime_nodes[anime_id].get_rating_totals()
+            if count == 0:
+                weighted_avg = 0.0
+            else:
+                weighted_avg = sum([weight * round(sums[column] / count, 2)
+                                    for weight, column in weighted_columns]) / 10
+
+            date_overlap_delta = max(min(era_end, catalogue.end_ordinals[anime_id])
+                                     - max(era_start, catalogue.start_ordinals[anime_id]) + 1, 0)
+            date_score = round(date_overlap_delta / user_era_length, 2)
+
+            shared_members = (genre_mask & catalogue.genre_masks[anime_id]).bit_count()
+            total_members = num_matching_genres + catalogue.num_genres[anime_id] - shared_members
+            genre_match_index = round(shared_members / total_members, 2)
+
+            num_episodes = catalogue.num_episodes[anime_id]
+            if num_episodes not in episode_ratings:
+                episode_ratings[num_episodes] = round(self.calculate_episode_count_rating(num_episodes,
+                                                                                          catalogue.statistics), 2)
+            episode_rating = episode_ratings[num_episodes]
+
+            ratings.append(round((0.5 * weighted_avg + 0.3 * genre_match_index + 0.1 * episode_rating
+                                  + 0.1 * date_score), 2) * 10)
+        return ratings
+
     def calculate_episode_rating(self, anime: Anime) -> float:
         """Calulcates a normalized score for the number of standard deviations an anime is away from the
         users avereage length.
@@ -281,40 +473,105 @@ class User:
             - anime must be a valid Anime object
             - self.priorities['num-episodes] > 0
         """
-        stddev = 39.64
+        statistics = None if anime.review_store is None else anime.review_store.statistics
+        return self.calculate_episode_count_rating(anime.get_num_episodes(), statistics)
+
+    def calculate_episode_count_rating(self, num_episodes: int,
+                                       statistics: Optional[g.StatisticsCatalogue] = None) -> float:
+        """Calculate calculate_episode_rating for an anime with num_episodes episodes, using the episode bounds and
+        spread of statistics, or DEFAULT_EPISODE_SUMMARY if statistics is None
+        Preconditions
+            - self.priorities['num-episodes] > 0
+        """
+        if statistics is None:
+            fewest, most, stddev = DEFAULT_EPISODE_SUMMARY
+        else:
+            fewest, most, stddev = statistics.get_episode_summary()
         mid = self.priorities['num-episodes']
-        # NOTE: the numbers 1 and 773 come from the minimum and maximum of the episode counts (excluding outliers)
-        # and the standard deviation was calulated with the outliers removed
-        # outliers were animes with id [6277, 23349, 2471, 32448, 22221, 12393, 8213, 10241]
-        max_std_deviations_l = (mid - 1) / stddev
-        max_std_deviations_r = (773 - mid) / stddev
-
-        if anime.get_num_episodes() < mid:
-            deviations_distance = (mid - anime.get_num_episodes()) / stddev
+        # NOTE: the bounds are the minimum and maximum of the episode counts excluding outliers, and the standard
+        # deviation was calculated with the outliers removed
+        max_std_deviations_l = (mid - fewest) / stddev
+        max_std_deviations_r = (most - mid) / stddev
+
+        if num_episodes < mid:
+            deviations_distance = (mid - num_episodes) / stddev
             return 1 - (deviations_distance / max_std_deviations_l)
         else:
-            deviations_distance = (anime.get_num_episodes() - mid) / stddev
+            deviations_distance = (num_episodes - mid) / stddev
             return 1 - (deviations_distance / max_std_deviations_r)
 
     def reccomend_based_on_friends(self) -> list:
         """Reccomend anime based on what the user's friends have watched. If the user has no friends, returns an empty
         list.
         """
-        already_watched = self.favorite_animes.union(self.reviews.keys())
-        animes_to_rank = set()
-        scores = {}
-        for friend in self.friends_list:
-            friend_watched = friend.favorite_animes.union(friend.reviews.keys())
-            animes_to_rank = animes_to_rank.union(friend_watched.difference(already_watched))
+        return self.recommend_from_friend_graph(radius=1, support_weight=0.0)
 
-        for anime in animes_to_rank:
-            scores[anime] = self.calculate_similarity_rating(anime)
+    def recommend_from_friend_graph(self, radius: int = FRIEND_RADIUS, k: int = 10,
+                                    support_weight: float = FRIEND_SUPPORT_WEIGHT) -> list[tuple[Anime, float]]:
+        """Return the k best anime watched by the users up to radius friendships away from this user that this user
+        has not watched, with their scores, from best to worst.
 
-        sorted_values = sorted(scores.items(), key=lambda x: x[1], reverse=True)
-        if len(sorted_values) < 10:
-            return sorted_values
-        else:
-            return sorted_values[0:10]
+        Each anime's score is (1 - support_weight) times its similarity rating plus support_weight times its support
+        out of 10, where its support is how much the friends who watched it count over the most that any anime has.
+        Friends count 1 and friends of friends count FRIEND_DISTANCE_DECAY, and so on. Anime with equal scores keep
+        the order they were first found in.
+        Preconditions:
+            - radius >= 1 and k >= 0
+            - 0 <= support_weight <= 1
+        """
+        supports = self.find_friend_support(radius)
+        if len(supports) == 0:
+            return []
+        animes = list(supports)
+        most_support = max(supports.values())
+        scores = ((anime, (1 - support_weight) * sim_rating + support_weight * 10 * supports[anime] / most_support)
+                  for anime, sim_rating in zip(animes, self.calculate_similarity_ratings_of(animes)))
+        return heapq.nlargest(k, scores, key=lambda x: x[1])
+
+    def find_friend_support(self, radius: int) -> dict[Anime, float]:
+        """Return how much the users who watched each anime that this user has not watched count, over the users up
+        to radius friendships away from this user, in the order the anime are found in. A user counts
+        FRIEND_DISTANCE_DECAY ** (d - 1), where d is the fewest friendships between them and this user.
+        """
+        already_watched = self.favorite_animes.union(self.reviews)
+        supports = {}
+        visited = {self}
+        frontier = [self]
+        for distance in range(1, radius + 1):
+            weight = FRIEND_DISTANCE_DECAY ** (distance - 1)
+            next_frontier = []
+            for user in frontier:
+                for friend in user.friends_list:
+                    if friend not in visited:
+                        visited.add(friend)
+                        next_frontier.append(friend)
+
+            for friend in next_frontier:
+                for anime in friend.favorite_animes:
+                    if anime not in already_watched:
+                        supports[anime] = supports.get(anime, 0.0) + weight
+                for anime in friend.reviews:
+                    if anime not in already_watched and anime not in friend.favorite_animes:
+                        supports[anime] = supports.get(anime, 0.0) + weight
+            frontier = next_frontier
+        return supports
+
+    def calculate_similarity_ratings_of(self, animes: list[Anime]) -> list[float]:
+        """Return the similarity rating of each anime in animes, in the same order. The anime are scored together, a
+        batch for each review store they belong to.
+        """
+        scores = {}
+        batches = {}
+        for anime in animes:
+            if anime.review_store is None:
+                scores[anime] = self.calculate_similarity_rating(anime)
+            else:
+                batches.setdefault(anime.review_store, []).append(anime)
+        for store, batch in batches.items():
+            ratings = self.calculate_similarity_ratings(store.get_catalogue(),
+                                                        [store.get_anime_id(anime) for anime in batch])
+            scores.update(zip(batch, ratings))
+        return [scores[anime] for anime in animes]
 
 
 if __name__ == '__main__':
@@ -322,7 +579,7 @@ if __name__ == '__main__':
 
     doctest.testmod(verbose=True)
     python_ta.check_all(config={
-        'extra-imports': ['graph', 'typing', 'datetime', 're'],
+        'extra-imports': ['graph', 'array', 'typing', 'datetime', 'heapq', 're', 'sys'],
         'allowed-io': ['import_profile', 'save_profile'],
         'disable': ['too-many-nested-blocks', 'too-many-instance-attributes', 'too-many-arguments'],
         'max-line-length': 120
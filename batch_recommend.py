@@ -0,0 +1,177 @@
+"""
+CSC111 Project: Batch recommendations
+
+This module contains a headless job that loads the ReccomenderGraph once and works out the path and friend
+recommendations of every user in it, or of a chosen few, with a pool of processes. Each user's recommendations are
+written to a JSON lines file as soon as they are ready, and a job that is stopped part of the way through carries on
+from the users that are not in the file yet when it is run again.
+
+Run it with `python batch_recommend.py --output recommendations.jsonl --workers 4`, and pass --help for the other
+options.
+
+This file is Copyright (c) 2023 Hai Shi, Liam Alexander Maguire, Amelia Wu, and Sanya Chawla.
+"""
+from __future__ import annotations
+import argparse
+import concurrent.futures
+import json
+import os
+import sys
+import time
+from typing import Iterator, Optional, Sequence
+
+import python_ta
+
+import anime_and_users as aau
+import dataset_files
+import graph as g
+
+OUTPUT_FILE = 'recommendations.jsonl'
+
+# The number of users that a worker is given at a time, and that are written to the output file together
+BATCH_CHUNK_SIZE = 64
+
+# The graph that recommend_for_users reads in this process, set by init_worker
+_worker_graph: Optional[g.ReccomenderGraph] = None
+
+
+def run_batch_job(files: list[str], output_file: str = OUTPUT_FILE, usernames: Optional[Sequence[str]] = None,
+                  workers: Optional[int] = None, k: int = 10, chunk_size: int = BATCH_CHUNK_SIZE) -> int:
+    """Write the recommendations of every user in the graph read from files, or of the users in usernames, to
+    output_file as one JSON object per line, and return the number of users written.
+
+    Users already in output_file are skipped, so a job that was stopped can be run again to finish it. The users
+    are split into chunks of chunk_size, and if workers is greater than 1 the chunks are shared between that many
+    processes. Each chunk is written in order as soon as it is done, and the progress and the number of users per
+    second are printed to stderr. Raises ValueError if a username in usernames is not a user in the graph.
+    Preconditions:
+        - k >= 0 and chunk_size > 0
+    """
+    global _worker_graph
+    start_time = time.perf_counter()
+    # workers is only for the recommendations, since parsing the bundled dataset with a pool of processes is slower
+    # than parsing it in this one
+    _worker_graph = g.read_file(files)
+    print(f'loaded the graph in {time.perf_counter() - start_time:.1f} s', file=sys.stderr)
+
+    if usernames is None:
+        usernames = list(_worker_graph.users)
+    unknown = [username for username in usernames if username not in _worker_graph.users]
+    if len(unknown) > 0:
+        raise ValueError(f'there are no users called {", ".join(unknown)}')
+
+    finished = read_finished_usernames(output_file)
+    remaining = [username for username in usernames if username not in finished]
+    chunks = [remaining[i:i + chunk_size] for i in range(0, len(remaining), chunk_size)]
+    print(f'{len(usernames) - len(remaining)} of {len(usernames)} users were already done', file=sys.stderr)
+
+    start_time = time.perf_counter()
+    num_written = 0
+    with open(output_file, 'a', encoding='utf-8') as writer:
+        for lines in map_chunks(files, chunks, workers, k):
+            writer.writelines(lines)
+            writer.flush()
+            os.fsync(writer.fileno())
+            num_written += len(lines)
+            elapsed = time.perf_counter() - start_time
+            print(f'{num_written} of {len(remaining)} users done, {num_written / elapsed:.1f} users/s',
+                  file=sys.stderr)
+
+    elapsed = time.perf_counter() - start_time
+    print(f'finished {num_written} users in {elapsed:.1f} s', file=sys.stderr)
+    return num_written
+
+
+def map_chunks(files: list[str], chunks: list[list[str]], workers: Optional[int], k: int) -> Iterator[list[str]]:
+    """Yield the output lines of each chunk of usernames in chunks, in order.
+    The chunks are worked on by a pool of workers processes if workers is greater than 1. Processes started by
+    forking share the graph already read by this process, and other processes read it themselves.
+    """
+    if workers is None or workers <= 1:
+        for chunk in chunks:
+            yield recommend_for_users(chunk, k)
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                                                    initargs=(files,)) as executor:
+            yield from executor.map(recommend_for_users, chunks, [k] * len(chunks))
+
+
+def init_worker(files: list[str]) -> None:
+    """Read the graph from files in this process, unless it was already read before the process was forked"""
+    global _worker_graph
+    if _worker_graph is None:
+        _worker_graph = g.read_file(files)
+
+
+def recommend_for_users(usernames: list[str], k: int) -> list[str]:
+    """Return the output line of each user in usernames, in the graph set by init_worker or run_batch_job"""
+    return [json.dumps(recommend_for_user(_worker_graph, _worker_graph.users[username], k)) + '\n'
+            for username in usernames]
+
+
+def recommend_for_user(graph: g.ReccomenderGraph, user: aau.User, k: int) -> dict:
+    """Return the top k path recommendations and the friend recommendations of user in graph, as the uid and score
+    of each anime.
+    Users from the dataset have no preferences, so they are given the same ones as a new profile. Users without any
+    favorite or highly rated anime to base their preferences on get no recommendations and are marked as skipped.
+    """
+    if len(user.priorities) == 0:
+        if not has_preference_anime(user):
+            return {'username': user.username, 'skipped': True, 'recommendations': [], 'friend_recommendations': []}
+        user.update_preferences(aau.DEFAULT_PRIORITIES, aau.DEFAULT_FAVORITE_ERA)
+
+    return {'username': user.username, 'skipped': False,
+            'recommendations': [[anime.get_uid(), score] for anime, score in graph.get_all_path_scores(user, k=k)],
+            'friend_recommendations': [[anime.get_uid(), score]
+                                       for anime, score in user.reccomend_based_on_friends()]}
+
+
+def has_preference_anime(user: aau.User) -> bool:
+    """Return whether user has a favorite anime or a review with an overall rating above 4, which
+    aau.User.calculate_genre_match_avg needs
+    """
+    return len(user.favorite_animes) > 0 or any(review.get_rating('overall') > 4 for review in user.reviews.values())
+
+
+def read_finished_usernames(output_file: str) -> set[str]:
+    """Return the usernames of the users already written to output_file, or an empty set if it does not exist.
+    If the job writing the file was stopped part of the way through a line, that line is removed from the file.
+    """
+    try:
+        with open(output_file, 'rb+') as reader:
+            contents = reader.read()
+            complete_length = contents.rfind(b'\n') + 1
+            if complete_length < len(contents):
+                reader.truncate(complete_length)
+    except FileNotFoundError:
+        return set()
+    return {json.loads(line)['username'] for line in contents[:complete_length].splitlines() if line.strip() != b''}
+
+
+def parse_arguments(arguments: list[str]) -> argparse.Namespace:
+    """Return the options of the batch job given on the command line"""
+    parser = argparse.ArgumentParser(description='Write the recommendations of the users in the dataset to a file.')
+    parser.add_argument('--output', default=OUTPUT_FILE, help='the JSON lines file to write the results to')
+    parser.add_argument('--users', nargs='+', help='only recommend for these users')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='the number of processes to use')
+    parser.add_argument('-k', type=int, default=10, help='the number of path recommendations for each user')
+    parser.add_argument('--check', action='store_true', help='run the doctests and python_ta instead')
+    return parser.parse_args(arguments)
+
+
+if __name__ == '__main__':
+    options = parse_arguments(sys.argv[1:])
+    if options.check:
+        import doctest
+
+        doctest.testmod(verbose=True)
+        python_ta.check_all(config={
+            'extra-imports': ['anime_and_users', 'dataset_files', 'graph', 'argparse', 'concurrent.futures', 'json',
+                              'os', 'sys', 'time', 'typing'],
+            'allowed-io': ['run_batch_job', 'read_finished_usernames'],
+            'disable': ['global-statement'],
+            'max-line-length': 120
+        })
+    else:
+        run_batch_job([dataset_files.find_dataset_file(name) for name in dataset_files.DATASET_FILES],
+                      options.output, options.users, options.workers, options.k)
@@ -0,0 +1,267 @@
+"""
+CSC111 Project: Anime co-occurrence index
+
+This module contains an index of the anime most often reviewed by the same users as each anime, built offline from a
+ReccomenderGraph's reviews, and a path engine that recommends anime from it without walking the graph. Most of the
+work of the depth 3 path walk is finding the anime reviewed by the users who reviewed one of the user's anime, which
+the index has already found for every anime.
+
+This file is Copyright (c) 2023 Hai Shi, Liam Alexander Maguire, Amelia Wu, and Sanya Chawla.
+"""
+from __future__ import annotations
+import array
+import concurrent.futures
+import heapq
+from typing import Iterator, Optional, Sequence
+
+import python_ta
+
+import anime_and_users as aau
+import graph as g
+
+COOCCURRENCE_INDEX_FILE = 'cooccurrence_index.pickle'
+
+# The number of neighbours kept for each anime
+NEIGHBOURS_PER_ANIME = 100
+
+# build_cooccurrence_index gives each worker about this many chunks of anime to find the neighbours of
+CHUNKS_PER_WORKER = 4
+
+# The review arrays that find_neighbours reads, set in each worker process by set_build_arrays
+_build_arrays: Optional[tuple[array.array, ...]] = None
+
+IndexRows = tuple[array.array, array.array, array.array, array.array, array.array]
+
+
+class CooccurrenceIndex:
+    """The neighbours of every anime in a graph, which are the anime reviewed by the most users who also reviewed
+    it, with the ratings those users gave to both.
+
+    The neighbours of the anime at position i of anime_uids are at positions neighbour_offsets[i] to
+    neighbour_offsets[i + 1] of the neighbour arrays, from the most to the least co-reviewed. For each neighbour,
+    neighbour_sums holds len(g.RATING_CATEGORIES) sums, in the order of g.RATING_CATEGORIES, of the ratings that the
+    co-reviewers gave to the anime and to the neighbour. Those are the rating sums of the paths through each
+    co-reviewer that g.ReccomenderGraph.calculate_path_score scores.
+
+    Instance Attributes
+    - anime_uids: the uid of each anime in the index
+    - neighbour_offsets: where the neighbours of each anime start in the neighbour arrays
+    - neighbour_animes: the position in anime_uids of each neighbour
+    - neighbour_counts: the number of users who reviewed both the anime and each neighbour
+    - neighbour_sums: the sums of the ratings of both reviews of those users, for each neighbour
+    Representation Invariants:
+        - len(self.neighbour_offsets) == len(self.anime_uids) + 1
+        - len(self.neighbour_animes) == len(self.neighbour_counts) == self.neighbour_offsets[-1]
+        - len(self.neighbour_sums) == len(self.neighbour_counts) * len(g.RATING_CATEGORIES)
+        - all(count > 0 for count in self.neighbour_counts)
+    """
+    anime_uids: array.array
+    neighbour_offsets: array.array
+    neighbour_animes: array.array
+    neighbour_counts: array.array
+    neighbour_sums: array.array
+    _positions: dict[int, int]
+
+    def __init__(self, rows: IndexRows) -> None:
+        """Initialize an index from the rows returned by get_rows or find_index_rows"""
+        self.anime_uids, self.neighbour_offsets, self.neighbour_animes, self.neighbour_counts, \
+            self.neighbour_sums = rows
+        self._positions = {uid: position for position, uid in enumerate(self.anime_uids)}
+
+    def get_rows(self) -> IndexRows:
+        """Return the arrays of the index, in the order that __init__ takes them"""
+        return (self.anime_uids, self.neighbour_offsets, self.neighbour_animes, self.neighbour_counts,
+                self.neighbour_sums)
+
+    def get_position(self, uid: int) -> Optional[int]:
+        """Return the position in anime_uids of the anime with the given uid, or None if it is not in the index"""
+        return self._positions.get(uid)
+
+
+class CooccurrencePathEngine(g.PathEngine):
+    """Recommends the neighbours in a CooccurrenceIndex of the anime a user reviewed, in
+    O(number of the user's reviews * NEIGHBOURS_PER_ANIME).
+
+    Each neighbour is scored like the depth 3 paths to it, from the mean rating sums of every path through a user
+    who reviewed both it and one of the user's anime, the same way FrontierPathEngine scores all of the shortest
+    paths to an anime. Since only the most co-reviewed neighbours are kept, anime reached only through a few users
+    may not be recommended, and reviews added after the index was built are not used.
+
+    Instance Attributes
+    - index: the index that recommendations are read from
+    """
+    index: CooccurrenceIndex
+
+    def __init__(self, index: CooccurrenceIndex) -> None:
+        """Initialize an engine that recommends from index"""
+        self.index = index
+
+    def get_path_scores(self, graph: g.ReccomenderGraph, user: aau.User) -> Iterator[tuple[aau.Anime, float]]:
+        """Yield every neighbour in the index of the anime that user reviewed which user has not watched, with its
+        score, in the order they are first found from the user's reviews
+        """
+        index = self.index
+        num_categories = len(g.RATING_CATEGORIES)
+        watched = user.favorite_animes.union(set(user.reviews))
+
+        # the number of paths to each neighbour and the sums of their ratings
+        totals = {}
+        for anime in user.reviews:
+            position = index.get_position(anime.get_uid())
+            if position is None:
+                continue
+            for entry in range(index.neighbour_offsets[position], index.neighbour_offsets[position + 1]):
+                neighbour = graph.animes.get(index.anime_uids[index.neighbour_animes[entry]])
+                if neighbour is None or neighbour in watched:
+                    continue
+                if neighbour not in totals:
+                    totals[neighbour] = [0, [0] * num_categories]
+                total = totals[neighbour]
+                total[0] += index.neighbour_counts[entry]
+                for column in range(num_categories):
+                    total[1][column] += index.neighbour_sums[entry * num_categories + column]
+
+        store = graph.review_store
+        animes = list(totals)
+        sim_ratings = user.calculate_similarity_ratings(store.get_catalogue(),
+                                                        [store.get_anime_id(anime) for anime in animes])
+        for anime, sim_rating in zip(animes, sim_ratings):
+            count, sums = totals[anime]
+            mean_sums = [total / count for total in sums]
+            yield anime, graph.calculate_rating_sums_score(anime, mean_sums, 2, user, sim_rating)
+
+
+def load_cooccurrence_index(graph: g.ReccomenderGraph, files: list[str],
+                            index_file: Optional[str] = COOCCURRENCE_INDEX_FILE,
+                            workers: Optional[int] = None) -> CooccurrenceIndex:
+    """Return the co-occurrence index of graph, which was read from files by g.read_file.
+    The index is cached in index_file next to the dataset together with the sha256 hash of every file, and is only
+    built again with build_cooccurrence_index when one of the files has changed. If index_file is None, the index is
+    always built and never saved.
+    Preconditions:
+        - graph was read from files, and every review in graph is in graph.review_store
+    """
+    if index_file is None:
+        return build_cooccurrence_index(graph, workers=workers)
+
+    digests = [g.hash_file(file) for file in files]
+    rows = g.load_snapshot(index_file, digests)
+    if rows is not None:
+        return CooccurrenceIndex(rows)
+    index = build_cooccurrence_index(graph, workers=workers)
+    g.write_snapshot(index_file, digests, index.get_rows())
+    return index
+
+
+def build_cooccurrence_index(graph: g.ReccomenderGraph, neighbours: int = NEIGHBOURS_PER_ANIME,
+                             workers: Optional[int] = None) -> CooccurrenceIndex:
+    """Build the co-occurrence index of the reviews in graph, keeping at most neighbours neighbours for each anime.
+    If workers is greater than 1, the anime are split into chunks whose neighbours are found by that many processes.
+    Preconditions:
+        - every review in graph is in graph.review_store, which is not true of the subclasses of ReccomenderGraph
+          that load or share their reviews
+        - neighbours > 0
+    """
+    store = graph.review_store
+    adjacency = store.get_adjacency()
+    arrays = (adjacency.anime_offsets, adjacency.anime_users, adjacency.anime_rows, adjacency.user_offsets,
+              adjacency.user_animes, adjacency.user_rows, store.ratings)
+    num_animes = len(store.anime_nodes)
+
+    if workers is None or workers <= 1:
+        set_build_arrays(arrays)
+        try:
+            chunks = [find_neighbours(0, num_animes, neighbours)]
+        finally:
+            set_build_arrays(None)
+    else:
+        num_chunks = workers * CHUNKS_PER_WORKER
+        bounds = [num_animes * i // num_chunks for i in range(num_chunks + 1)]
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=set_build_arrays,
+                                                    initargs=(arrays,)) as executor:
+            chunks = list(executor.map(find_neighbours, bounds[:-1], bounds[1:],
+                                       [neighbours] * num_chunks))
+
+    anime_uids = array.array('i', [anime.get_uid() for anime in store.anime_nodes])
+    neighbour_offsets = array.array('i', [0])
+    neighbour_animes = array.array('i')
+    neighbour_counts = array.array('i')
+    neighbour_sums = array.array('q')
+    for chunk_lengths, chunk_animes, chunk_counts, chunk_sums in chunks:
+        for length in chunk_lengths:
+            neighbour_offsets.append(neighbour_offsets[-1] + length)
+        neighbour_animes.extend(chunk_animes)
+        neighbour_counts.extend(chunk_counts)
+        neighbour_sums.extend(chunk_sums)
+    return CooccurrenceIndex((anime_uids, neighbour_offsets, neighbour_animes, neighbour_counts, neighbour_sums))
+
+
+def set_build_arrays(arrays: Optional[tuple[array.array, ...]]) -> None:
+    """Set the review arrays that find_neighbours reads in this process"""
+    global _build_arrays
+    _build_arrays = arrays
+
+
+def find_neighbours(start: int, end: int, neighbours: int) -> tuple[array.array, ...]:
+    """Find at most neighbours neighbours of each anime with a dense id from start up to but not including end, in
+    the arrays set by set_build_arrays. Return the number of neighbours of each anime and the neighbours' ids,
+    counts and rating sums laid out the same way as in a CooccurrenceIndex.
+    Preconditions:
+        - set_build_arrays has been called with the arrays of a graph in this process
+    """
+    anime_offsets, anime_users, anime_rows, user_offsets, user_animes, user_rows, ratings = _build_arrays
+    num_categories = len(g.RATING_CATEGORIES)
+    lengths = array.array('i')
+    found_animes = array.array('i')
+    found_counts = array.array('i')
+    found_sums = array.array('q')
+    for anime_id in range(start, end):
+        reviewers = range(anime_offsets[anime_id], anime_offsets[anime_id + 1])
+
+        # counting first means that rating sums are only added up for the neighbours that are kept
+        counts = {}
+        for position in reviewers:
+            user_id = anime_users[position]
+            for other in user_animes[user_offsets[user_id]:user_offsets[user_id + 1]]:
+                if other != anime_id:
+                    counts[other] = counts.get(other, 0) + 1
+        kept = heapq.nsmallest(neighbours, counts, key=lambda other: (-counts[other], other))
+
+        sums = {other: [0] * num_categories for other in kept}
+        for position in reviewers:
+            user_id = anime_users[position]
+            anime_ratings = get_row_ratings(ratings, anime_rows[position])
+            for other_position in range(user_offsets[user_id], user_offsets[user_id + 1]):
+                other_sums = sums.get(user_animes[other_position])
+                if other_sums is not None:
+                    other_ratings = get_row_ratings(ratings, user_rows[other_position])
+                    for column in range(num_categories):
+                        other_sums[column] += anime_ratings[column] + other_ratings[column]
+
+        lengths.append(len(kept))
+        for other in kept:
+            found_animes.append(other)
+            found_counts.append(counts[other])
+            found_sums.extend(sums[other])
+    return lengths, found_animes, found_counts, found_sums
+
+
+def get_row_ratings(ratings: Sequence[int], row: int) -> Sequence[int]:
+    """Return the ratings of review row of a review store's ratings, in the order of g.RATING_CATEGORIES
+
+    >>> list(get_row_ratings(array.array('b', range(12)), 1))
+    [6, 7, 8, 9, 10, 11]
+    """
+    return ratings[row * len(g.RATING_CATEGORIES):(row + 1) * len(g.RATING_CATEGORIES)]
+
+
+if __name__ == '__main__':
+    import doctest
+
+    doctest.testmod(verbose=True)
+    python_ta.check_all(config={
+        'extra-imports': ['anime_and_users', 'graph', 'array', 'concurrent.futures', 'heapq', 'typing'],
+        'allowed-io': [],
+        'disable': ['global-statement'],
+        'max-line-length': 120
+    })
@@ -3,6 +3,10 @@ import csv
 import re
 from typing import Any, List, Tuple
 
+from dataset_files import find_dataset_file, open_text
+
+#every input below is opened with find_dataset_file and open_text, so it can also be a .gz or .xz file or a member
+#of database.zip instead of a plain csv file in the working directory
 #when compiling from original data provided, follow the order below:
 #recompile order: read_and_write_animes, read_and_write_profiles, read_and_write_reviews,
 #                   write_anime_no_duplicates(), write_reviews_no_duplicates(), write_profiles_no_duplicates()
@@ -10,7 +14,7 @@ from typing import Any, List, Tuple
 
 def read_uids() -> list:
     uids = []
-    with open(f"uids_to_remove.csv", 'r') as reader:
+    with open_text(find_dataset_file("uids_to_remove.csv")) as reader:
         line = reader.readline()
         while line != '':
             uids.append(line[:-1])
@@ -30,8 +34,7 @@ def read_and_write_reviews():
     big_lines = []
     # index 0 is uid, 1 is anime id, 2 is overall rating, and then the rest are the ratings for each category
     # (ex. {'Overall': '8', 'Story': '8', 'Animation': '8', 'Sound': '10', 'Character': '9', 'Enjoyment': '8'})
-    with open(f"reviews(edited).csv", 'r',
-              encoding="utf-8") as reader:
+    with open_text(find_dataset_file("reviews(edited).csv")) as reader:
         line = reader.readline()
         line = line[:-9]
         counter = 0
@@ -65,7 +68,7 @@ def read_and_write_reviews():
 def read_and_write_profiles():
     big_lines = []
     # idx 1 username, idx 2 onwards favorite anime
-    with open(f"profiles.csv", 'r', encoding="utf-8") as reader:
+    with open_text(find_dataset_file("profiles.csv")) as reader:
         line = reader.readline()
 
         while line != '':
@@ -107,7 +110,7 @@ def read_and_write_animes():
     # idx 1 is anime id, idx2 is title, next idxs are genres til dates, start dates first, end date second, last idx is
     # episodes
     big_lines = []
-    with open(f"animes.csv", 'r', errors="ignore", encoding='utf-8') as reader:
+    with open_text(find_dataset_file("animes.csv"), errors="ignore") as reader:
         line = reader.readline()
 
         while line != '':
@@ -172,8 +175,7 @@ def remove_anime_duplicates() -> list[tuple[str]]:
     Note:
     You have to return tuples here to avoid a hashing error when converting a nested list to a set
     """
-    with open(f"animes_formatted.csv", 'r', errors="ignore",
-              encoding='utf-8') as read_obj:
+    with open_text(find_dataset_file("animes_formatted.csv"), errors="ignore") as read_obj:
         csv_reader = csv.reader(read_obj)
         lst_of_csv = list(csv_reader)
 
@@ -207,7 +209,7 @@ def remove_review_duplicates() -> list[tuple[str]]:
     Note:
     You have to return tuples here to avoid a hashing error when converting a nested list to a set
     """
-    with open(f"formatted_reviews.csv", 'r', errors="ignore") as read_obj:
+    with open_text(find_dataset_file("formatted_reviews.csv"), errors="ignore") as read_obj:
         csv_reader = csv.reader(read_obj)
         lst_of_csv = list(csv_reader)
 
@@ -235,7 +237,7 @@ def remove_user_duplicate() -> list[tuple[str]]:
     Note:
     You have to return tuples here to avoid a hashing error when converting a nested list to a set
     """
-    with open(f"profiles_formatted.csv", 'r', errors="ignore") as read_obj:
+    with open_text(find_dataset_file("profiles_formatted.csv"), errors="ignore") as read_obj:
         csv_reader = csv.reader(read_obj)
         lst_of_csv = list(csv_reader)
 
@@ -259,15 +261,11 @@ def fix_inconsistent_users() -> tuple[list[Any], list[Any]]:
     """Returns a tuple where index 0 and 1 are all reviews and profiles that have users that are both in the profiles
     and reviews data sets respectively
     """
-    with open(f"reviews_formatted_no_duplicates.csv",
-              'r',
-              errors="ignore") as read_obj:
+    with open_text(find_dataset_file("reviews_formatted_no_duplicates.csv"), errors="ignore") as read_obj:
         csv_reader = csv.reader(read_obj)
         reviews = list(csv_reader)
 
-    with open(f"profiles_formatted_no_duplicates.csv",
-              'r',
-              errors="ignore") as read_obj:
+    with open_text(find_dataset_file("profiles_formatted_no_duplicates.csv"), errors="ignore") as read_obj:
         csv_reader = csv.reader(read_obj)
         profiles = list(csv_reader)
 
@@ -0,0 +1,106 @@
+"""
+CSC111 Project: Dataset files
+
+This module contains the functions for opening the dataset CSV files, whether they are plain files, gzip or xz
+compressed files, or members of a zip archive such as database.zip. Every file is streamed, so reading a
+compressed file never extracts it to disk or holds a decompressed copy of it in memory.
+
+This file is Copyright (c) 2023 Hai Shi, Liam Alexander Maguire, Amelia Wu, and Sanya Chawla.
+"""
+from __future__ import annotations
+import gzip
+import io
+import lzma
+import os
+import zipfile
+from typing import BinaryIO, Optional, TextIO
+
+import python_ta
+
+# The archive that the formatted dataset ships in
+DATABASE_ARCHIVE = 'database.zip'
+DATASET_FILES = ['anime_formatted_no_duplicates.csv', 'profiles_formatted_no_duplicates.csv',
+                 'reviews_formatted_no_duplicates.csv']
+
+
+def split_archive_path(path: str) -> tuple[str, Optional[str]]:
+    """Split a path of the form 'archive.zip/member.csv' into the archive and the member. Paths that are not inside
+    a zip archive are returned with a member of None.
+
+    >>> split_archive_path('database.zip/anime_formatted_no_duplicates.csv')
+    ('database.zip', 'anime_formatted_no_duplicates.csv')
+    >>> split_archive_path('anime_formatted_no_duplicates.csv.gz')
+    ('anime_formatted_no_duplicates.csv.gz', None)
+    """
+    marker = '.zip/'
+    index = path.lower().find(marker)
+    if index == -1:
+        return path, None
+    return path[:index + len(marker) - 1], path[index + len(marker):]
+
+
+def is_plain_file(path: str) -> bool:
+    """Return whether path is an uncompressed file outside of any archive, so that it can be read at byte offsets.
+
+    >>> is_plain_file('reviews_formatted_no_duplicates.csv')
+    True
+    >>> is_plain_file('database.zip/reviews_formatted_no_duplicates.csv')
+    False
+    """
+    return split_archive_path(path)[1] is None and not path.endswith(('.gz', '.xz'))
+
+
+def open_binary(path: str) -> BinaryIO:
+    """Open the dataset file at path for reading its decompressed bytes.
+    path is either a plain file, a file ending in .gz or .xz, or a member of a zip archive written as
+    'archive.zip/member'.
+    Raises FileNotFoundError if the file or the archive member does not exist.
+    """
+    archive, member = split_archive_path(path)
+    if member is not None:
+        # the archive's file stays open until the member stream is closed, even after the ZipFile is closed
+        with zipfile.ZipFile(archive) as zipped:
+            try:
+                return zipped.open(member)
+            except KeyError as error:
+                raise FileNotFoundError(f'{member} is not in {archive}') from error
+    elif path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    elif path.endswith('.xz'):
+        return lzma.open(path, 'rb')
+    else:
+        return open(path, 'rb')
+
+
+def open_text(path: str, errors: str = 'strict') -> TextIO:
+    """Open the dataset file at path for reading as utf-8 text, one line at a time.
+    path can be any path accepted by open_binary.
+    Raises FileNotFoundError if the file or the archive member does not exist.
+    """
+    return io.TextIOWrapper(open_binary(path), encoding='utf-8', errors=errors)
+
+
+def find_dataset_file(name: str, archive: str = DATABASE_ARCHIVE) -> str:
+    """Return the path that open_text should use for the dataset file called name.
+    A plain file called name is preferred, then name.gz and name.xz, and finally the member called name of
+    archive. If none of them exist, name is returned unchanged so that opening it raises FileNotFoundError.
+    """
+    for candidate in (name, name + '.gz', name + '.xz'):
+        if os.path.exists(candidate):
+            return candidate
+    if os.path.exists(archive):
+        with zipfile.ZipFile(archive) as zipped:
+            if name in zipped.namelist():
+                return f'{archive}/{name}'
+    return name
+
+
+if __name__ == '__main__':
+    import doctest
+
+    doctest.testmod(verbose=True)
+    python_ta.check_all(config={
+        'extra-imports': ['gzip', 'io', 'lzma', 'os', 'zipfile', 'typing'],
+        'allowed-io': ['open_binary'],
+        'max-line-length': 120
+    })
@@ -7,16 +7,67 @@ and writing user profiles.
 This file is Copyright (c) 2023 Hai Shi, Liam Alexander Maguire, Amelia Wu, and Sanya Chawla.
 """
 from __future__ import annotations
+import abc
+import array
+import bisect
+import collections
+import concurrent.futures
 import datetime
+import gc
+import hashlib
+import heapq
+import itertools
+import math
+import os
+import pickle
 import re
+import tempfile
+import threading
+import time
+from typing import Iterable, Iterator, Optional, Sequence
 
 import python_ta
 
 import anime_and_users as aau
+import dataset_files
+
+# The order that a review's ratings are stored in, both in a ReviewStore and in the snapshot rows
+RATING_CATEGORIES = ('story', 'animation', 'sound', 'character', 'enjoyment', 'overall')
+CATEGORY_COLUMNS = {category: column for column, category in enumerate(RATING_CATEGORIES)}
+
+# How many interquartile ranges above the upper quartile of the logarithms of the episode counts StatisticsCatalogue
+# puts the fence past which anime are outliers, which is Tukey's fence for "far out" values. Episode counts are
+# heavily skewed, so the fence is on their logarithms: for the bundled dataset the quartiles are 8 and 26 episodes,
+# the fence is at 26 * (26 / 8) ** 3, or about 890 episodes, and the outliers are the eight anime with over 1000.
+EPISODE_FENCE_WIDTH = 3
+
+# Bump this whenever the layout of the snapshot rows changes so that old snapshots are rebuilt
+SNAPSHOT_VERSION = 2
+SNAPSHOT_FILE = 'graph_snapshot.pickle'
+
+# parse_reviews_parallel splits the reviews file into chunks of about this many bytes
+REVIEW_CHUNK_BYTES = 1 << 24
+
+# ReccomenderGraph.generate_path_scores scores at most this many paths at a time, which is all of the paths that are
+# ever in memory at once
+PATH_SCORE_CHUNK_SIZE = 4096
+
+# generate_top_scores yields its first snapshot after taking this many scores, and each one after that once it has
+# taken twice as many more as it had for the one before, so the first comes quickly and the later ones cost little
+ANYTIME_FIRST_SNAPSHOT = 256
+
+AnimeRow = tuple[int, str, tuple[str, ...], int, int, int]
+UserRow = tuple[str, tuple[int, ...]]
+ReviewColumns = tuple[list[str], array.array, array.array]
+StoreColumns = tuple[array.array, array.array, array.array]
+GraphRows = tuple[list[AnimeRow], list[UserRow], StoreColumns]
 
 
 class Review:
-    """An edge that connects a user and an anime which contains the ratings the user gave
+    """An edge that connects a user and an anime which contains the ratings the user gave.
+
+    A Review does not hold its ratings itself, it is a lightweight view of one row of the ReviewStore that the
+    reviewed anime belongs to.
 
     Instance Attributes
     - endpoints: The two nodes linked by this review
@@ -24,19 +75,512 @@ class Review:
     Representation invariants:
          - all(0 <= self.ratings[rating] <= 10 for rating in self.ratings)
     """
-    endpoints: tuple[aau.User, aau.Anime]
-    ratings: dict[str, int]
-
-    def __init__(self, e1: aau.User, e2: aau.Anime, ratings: dict[str, int]) -> None:
-        """Add a review and connect the two endpoints
+    __slots__ = ('_store', '_index')
+    _store: ReviewStore
+    _index: int
+
+    def __init__(self, e1: aau.User, e2: aau.Anime, ratings: Optional[dict[str, int] | Sequence[int]],
+                 index: Optional[int] = None) -> None:
+        """Add a review and connect the two endpoints. ratings is either a dictionary of ratings or a sequence of
+        ratings in the order of RATING_CATEGORIES. If e1 has already reviewed e2, the ratings of that review are
+        replaced instead.
+
+        If index is given, no ratings are stored and ratings is ignored. The review is connected as a view of the
+        existing row index of e2's review store instead.
         Preconditions:
             - user and anime both need to exist in the ReccomenderGraph
-            - the user and anime cannot be previously linked
+            - index is None or e2.review_store.get_anime(index) is e2
+        """
+        if e2.review_store is None:
+            e2.review_store = ReviewStore()
+        self._store = e2.review_store
+
+        with self._store.lock:
+            if index is not None:
+                self._index = index
+            else:
+                if isinstance(ratings, dict):
+                    ratings = [ratings[category] for category in RATING_CATEGORIES]
+                existing = e2.reviews.get(e1)
+                if existing is not None and existing._store is self._store:
+                    self._index = existing._index
+                    self._store.set_ratings(self._index, ratings)
+                else:
+                    self._index = self._store.append(e1, e2, ratings)
+            e1.reviews[e2] = self
+            e2.reviews[e1] = self
+
+    @property
+    def endpoints(self) -> tuple[aau.User, aau.Anime]:
+        """The user and anime linked by this review"""
+        return self._store.get_user(self._index), self._store.get_anime(self._index)
+
+    @property
+    def ratings(self) -> dict[str, int]:
+        """A new dictionary of the ratings the user gave for each category"""
+        return dict(zip(RATING_CATEGORIES, self._store.get_ratings(self._index)))
+
+    def get_rating(self, category: str) -> int:
+        """Return the rating the user gave for category
+        Preconditions:
+            - category in RATING_CATEGORIES
+        """
+        return self._store.get_rating(self._index, category)
+
+    def get_ratings_row(self) -> array.array:
+        """Return a copy of the ratings of this review in the order of RATING_CATEGORIES"""
+        return self._store.get_ratings(self._index)
+
+    def get_index(self) -> int:
+        """Return the index of the row of the review store that this review is a view of"""
+        return self._index
+
+
+class ReviewStore:
+    """A columnar store of reviews. Row i of the store holds the user, the anime and the ratings of one review.
+
+    Instance Attributes
+    - user_index: the index into user_nodes of the user who wrote each review
+    - anime_index: the index into anime_nodes of the anime of each review
+    - ratings: a review x category matrix of ratings stored row by row, with one column for each category in
+      RATING_CATEGORIES
+    - user_nodes: every user in the store by their dense id, or None for a user that was released with release_user
+    - anime_nodes: every anime in the store by their dense id
+    - anime_review_counts: the number of reviews of each anime by its dense id
+    - anime_rating_sums: an anime x category matrix of the sums of the ratings of each anime's reviews, laid out the
+      same way as ratings
+    - anime_versions: the number of times a review of each anime was added or changed, by its dense id
+    - user_versions: the number of times a review by each user was added or changed, by their dense id
+    - statistics: the statistics of the anime and reviews in the store
+    - lock: held while reviews are added or changed, so that the ratings, the rating sums and the reviews of the
+      nodes always agree
+    Representation Invariants:
+        - len(self.user_index) == len(self.anime_index) == len(self.ratings) // len(RATING_CATEGORIES)
+        - all(0 <= rating <= 10 for rating in self.ratings)
+        - len(self.anime_review_counts) == len(self.anime_nodes)
+        - len(self.anime_rating_sums) == len(self.anime_nodes) * len(RATING_CATEGORIES)
+        - len(self.anime_versions) == len(self.anime_nodes) and len(self.user_versions) == len(self.user_nodes)
+    """
+    user_index: array.array
+    anime_index: array.array
+    ratings: array.array
+    user_nodes: list[Optional[aau.User]]
+    anime_nodes: list[aau.Anime]
+    anime_review_counts: array.array
+    anime_rating_sums: array.array
+    anime_versions: array.array
+    user_versions: array.array
+    _user_ids: dict[aau.User, int]
+    _anime_ids: dict[aau.Anime, int]
+    _adjacency: Optional[ReviewAdjacency]
+    _catalogue: Optional[AnimeCatalogue]
+    statistics: StatisticsCatalogue
+    lock: threading.RLock
+
+    def __init__(self) -> None:
+        """Initialize an empty ReviewStore"""
+        self.user_index = array.array('i')
+        self.anime_index = array.array('i')
+        self.ratings = array.array('b')
+        self.user_nodes = []
+        self.anime_nodes = []
+        self.anime_review_counts = array.array('i')
+        self.anime_rating_sums = array.array('q')
+        self.anime_versions = array.array('q')
+        self.user_versions = array.array('q')
+        self._user_ids = {}
+        self._anime_ids = {}
+        self._adjacency = None
+        self._catalogue = None
+        self.statistics = StatisticsCatalogue()
+        self.lock = threading.RLock()
+
+    def __len__(self) -> int:
+        """Return the number of reviews in the store"""
+        return len(self.user_index)
+
+    def add_user(self, user: aau.User) -> int:
+        """Give user the next dense user id if they do not have one yet, and return their id"""
+        with self.lock:
+            if user not in self._user_ids:
+                self._user_ids[user] = len(self.user_nodes)
+                self.user_nodes.append(user)
+                self.user_versions.append(0)
+                self._adjacency = None
+            return self._user_ids[user]
+
+    def add_anime(self, anime: aau.Anime) -> int:
+        """Give anime the next dense anime id if it does not have one yet, and return its id"""
+        with self.lock:
+            if anime not in self._anime_ids:
+                self._anime_ids[anime] = len(self.anime_nodes)
+                self.anime_nodes.append(anime)
+                self.anime_review_counts.append(0)
+                self.anime_rating_sums.extend([0] * len(RATING_CATEGORIES))
+                self.anime_versions.append(0)
+                self.statistics.add_anime(anime)
+                self._adjacency = None
+                self._catalogue = None
+            return self._anime_ids[anime]
+
+    def get_user_id(self, user: aau.User) -> Optional[int]:
+        """Return the dense id of user, or None if user is not in the store"""
+        return self._user_ids.get(user)
+
+    def get_anime_id(self, anime: aau.Anime) -> Optional[int]:
+        """Return the dense id of anime, or None if anime is not in the store"""
+        return self._anime_ids.get(anime)
+
+    def append(self, user: aau.User, anime: aau.Anime, ratings: Sequence[int]) -> int:
+        """Add a new review row and return its index
+        Preconditions:
+            - len(ratings) == len(RATING_CATEGORIES)
+        """
+        with self.lock:
+            anime_id = self.add_anime(anime)
+            user_id = self.add_user(user)
+            self.user_index.append(user_id)
+            self.anime_index.append(anime_id)
+            self.ratings.extend(ratings)
+            self.anime_review_counts[anime_id] += 1
+            self.anime_versions[anime_id] += 1
+            self.user_versions[user_id] += 1
+            start = anime_id * len(RATING_CATEGORIES)
+            for column, rating in enumerate(ratings):
+                self.anime_rating_sums[start + column] += rating
+            self.statistics.add_ratings(ratings)
+            self._adjacency = None
+            return len(self.user_index) - 1
+
+    def extend(self, user_ids: array.array, anime_ids: array.array, ratings: array.array) -> int:
+        """Add new review rows by the dense ids of their users and anime, with their ratings laid out like
+        self.ratings, and return the index of the first of them. This adds the rows column by column instead of one
+        at a time like append, and does not create their Review views.
+        Preconditions:
+            - len(user_ids) == len(anime_ids) == len(ratings) // len(RATING_CATEGORIES)
+            - every id in user_ids and anime_ids was given out by add_user or add_anime
+            - no user reviews the same anime more than once, in the new rows or with the rows already in the store
+        """
+        num_categories = len(RATING_CATEGORIES)
+        with self.lock:
+            start = len(self.user_index)
+            self.user_index.extend(user_ids)
+            self.anime_index.extend(anime_ids)
+            self.ratings.extend(ratings)
+            for anime_id, count in collections.Counter(anime_ids).items():
+                self.anime_review_counts[anime_id] += count
+                self.anime_versions[anime_id] += count
+            for user_id, count in collections.Counter(user_ids).items():
+                self.user_versions[user_id] += count
+            for column in range(num_categories):
+                column_sums = self.anime_rating_sums[column::num_categories].tolist()
+                for anime_id, rating in zip(anime_ids, ratings[column::num_categories]):
+                    column_sums[anime_id] += rating
+                self.anime_rating_sums[column::num_categories] = array.array('q', column_sums)
+            self.statistics.add_rating_rows(ratings)
+            self._adjacency = None
+            return start
+
+    def set_ratings(self, index: int, ratings: Sequence[int]) -> None:
+        """Replace the ratings of the review at index
+        Preconditions:
+            - 0 <= index < len(self)
+            - len(ratings) == len(RATING_CATEGORIES)
+        """
+        start = index * len(RATING_CATEGORIES)
+        new_ratings = array.array('b', ratings)
+        with self.lock:
+            old_ratings = self.ratings[start:start + len(RATING_CATEGORIES)]
+            self.ratings[start:start + len(RATING_CATEGORIES)] = new_ratings
+            sums_start = self.anime_index[index] * len(RATING_CATEGORIES)
+            for column in range(len(RATING_CATEGORIES)):
+                self.anime_rating_sums[sums_start + column] += new_ratings[column] - old_ratings[column]
+            self.statistics.add_ratings(new_ratings, old_ratings)
+            self.anime_versions[self.anime_index[index]] += 1
+            self.user_versions[self.user_index[index]] += 1
+
+    def get_ratings(self, index: int) -> array.array:
+        """Return the ratings of the review at index in the order of RATING_CATEGORIES"""
+        start = index * len(RATING_CATEGORIES)
+        return self.ratings[start:start + len(RATING_CATEGORIES)]
+
+    def get_rating(self, index: int, category: str) -> int:
+        """Return the rating of the review at index for category"""
+        return self.ratings[index * len(RATING_CATEGORIES) + CATEGORY_COLUMNS[category]]
+
+    def get_rating_totals(self, anime: aau.Anime) -> tuple[int, list[int]]:
+        """Return the number of reviews of anime in the store and the sums of their ratings in the order of
+        RATING_CATEGORIES. The two always agree with each other, even while other threads are adding or changing
+        reviews.
         """
-        self.ratings = ratings
-        self.endpoints = (e1, e2)
-        e1.reviews[e2] = self
-        e2.reviews[e1] = self
+        anime_id = self._anime_ids.get(anime)
+        if anime_id is None:
+            return 0, [0] * len(RATING_CATEGORIES)
+        start = anime_id * len(RATING_CATEGORIES)
+        with self.lock:
+            return (self.anime_review_counts[anime_id],
+                    self.anime_rating_sums[start:start + len(RATING_CATEGORIES)].tolist())
+
+    def get_user(self, index: int) -> Optional[aau.User]:
+        """Return the user who wrote the review at index, or None if that user has been released"""
+        return self.user_nodes[self.user_index[index]]
+
+    def release_user(self, user: aau.User) -> int:
+        """Drop the store's reference to user and return the index that user had in user_nodes.
+        The user's review rows are kept, so a new node for the same user can take them over with bind_user.
+        Preconditions:
+            - user has at least one review in the store
+        """
+        user_id = self._user_ids.pop(user)
+        self.user_nodes[user_id] = None
+        return user_id
+
+    def bind_user(self, user_id: int, user: aau.User) -> None:
+        """Make user the owner of the review rows of the user released from index user_id of user_nodes
+        Preconditions:
+            - self.user_nodes[user_id] is None
+            - user has no reviews in the store
+        """
+        self.user_nodes[user_id] = user
+        self._user_ids[user] = user_id
+
+    def get_anime(self, index: int) -> aau.Anime:
+        """Return the anime of the review at index"""
+        return self.anime_nodes[self.anime_index[index]]
+
+    def get_review(self, index: int) -> Review:
+        """Return the Review that is a view of the row at index
+        Preconditions:
+            - self.get_user(index) is not None
+        """
+        return self.get_anime(index).reviews[self.get_user(index)]
+
+    def get_adjacency(self) -> ReviewAdjacency:
+        """Return the adjacency arrays of the reviews in the store, building them again if reviews, users or anime
+        were added since they were last built.
+        """
+        if self._adjacency is None:
+            self._adjacency = ReviewAdjacency(self)
+        return self._adjacency
+
+    def get_catalogue(self) -> AnimeCatalogue:
+        """Return the features of the anime in the store, building them again if anime were added since they were
+        last built.
+        """
+        if self._catalogue is None:
+            self._catalogue = AnimeCatalogue(self.anime_nodes, self.statistics)
+        return self._catalogue
+
+
+class ReviewAdjacency:
+    """Both directions of the bipartite graph of the reviews in a ReviewStore, as compressed sparse row arrays over
+    the store's dense user and anime ids.
+
+    The reviews of the user with id u are the rows user_rows[user_offsets[u]:user_offsets[u + 1]] of the store, in
+    the order they were added, and user_animes holds the anime id of each of those rows. anime_offsets, anime_rows
+    and anime_users are laid out the same way for each anime. Rows of users released from the store are kept.
+
+    Instance Attributes
+    - user_offsets: where the reviews of each user start in user_rows and user_animes
+    - user_rows: the rows of the store grouped by user
+    - user_animes: the anime id of each row in user_rows
+    - anime_offsets: where the reviews of each anime start in anime_rows and anime_users
+    - anime_rows: the rows of the store grouped by anime
+    - anime_users: the user id of each row in anime_rows
+    Representation Invariants:
+        - len(self.user_offsets) == len(store.user_nodes) + 1
+        - len(self.anime_offsets) == len(store.anime_nodes) + 1
+        - len(self.user_rows) == len(self.anime_rows) == len(store)
+    """
+    user_offsets: array.array
+    user_rows: array.array
+    user_animes: array.array
+    anime_offsets: array.array
+    anime_rows: array.array
+    anime_users: array.array
+
+    def __init__(self, store: ReviewStore) -> None:
+        """Build the adjacency arrays of the reviews in store"""
+        self.user_offsets, self.user_rows = group_rows(store.user_index, len(store.user_nodes))
+        self.user_animes = array.array('i', [store.anime_index[row] for row in self.user_rows])
+        self.anime_offsets, self.anime_rows = group_rows(store.anime_index, len(store.anime_nodes))
+        self.anime_users = array.array('i', [store.user_index[row] for row in self.anime_rows])
+
+    def get_user_rows(self, user_id: int) -> array.array:
+        """Return the rows of the reviews by the user with id user_id"""
+        return self.user_rows[self.user_offsets[user_id]:self.user_offsets[user_id + 1]]
+
+    def get_anime_rows(self, anime_id: int) -> array.array:
+        """Return the rows of the reviews of the anime with id anime_id"""
+        return self.anime_rows[self.anime_offsets[anime_id]:self.anime_offsets[anime_id + 1]]
+
+
+class StatisticsCatalogue:
+    """Statistics of the anime and reviews in a ReviewStore, which are kept up to date as anime and reviews are added,
+    so that scoring reads them instead of numbers worked out by hand for one dataset.
+
+    The anime with more episodes than get_episode_fence are outliers, and the episode bounds and spread are of the
+    rest. The episode counts are kept sorted with running sums of them and their squares, so the bounds and spread
+    only need the few outliers to be taken away when they are looked up.
+
+    Instance Attributes
+    - episode_counts: the number of episodes of every anime, from fewest to most
+    - genre_counts: the number of anime with each genre, by the genre's id in aau.GENRES
+    - num_reviews: the number of reviews
+    - rating_sums: the sum of the ratings of every review in each category, in the order of RATING_CATEGORIES
+    Representation Invariants:
+        - self.episode_counts == sorted(self.episode_counts)
+        - len(self.rating_sums) == len(RATING_CATEGORIES)
+    """
+    episode_counts: list[int]
+    genre_counts: array.array
+    num_reviews: int
+    rating_sums: list[int]
+    _episode_sum: int
+    _episode_square_sum: int
+    _episode_summary: Optional[tuple[int, int, float]]
+
+    def __init__(self) -> None:
+        """Initialize the statistics of an empty review store"""
+        self.episode_counts = []
+        self.genre_counts = array.array('i')
+        self.num_reviews = 0
+        self.rating_sums = [0] * len(RATING_CATEGORIES)
+        self._episode_sum = 0
+        self._episode_square_sum = 0
+        self._episode_summary = None
+
+    def add_anime(self, anime: aau.Anime) -> None:
+        """Count the episodes and genres of an anime added to the store"""
+        num_episodes = anime.get_num_episodes()
+        bisect.insort(self.episode_counts, num_episodes)
+        self._episode_sum += num_episodes
+        self._episode_square_sum += num_episodes * num_episodes
+        self._episode_summary = None
+        for genre_id in anime.get_genre_ids():
+            if genre_id >= len(self.genre_counts):
+                self.genre_counts.extend([0] * (genre_id + 1 - len(self.genre_counts)))
+            self.genre_counts[genre_id] += 1
+
+    def add_ratings(self, ratings: Sequence[int], old_ratings: Optional[Sequence[int]] = None) -> None:
+        """Count the ratings of a review added to the store, in the order of RATING_CATEGORIES, or if old_ratings is
+        given, of a review whose ratings were changed from old_ratings
+        """
+        if old_ratings is None:
+            self.num_reviews += 1
+            old_ratings = [0] * len(RATING_CATEGORIES)
+        for column in range(len(RATING_CATEGORIES)):
+            self.rating_sums[column] += ratings[column] - old_ratings[column]
+
+    def add_rating_rows(self, ratings: array.array) -> None:
+        """Count the ratings of many reviews added to the store at once, laid out like ReviewStore.ratings"""
+        self.num_reviews += len(ratings) // len(RATING_CATEGORIES)
+        for column in range(len(RATING_CATEGORIES)):
+            self.rating_sums[column] += sum(ratings[column::len(RATING_CATEGORIES)])
+
+    def get_episode_summary(self) -> tuple[int, int, float]:
+        """Return the fewest and the most episodes of the anime that are not outliers, and the standard deviation of
+        their episode counts. An empty store has (0, 0, 0.0).
+
+        >>> statistics = StatisticsCatalogue()
+        >>> for num_episodes in [12, 1, 24]:
+        ...     statistics.add_anime(aau.Anime('', num_episodes, set(), (datetime.date(2000, 1, 1),) * 2, 0))
+        >>> fewest, most, stddev = statistics.get_episode_summary()
+        >>> fewest, most, round(stddev, 2)
+        (1, 24, 9.39)
+        """
+        if self._episode_summary is None:
+            num_kept = bisect.bisect_right(self.episode_counts, self.get_episode_fence())
+            if num_kept == 0:
+                self._episode_summary = (0, 0, 0.0)
+            else:
+                outliers = self.episode_counts[num_kept:]
+                mean = (self._episode_sum - sum(outliers)) / num_kept
+                variance = (self._episode_square_sum - sum(count * count for count in outliers)) / num_kept - mean ** 2
+                self._episode_summary = (self.episode_counts[0], self.episode_counts[num_kept - 1],
+                                         math.sqrt(max(variance, 0.0)))
+        return self._episode_summary
+
+    def get_episode_fence(self) -> float:
+        """Return the most episodes an anime can have without being an outlier, EPISODE_FENCE_WIDTH interquartile
+        ranges above the upper quartile of the logarithms of the episode counts. Only anime with far more episodes
+        than most are past it, and there is no lower fence, since no anime has fewer than one episode.
+
+        >>> statistics = StatisticsCatalogue()
+        >>> for num_episodes in [4, 4, 8, 8, 8, 12, 16, 1000]:
+        ...     statistics.add_anime(aau.Anime('', num_episodes, set(), (datetime.date(2000, 1, 1),) * 2, 0))
+        >>> statistics.get_episode_fence()
+        128.0
+        >>> statistics.get_episode_summary()[1]
+        16
+        """
+        num_animes = len(self.episode_counts)
+        if num_animes == 0:
+            return 0.0
+        lower_quartile = max(self.episode_counts[num_animes // 4], 1)
+        upper_quartile = max(self.episode_counts[3 * num_animes // 4], 1)
+        return upper_quartile * (upper_quartile / lower_quartile) ** EPISODE_FENCE_WIDTH
+
+    def get_genre_frequency(self, genre: str) -> float:
+        """Return the fraction of the anime in the store that have genre"""
+        genre_id = aau.GENRES.get_id(genre)
+        if len(self.episode_counts) == 0 or genre_id >= len(self.genre_counts):
+            return 0.0
+        return self.genre_counts[genre_id] / len(self.episode_counts)
+
+    def get_category_means(self) -> list[float]:
+        """Return the mean rating of the reviews in the store in each category, in the order of RATING_CATEGORIES,
+        or all zeros if there are no reviews
+        """
+        return [total / max(self.num_reviews, 1) for total in self.rating_sums]
+
+
+class AnimeCatalogue:
+    """The features of anime that aau.User.calculate_similarity_ratings scores them on, as arrays over the dense
+    anime ids of a ReviewStore. Only features that never change are kept, the rating averages of each anime are read
+    from the anime's rating totals when it is scored, since they change as reviews are added.
+
+    Instance Attributes
+    - anime_nodes: every anime in the catalogue by their dense id
+    - start_ordinals: the ordinal of the first air date of each anime
+    - end_ordinals: the ordinal of the last air date of each anime
+    - num_episodes: the number of episodes of each anime
+    - genre_masks: the bitmask of the ids in aau.GENRES of the genres of each anime
+    - num_genres: the number of genres of each anime
+    - statistics: the statistics of the review store the anime are in, or None if they are not in one
+    Representation Invariants:
+        - len(self.start_ordinals) == len(self.end_ordinals) == len(self.num_episodes) == len(self.anime_nodes)
+        - len(self.genre_masks) == len(self.num_genres) == len(self.anime_nodes)
+    """
+    anime_nodes: list[aau.Anime]
+    start_ordinals: array.array
+    end_ordinals: array.array
+    num_episodes: array.array
+    genre_masks: list[int]
+    num_genres: array.array
+    statistics: Optional[StatisticsCatalogue]
+
+    def __init__(self, animes: Iterable[aau.Anime], statistics: Optional[StatisticsCatalogue] = None) -> None:
+        """Build the features of animes, giving each anime its position in animes as its id"""
+        self.anime_nodes = list(animes)
+        self.statistics = statistics
+        self.start_ordinals = array.array('i', [anime.get_air_dates()[0].toordinal() for anime in self.anime_nodes])
+        self.end_ordinals = array.array('i', [anime.get_air_dates()[1].toordinal() for anime in self.anime_nodes])
+        self.num_episodes = array.array('i', [anime.get_num_episodes() for anime in self.anime_nodes])
+        self.genre_masks = [anime.get_genre_mask() for anime in self.anime_nodes]
+        self.num_genres = array.array('i', [len(anime.get_genre_ids()) for anime in self.anime_nodes])
+
+    def __len__(self) -> int:
+        """Return the number of anime in the catalogue"""
+        return len(self.anime_nodes)
+
+    def filter_by_genres(self, genre_mask: int, anime_ids: Optional[Iterable[int]] = None) -> list[int]:
+        """Return the ids in anime_ids, or every id in the catalogue if anime_ids is None, of the anime that have
+        every genre in genre_mask
+        """
+        if anime_ids is None:
+            anime_ids = range(len(self.anime_nodes))
+        return [anime_id for anime_id in anime_ids if self.genre_masks[anime_id] & genre_mask == genre_mask]
 
 
 class ReccomenderGraph:
@@ -45,15 +589,18 @@ class ReccomenderGraph:
     Instance Attributes
     - users: a list of user nodes
     - animes: a list of anime nodes
+    - review_store: the ratings of every review between the users and animes in the graph
     """
     users: dict[str, aau.User]
     animes: dict[int, aau.Anime]
+    review_store: ReviewStore
 
     def __init__(self) -> None:
         """initialize an empty ReccomenderGraph
         """
         self.users = {}
         self.animes = {}
+        self.review_store = ReviewStore()
 
     def insert_user(self, user: aau.User) -> None:
         """Add a user into the graph
@@ -62,6 +609,7 @@ class ReccomenderGraph:
             - user.username not in a.users
         """
         self.users[user.username] = user
+        self.review_store.add_user(user)
 
     def insert_anime(self, anime: aau.Anime) -> None:
         """Add an anime into the graph
@@ -70,6 +618,32 @@ class ReccomenderGraph:
             - anime.get_title not in a.animes
         """
         self.animes[anime.get_uid()] = anime
+        anime.review_store = self.review_store
+        self.review_store.add_anime(anime)
+
+    def get_user_id(self, username: str) -> int:
+        """Return the dense id in the review store of the user called username
+        Preconditions:
+            - username in self.users
+        """
+        return self.review_store.get_user_id(self.users[username])
+
+    def get_anime_id(self, uid: int) -> int:
+        """Return the dense id in the review store of the anime with the given uid
+        Preconditions:
+            - uid in self.animes
+        """
+        return self.review_store.get_anime_id(self.animes[uid])
+
+    def get_favorite_animes(self, favorite_uids: tuple[int, ...]) -> frozenset[aau.Anime]:
+        """Return the animes with the given uids as a set for User.favorite_animes. Users without favorite animes
+        all share aau.EMPTY_SET.
+        Preconditions:
+            - all(uid in self.animes for uid in favorite_uids)
+        """
+        if favorite_uids == ():
+            return aau.EMPTY_SET
+        return frozenset(self.animes[uid] for uid in favorite_uids)
 
     def add_friends(self, user: str, friend_user: str) -> None:
         """Connect this user and the friend_user together
@@ -79,40 +653,149 @@ class ReccomenderGraph:
         self.users[user].friends_list.append(self.users[friend_user])
         self.users[friend_user].friends_list.append(self.users[user])
 
-    def get_all_path_scores(self, user: aau.User) -> list[tuple[aau.Anime, float]]:
+    def get_all_path_scores(self, user: aau.User, engine: Optional[PathEngine] = None, k: int = 10,
+                            deadline: Optional[float] = None,
+                            path_budget: Optional[int] = None) -> list[tuple[aau.Anime, float]]:
         """Find all anime at a path length of 3 and calculate a path score for each anime based on
-        the reviews given to it and the user's priorities, and returns the anime with the top 10 path scores
+        the reviews given to it and the user's priorities, and returns the anime with the top k path scores.
+        If engine is given, it finds and scores the paths instead of find_first_paths and calculate_path_score.
+
+        The paths are scored in chunks of at most PATH_SCORE_CHUNK_SIZE as they are found and only the best k are
+        kept in a heap, so neither the paths nor their scores are ever all in memory at once. Anime with equal scores
+        keep the order they were found in.
+
+        If deadline, a time.perf_counter() time, or path_budget, a number of paths, is given, the search stops once
+        it is past the deadline or has explored that many paths, and returns the best k found so far instead. See
+        generate_top_path_scores, which the search is then run with.
         Preconditions:
             - user in self.users
+            - k >= 0
         """
-        watched_animes = user.favorite_animes.union(set(user.reviews))
-        paths = [pa for pa in user.get_all_path_scores_helper(0, [], list(watched_animes)) if len(pa) > 2]
-        scores = []
-        for path in paths:
-            scores.append((path[-1].endpoints[1], self.calculate_path_score(path, user)))
-
-        scores_sorted = sorted(scores, key=lambda x: x[1], reverse=True)[0:10]
-        if len(scores_sorted) < 10:
-            return scores_sorted
+        if deadline is not None or path_budget is not None:
+            top_scores = []
+            for top_scores in self.generate_top_path_scores(user, engine, k, deadline, path_budget):
+                pass
+            return top_scores
+        if engine is not None:
+            scores = engine.get_path_scores(self, user)
         else:
-            return scores_sorted[0:10]
-
-    def calculate_path_score(self, path: list[Review], user: aau.User) -> float:
-        """Helper function for get_all_path_scores that calculates the path score for the given path
+            scores = self.generate_path_scores(user)
+        return heapq.nlargest(k, scores, key=lambda x: x[1])
+
+    def generate_top_path_scores(self, user: aau.User, engine: Optional[PathEngine] = None, k: int = 10,
+                                 deadline: Optional[float] = None,
+                                 path_budget: Optional[int] = None) -> Iterator[list[tuple[aau.Anime, float]]]:
+        """Yield the top k path scores of user found so far, from best to worst, each time they get better while
+        the paths are explored, so that they can be shown right away and refined. The last snapshot is the same as
+        get_all_path_scores(user, engine, k), unless the search stops early at deadline, a time.perf_counter() time,
+        or after exploring path_budget paths.
+
+        Without an engine, the paths are walked by find_first_paths and scored in chunks that double in size up to
+        PATH_SCORE_CHUNK_SIZE, so the first snapshot comes after scoring ANYTIME_FIRST_SNAPSHOT paths. Anime are
+        scored from the first path to them in the walk's order, so every snapshot holds the final scores of its anime.
+        Walking the paths through higher rated reviews first would find other paths to them, and their early scores
+        would be wrong. An engine's scores are taken in the order it yields them, each one counting as a path, and it
+        can only be stopped between them.
+        Preconditions:
+            - user in self.users
+            - k >= 0
+            - path_budget is None or path_budget >= 0
+        """
+        if engine is not None:
+            yield from generate_top_scores(engine.get_path_scores(self, user), k, deadline, path_budget)
+        else:
+            yield from generate_top_scores(self.generate_path_scores(user, deadline, path_budget,
+                                                                     ANYTIME_FIRST_SNAPSHOT), k)
+
+    def generate_path_scores(self, user: aau.User, deadline: Optional[float] = None,
+                             path_budget: Optional[int] = None,
+                             first_chunk_size: int = PATH_SCORE_CHUNK_SIZE) -> Iterator[tuple[aau.Anime, float]]:
+        """Yield each anime that get_all_path_scores scores for user with its path score. The paths are found and
+        scored in chunks, with the similarity ratings of the anime at the ends of each chunk's paths calculated
+        together. The first chunk has first_chunk_size paths, and each chunk after it twice as many as the one before
+        up to PATH_SCORE_CHUNK_SIZE. The walk stops early at deadline or path_budget like find_first_paths.
+        Preconditions:
+            - user in self.users
+            - first_chunk_size > 0
+        """
+        watched_animes = user.favorite_animes.union(set(user.reviews))
+        paths = self.find_first_paths(user, set(watched_animes), deadline, path_budget)
+        chunk_size = first_chunk_size
+        while True:
+            chunk = list(itertools.islice(paths, chunk_size))
+            if len(chunk) == 0:
+                return
+            animes = [path[-1].endpoints[1] for path in chunk]
+            sim_ratings = user.calculate_similarity_ratings(self.review_store.get_catalogue(),
+                                                            [self.review_store.get_anime_id(anime) for anime in animes])
+            for path, anime, sim_rating in zip(chunk, animes, sim_ratings):
+                yield anime, self.calculate_path_score(path, user, sim_rating)
+            chunk_size = min(2 * chunk_size, max(first_chunk_size, PATH_SCORE_CHUNK_SIZE))
+
+    def find_first_paths(self, user: aau.User, added_ends: set[aau.Anime], deadline: Optional[float] = None,
+                         path_budget: Optional[int] = None) -> Iterator[list[Review]]:
+        """Yield the first path of 3 reviews from user to each anime not in added_ends, in the order that
+        aau.User.get_all_path_scores_helper finds them, adding each anime to added_ends as its path is found.
+        The paths are walked over the review store's adjacency arrays instead of the nodes' reviews dicts.
+
+        If deadline, a time.perf_counter() time, or path_budget is given, the walk stops before the next reviewer it
+        would expand once it is past the deadline or has explored path_budget paths, counting the paths to anime
+        that were already found too.
+        Preconditions:
+            - all(review.get_index() < len(self.review_store) for review in user.reviews.values())
+        """
+        store = self.review_store
+        adjacency = store.get_adjacency()
+        user_id = store.get_user_id(user)
+        ended = {store.get_anime_id(anime) for anime in added_ends}
+        explored = 0
+        for first_anime, first_review in user.reviews.items():
+            first_anime_id = store.get_anime_id(first_anime)
+            start, end = adjacency.anime_offsets[first_anime_id], adjacency.anime_offsets[first_anime_id + 1]
+            for second_user_id, second_row in zip(adjacency.anime_users[start:end], adjacency.anime_rows[start:end]):
+                if second_user_id == user_id:
+                    continue
+                if is_out_of_budget(explored, deadline, path_budget):
+                    return
+                second_start, second_end = (adjacency.user_offsets[second_user_id],
+                                            adjacency.user_offsets[second_user_id + 1])
+                explored += second_end - second_start
+                for position in range(second_start, second_end):
+                    end_anime_id = adjacency.user_animes[position]
+                    if end_anime_id != first_anime_id and end_anime_id not in ended:
+                        ended.add(end_anime_id)
+                        added_ends.add(store.anime_nodes[end_anime_id])
+                        yield [first_review, store.get_review(second_row),
+                               store.get_review(adjacency.user_rows[position])]
+
+    def calculate_path_score(self, path: list[Review], user: aau.User, sim_rating: Optional[float] = None) -> float:
+        """Helper function for get_all_path_scores that calculates the path score for the given path.
+        sim_rating is the similarity rating of the anime at the end of the path if it is already known.
         Preconditions:
             - user in self.users
             - all(review.endpoints[0] in self.users and review.endpoints[1] in self.animes for review in path
         """
 
-        anime = path[-1].endpoints[1]
-        sim_rating = user.calculate_similarity_rating(anime)
-        review_sums = {'story': 0, 'animation': 0, 'sound': 0, 'character': 0, 'enjoyment': 0, 'overall': 0}
-
+        sums = [0] * len(RATING_CATEGORIES)
         for i in range(1, len(path)):
-            for rating in path[i].ratings:
-                review_sums[rating] += path[i].ratings[rating]
-        review_averages = {category: review_sums[category] / (len(path) - 1) for category in review_sums}
-        user_review = {category: review_sums[category] / (len(path) - 1) for category in path[0].ratings}
+            row = path[i].get_ratings_row()
+            for column in range(len(RATING_CATEGORIES)):
+                sums[column] += row[column]
+        return self.calculate_rating_sums_score(path[-1].endpoints[1], sums, len(path) - 1, user, sim_rating)
+
+    def calculate_rating_sums_score(self, anime: aau.Anime, sums: Sequence[int], num_reviews: int,
+                                    user: aau.User, sim_rating: Optional[float] = None) -> float:
+        """Calculate the path score of a path to anime whose reviews after the user's own have ratings adding up to
+        sums, in the order of RATING_CATEGORIES, over num_reviews reviews. sim_rating is user's similarity rating of
+        anime if it is already known.
+        Preconditions:
+            - num_reviews > 0
+        """
+        if sim_rating is None:
+            sim_rating = user.calculate_similarity_rating(anime)
+        review_sums = dict(zip(RATING_CATEGORIES, sums))
+        review_averages = {category: review_sums[category] / num_reviews for category in review_sums}
+        user_review = {category: review_sums[category] / num_reviews for category in RATING_CATEGORIES}
         weighted_avg = sum([user.weights[key] * review_averages[key] for key in user.priorities if
                             key not in ('num-episodes', 'overall', 'enjoyment')])
         user_review_avg = sum([user.weights[key] * user_review[key] for key in user.priorities if
@@ -123,6 +806,197 @@ class ReccomenderGraph:
         return total_avg
 
 
+class PathEngine(abc.ABC):
+    """A way of finding and scoring the anime that ReccomenderGraph.get_all_path_scores recommends, which can be
+    passed to it in place of its own path walk.
+    """
+
+    @abc.abstractmethod
+    def get_path_scores(self, graph: ReccomenderGraph, user: aau.User) -> Iterator[tuple[aau.Anime, float]]:
+        """Yield every anime recommended to user in graph with its score, in any order"""
+        raise NotImplementedError
+
+
+class SparsePathEngine(PathEngine):
+    """Finds the same paths as ReccomenderGraph.find_first_paths with two sparse vector-matrix products over the
+    review store's adjacency arrays, and scores them from their rating sums.
+
+    The products use the semiring where multiplying extends a path and adding keeps the path found first by the
+    walk, so each anime ends up with the path that get_all_path_scores would have scored. Multiplying the user's
+    anime by the anime x user matrix gives the first review of every other user on a path. Multiplying that by the
+    user x anime matrix gives the first path to every unwatched anime. Unlike the walk, each user is only expanded
+    once, however many of the user's anime they reviewed.
+    """
+
+    def get_path_scores(self, graph: ReccomenderGraph, user: aau.User) -> Iterator[tuple[aau.Anime, float]]:
+        """Yield every anime recommended to user in graph with its score, in the order that
+        ReccomenderGraph.find_first_paths finds them
+        Preconditions:
+            - every review in graph is in graph.review_store, which is not true of the subclasses of ReccomenderGraph
+              that load or share their reviews
+        """
+        store = graph.review_store
+        adjacency = store.get_adjacency()
+        user_id = store.get_user_id(user)
+        watched = {store.get_anime_id(anime) for anime in user.favorite_animes.union(set(user.reviews))}
+
+        # the first review on a path by each other user, in the order the walk first reaches them
+        second_rows = {}
+        for anime in user.reviews:
+            anime_id = store.get_anime_id(anime)
+            start, end = adjacency.anime_offsets[anime_id], adjacency.anime_offsets[anime_id + 1]
+            for second_user_id, row in zip(adjacency.anime_users[start:end], adjacency.anime_rows[start:end]):
+                if second_user_id != user_id and second_user_id not in second_rows:
+                    second_rows[second_user_id] = row
+
+        # every anime on a path was reviewed by the user, so it is watched and can not be the end of the path
+        end_rows = {}
+        for second_user_id, row in second_rows.items():
+            start, end = adjacency.user_offsets[second_user_id], adjacency.user_offsets[second_user_id + 1]
+            for position in range(start, end):
+                end_anime_id = adjacency.user_animes[position]
+                if end_anime_id not in watched and end_anime_id not in end_rows:
+                    end_rows[end_anime_id] = (row, adjacency.user_rows[position])
+
+        sim_ratings = user.calculate_similarity_ratings(store.get_catalogue(), list(end_rows))
+        for (end_anime_id, (second_row, end_row)), sim_rating in zip(end_rows.items(), sim_ratings):
+            sums = [a + b for a, b in zip(store.get_ratings(second_row), store.get_ratings(end_row))]
+            anime = store.anime_nodes[end_anime_id]
+            yield anime, graph.calculate_rating_sums_score(anime, sums, 2, user, sim_rating)
+
+
+class FrontierPathEngine(PathEngine):
+    """Finds the anime up to depth reviews away from a user with a breadth first search over the review store's
+    adjacency arrays, and scores each one from statistics aggregated over all of the shortest paths to it.
+
+    Instead of listing paths, every node reached at the current distance keeps the number of shortest paths to it
+    and the sums of their ratings, which are pushed along each edge to the next distance. An anime first reached at
+    distance d is scored from the mean rating sums of its paths over their d - 1 reviews after the user's own. At
+    depth 3 this finds the same anime as ReccomenderGraph.find_first_paths, but averages over all of their shortest
+    paths instead of scoring the first one.
+
+    Instance Attributes
+    - depth: the greatest number of reviews on a path from the user to a recommended anime
+    Representation Invariants:
+        - self.depth >= 3 and self.depth % 2 == 1
+    """
+    depth: int
+
+    def __init__(self, depth: int = 5) -> None:
+        """Initialize an engine that recommends anime up to depth reviews away"""
+        self.depth = depth
+
+    def get_path_scores(self, graph: ReccomenderGraph, user: aau.User) -> Iterator[tuple[aau.Anime, float]]:
+        """Yield every anime recommended to user in graph with its score, nearest anime first. The anime at each
+        distance are scored as soon as that distance has been searched.
+        Preconditions:
+            - every review in graph is in graph.review_store, which is not true of the subclasses of ReccomenderGraph
+              that load or share their reviews
+        """
+        store = graph.review_store
+        adjacency = store.get_adjacency()
+        num_categories = len(RATING_CATEGORIES)
+        watched = {store.get_anime_id(anime) for anime in user.favorite_animes.union(set(user.reviews))}
+
+        # the nodes reached at the current distance, with the number of shortest paths to them and the sums of the
+        # ratings on those paths
+        frontier = {store.get_anime_id(anime): [1, [0] * num_categories] for anime in user.reviews}
+        reached_animes = set(frontier)
+        reached_users = {store.get_user_id(user)}
+        for distance in range(2, self.depth + 1):
+            if distance % 2 == 0:
+                offsets, neighbours, rows, reached = (adjacency.anime_offsets, adjacency.anime_users,
+                                                      adjacency.anime_rows, reached_users)
+            else:
+                offsets, neighbours, rows, reached = (adjacency.user_offsets, adjacency.user_animes,
+                                                      adjacency.user_rows, reached_animes)
+            next_frontier = {}
+            for node, (count, sums) in frontier.items():
+                for position in range(offsets[node], offsets[node + 1]):
+                    neighbour = neighbours[position]
+                    if neighbour in reached:
+                        continue
+                    if neighbour not in next_frontier:
+                        next_frontier[neighbour] = [0, [0] * num_categories]
+                    entry = next_frontier[neighbour]
+                    entry[0] += count
+                    ratings = store.get_ratings(rows[position])
+                    entry_sums = entry[1]
+                    for column in range(num_categories):
+                        entry_sums[column] += sums[column] + count * ratings[column]
+            reached.update(next_frontier)
+            frontier = next_frontier
+
+            if distance % 2 == 1:
+                anime_ids = [anime_id for anime_id in frontier if anime_id not in watched]
+                sim_ratings = user.calculate_similarity_ratings(store.get_catalogue(), anime_ids)
+                for anime_id, sim_rating in zip(anime_ids, sim_ratings):
+                    count, sums = frontier[anime_id]
+                    anime = store.anime_nodes[anime_id]
+                    mean_sums = [total / count for total in sums]
+                    yield anime, graph.calculate_rating_sums_score(anime, mean_sums, distance - 1, user, sim_rating)
+
+
+def generate_top_scores(scores: Iterable[tuple[aau.Anime, float]], k: int, deadline: Optional[float] = None,
+                        budget: Optional[int] = None) -> Iterator[list[tuple[aau.Anime, float]]]:
+    """Yield the top k of the scores taken from scores so far, from best to worst, if they got better since the
+    last snapshot, after taking ANYTIME_FIRST_SNAPSHOT scores, then after 3, 7, 15 and so on times as many, and once
+    there are no more. Stop taking scores at deadline, a time.perf_counter() time, or after budget scores. Anime with
+    equal scores keep the order they were taken in.
+
+    >>> list(generate_top_scores(iter([('a', 1.0), ('b', 3.0), ('c', 2.0), ('d', 3.0)]), 2, budget=3))
+    [[('b', 3.0), ('c', 2.0)]]
+    """
+    heap = []
+    changed = False
+    count = 0
+    next_snapshot = ANYTIME_FIRST_SNAPSHOT
+    for anime, score in scores:
+        count += 1
+        # The negated count keeps earlier anime ahead of later ones with equal scores, and stops anime being compared
+        if len(heap) < k:
+            heapq.heappush(heap, (score, -count, anime))
+            changed = True
+        elif k > 0 and (score, -count) > heap[0][:2]:
+            heapq.heapreplace(heap, (score, -count, anime))
+            changed = True
+
+        out_of_budget = is_out_of_budget(count, deadline, budget)
+        if changed and (count >= next_snapshot or out_of_budget):
+            yield [(item[2], item[0]) for item in sorted(heap, reverse=True)]
+            changed = False
+        if count >= next_snapshot:
+            next_snapshot = 2 * next_snapshot + ANYTIME_FIRST_SNAPSHOT
+        if out_of_budget:
+            return
+    if changed:
+        yield [(item[2], item[0]) for item in sorted(heap, reverse=True)]
+
+
+def is_out_of_budget(explored: int, deadline: Optional[float], budget: Optional[int]) -> bool:
+    """Return whether a search that has explored explored paths should stop, because it is past deadline, a
+    time.perf_counter() time, or has explored budget paths. Either can be None for no limit.
+
+    >>> is_out_of_budget(10, None, 10), is_out_of_budget(9, None, 10), is_out_of_budget(0, 0.0, None)
+    (True, False, True)
+    """
+    return (budget is not None and explored >= budget) or (deadline is not None and time.perf_counter() >= deadline)
+
+
+def group_rows(keys: array.array, num_keys: int) -> tuple[array.array, array.array]:
+    """Return the offsets and rows of a compressed sparse row grouping of the rows of keys by their key.
+    The rows with key k are rows[offsets[k]:offsets[k + 1]], in increasing order.
+
+    >>> offsets, rows = group_rows(array.array('i', [1, 0, 1, 2]), 3)
+    >>> list(offsets), list(rows)
+    ([0, 1, 3, 4], [1, 0, 2, 3])
+    """
+    counts = collections.Counter(keys)
+    offsets = array.array('i', itertools.accumulate((counts[key] for key in range(num_keys)), initial=0))
+    # sorted is stable, so each key's rows stay in increasing order
+    return offsets, array.array('i', sorted(range(len(keys)), key=keys.__getitem__))
+
+
 def tag_keywords_and_strip(query: str) -> set[str]:
     """Takes a query for an anime and simplfies it into its keywords, with only
     alphanumeric characters and all lowercase
@@ -176,7 +1050,8 @@ def search(query: str, graph: ReccomenderGraph) -> dict[str, aau.Anime]:
     return search_res_dict
 
 
-def read_file(files: list[str]) -> ReccomenderGraph:
+def read_file(files: list[str], snapshot_file: Optional[str] = SNAPSHOT_FILE,
+              workers: Optional[int] = None) -> ReccomenderGraph:
     """Creates a ReccomenderGraph given the animes. profiles, and reviews formatted in a CSV file in the format:
     Reviews:
         index 0 is uid, 1 is anime id, 2 is overall rating, and then the rest are the ratings for each category
@@ -186,64 +1061,290 @@ def read_file(files: list[str]) -> ReccomenderGraph:
     Anime:
         index 1 is id, index 2 is title, next idxs are genres until dates,
         start dates first index after, end date second index after, last index is number of episodes
+
+    Each file can be a plain CSV file, a gzip or xz compressed CSV file, or a member of a zip archive written as
+    'database.zip/anime_formatted_no_duplicates.csv'. Compressed files are decompressed as they are read.
+
+    The parsed rows, with the reviews already in the columns of the graph's review store, are cached in snapshot_file
+    together with the sha256 hash of every file. Later calls load the snapshot instead of parsing the CSV files
+    again, as long as none of the files have changed. If snapshot_file is None, the CSV files are always parsed and
+    no snapshot is written.
+
+    If workers is greater than 1, the reviews file is split into chunks that are parsed by that many processes.
     Preconditions:
             - files are formatted correctly in the specified format
             - files[0] is the anime file, files[1] is the user file, files[2] is the reviews file
     """
-    graph = ReccomenderGraph()
-    with open(files[0], 'r',
-              encoding="utf-8") as reader:
-        line = reader.readline()
+    if snapshot_file is None:
+        return build_graph(parse_files(files, workers))
+
+    digests = [hash_file(file) for file in files]
+    rows = load_snapshot(snapshot_file, digests)
+    if rows is None:
+        rows = parse_files(files, workers)
+        write_snapshot(snapshot_file, digests, rows)
+    return build_graph(rows)
+
+
+def parse_files(files: list[str], workers: Optional[int] = None) -> GraphRows:
+    """Parse the anime, profile and review CSV files into the rows used by build_graph.
+    Anime rows are (uid, title, genres, start date ordinal, end date ordinal, number of episodes), user rows are
+    (username, favorite anime uids) and the reviews are stored column by column as (usernames, anime uids, ratings),
+    where ratings holds len(RATING_CATEGORIES) values per review in the order of RATING_CATEGORIES, and then turned
+    into the columns of a review store by index_review_columns.
+    If workers is greater than 1 and the reviews file is a plain file, it is parsed with parse_reviews_parallel.
+    Preconditions:
+            - files are formatted correctly in the format specified in read_file
+    """
+    with dataset_files.open_text(files[0]) as reader:
+        animes = [parse_anime_line(line) for line in reader]
 
-        while line != '':
-            lines = line.split(',')
-            anime_id = lines[0]
-            title = lines[1]
-            genres = set()
-            i = 2
-            while all(char.isalpha() for char in lines[i]):
-                genres.add(lines[i])
-                i += 1
-
-            start_date = datetime.datetime.strptime(lines[i], '%m/%d/%Y').date()
-            end_date = datetime.datetime.strptime(lines[i + 1], '%m/%d/%Y').date()
-            num_episodes = int(lines[i + 2])
-            graph.insert_anime(aau.Anime(title, num_episodes, genres, (start_date, end_date), int(anime_id)))
-            line = reader.readline()
+    with dataset_files.open_text(files[1]) as reader:
+        users = [parse_profile_line(line) for line in reader]
 
-    with open(files[1], 'r',
-              encoding="utf-8") as reader:
-        line = reader.readline()
+    if workers is not None and workers > 1 and dataset_files.is_plain_file(files[2]):
+        reviews = parse_reviews_parallel(files[2], workers)
+    else:
+        with dataset_files.open_text(files[2]) as reader:
+            reviews = parse_review_lines(reader)
 
-        while line != '':
-            lines = line.split(',')
-            if lines[0][-1] == '\n':
-                username = lines[0][0:len(lines[0]) - 1]
-            else:
-                username = lines[0]
-            favorite_animes = set()
-            for i in range(1, len(lines)):
-                favorite_animes.add(graph.animes[int(lines[i])])
+    return animes, users, index_review_columns(animes, users, reviews)
 
-            graph.insert_user(aau.User(username=username, fav_animes=favorite_animes))
-            line = reader.readline()
 
-    with open(files[2], 'r',
-              encoding="utf-8") as reader:
-        line = reader.readline()
+def parse_anime_line(line: str) -> AnimeRow:
+    """Parse one line of the anime CSV file into the anime row described in parse_files.
+    Preconditions:
+            - line is formatted correctly in the format specified in read_file
+    """
+    lines = line.split(',')
+    anime_id = lines[0]
+    title = lines[1]
+    genres = []
+    i = 2
+    while all(char.isalpha() for char in lines[i]):
+        genres.append(lines[i])
+        i += 1
+
+    start_date = datetime.datetime.strptime(lines[i], '%m/%d/%Y').date()
+    end_date = datetime.datetime.strptime(lines[i + 1], '%m/%d/%Y').date()
+    num_episodes = int(lines[i + 2])
+    return int(anime_id), title, tuple(genres), start_date.toordinal(), end_date.toordinal(), num_episodes
+
+
+def parse_profile_line(line: str) -> UserRow:
+    """Parse one line of the profiles CSV file into the user row described in parse_files.
+    Preconditions:
+            - line is formatted correctly in the format specified in read_file
+    """
+    lines = line.split(',')
+    if lines[0][-1] == '\n':
+        username = lines[0][0:len(lines[0]) - 1]
+    else:
+        username = lines[0]
+    return username, tuple(int(lines[i]) for i in range(1, len(lines)))
+
+
+def parse_review_lines(lines: Iterable[str]) -> ReviewColumns:
+    """Parse lines of the reviews CSV file into the (usernames, anime uids, ratings) columns described in
+    parse_files.
+    Preconditions:
+            - every line is formatted correctly in the format specified in read_file
+    """
+    usernames = []
+    anime_ids = array.array('i')
+    ratings = array.array('b')
+    for line in lines:
+        username, anime_id, review_ratings = parse_review_line(line)
+        usernames.append(username)
+        anime_ids.append(anime_id)
+        ratings.extend(review_ratings)
+
+    return usernames, anime_ids, ratings
 
-        while line != '':
-            lines = line.split(',')
-            user = graph.users[lines[0]]
-            anime = graph.animes[int(lines[1])]
-            ratings = {'story': int(lines[4]), 'animation': int(lines[5]), 'sound': int(lines[6]),
-                       'character': int(lines[7]), 'overall': int(lines[3]), 'enjoyment': int(lines[8])}
-            Review(user, anime, ratings)
-            line = reader.readline()
+
+def parse_review_line(line: str) -> tuple[str, int, tuple[int, ...]]:
+    """Parse one line of the reviews CSV file into its username, anime uid and ratings in the order of
+    RATING_CATEGORIES.
+    Preconditions:
+            - line is formatted correctly in the format specified in read_file
+    """
+    row = line.split(',')
+    # the file stores overall before story, animation, sound, character and enjoyment
+    return row[0], int(row[1]), (int(row[4]), int(row[5]), int(row[6]), int(row[7]), int(row[8]), int(row[3]))
+
+
+def parse_review_chunk(file: str, start: int, end: int) -> ReviewColumns:
+    """Parse the lines of the reviews CSV file that lie between the byte offsets start and end.
+    This is run in the worker processes of parse_reviews_parallel.
+    Preconditions:
+            - start and end are both 0, the size of file, or the offset of the first byte of a line
+    """
+    with open(file, 'rb') as reader:
+        reader.seek(start)
+        lines = reader.read(end - start).decode('utf-8').split('\n')
+    if lines[-1] == '':
+        lines.pop()
+    return parse_review_lines(lines)
+
+
+def find_chunk_offsets(file: str, num_chunks: int) -> list[int]:
+    """Split file into at most num_chunks pieces of about the same size that each end on a line boundary, and
+    return the byte offsets where the pieces start followed by the size of file.
+    """
+    size = os.path.getsize(file)
+    offsets = [0]
+    with open(file, 'rb') as reader:
+        for i in range(1, num_chunks):
+            reader.seek(max(size * i // num_chunks, offsets[-1]))
+            reader.readline()
+            if reader.tell() >= size:
+                break
+            if reader.tell() > offsets[-1]:
+                offsets.append(reader.tell())
+    offsets.append(size)
+    return offsets
+
+
+def parse_reviews_parallel(file: str, workers: int) -> ReviewColumns:
+    """Parse the reviews CSV file with a pool of workers processes and return the same columns as parse_review_lines.
+    The file is split on line boundaries into chunks of about REVIEW_CHUNK_BYTES (and at least one chunk per
+    worker), each worker parses whole chunks, and the chunk columns are concatenated in file order.
+    Preconditions:
+            - file is a plain, uncompressed file
+            - workers > 1
+    """
+    num_chunks = max(workers, os.path.getsize(file) // REVIEW_CHUNK_BYTES + 1)
+    offsets = find_chunk_offsets(file, num_chunks)
+    usernames = []
+    anime_ids = array.array('i')
+    ratings = array.array('b')
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        chunks = executor.map(parse_review_chunk, itertools.repeat(file), offsets[:-1], offsets[1:])
+        for chunk_usernames, chunk_anime_ids, chunk_ratings in chunks:
+            usernames.extend(chunk_usernames)
+            anime_ids.extend(chunk_anime_ids)
+            ratings.extend(chunk_ratings)
+
+    return usernames, anime_ids, ratings
+
+
+def index_review_columns(animes: list[AnimeRow], users: list[UserRow], reviews: ReviewColumns) -> StoreColumns:
+    """Return the (usernames, anime uids, ratings) columns of reviews as (user rows, anime rows, ratings) columns,
+    where each review's user and anime are the indexes of their rows in users and animes, which are their dense ids
+    in the review store of the graph build_graph builds. Like the graph, a username or uid that appears in more than
+    one row refers to the last of them, and a user who reviewed an anime more than once keeps the place of their
+    first review with the ratings of their last.
+
+    >>> animes = [(5, 'A', (), 0, 0, 1), (7, 'B', (), 0, 0, 1)]
+    >>> reviews = (['amy', 'bo', 'amy'], array.array('i', [7, 7, 7]), array.array('b', range(18)))
+    >>> review_users, review_animes, ratings = index_review_columns(animes, [('amy', ()), ('bo', ())], reviews)
+    >>> list(review_users), list(review_animes), list(ratings)
+    ([0, 1], [1, 1], [12, 13, 14, 15, 16, 17, 6, 7, 8, 9, 10, 11])
+    """
+    usernames, anime_uids, ratings = reviews
+    user_rows = {row[0]: i for i, row in enumerate(users)}
+    anime_rows = {row[0]: i for i, row in enumerate(animes)}
+    review_users = array.array('i', map(user_rows.__getitem__, usernames))
+    review_animes = array.array('i', map(anime_rows.__getitem__, anime_uids))
+    last_reviews = dict(zip(zip(review_users, review_animes), range(len(review_users))))
+    if len(last_reviews) == len(review_users):
+        return review_users, review_animes, ratings
+
+    num_categories = len(RATING_CATEGORIES)
+    kept_users, kept_animes, kept_ratings = array.array('i'), array.array('i'), array.array('b')
+    kept = set()
+    for pair in zip(review_users, review_animes):
+        if pair not in kept:
+            kept.add(pair)
+            kept_users.append(pair[0])
+            kept_animes.append(pair[1])
+            last = last_reviews[pair]
+            kept_ratings.extend(ratings[last * num_categories:(last + 1) * num_categories])
+    return kept_users, kept_animes, kept_ratings
+
+
+def build_graph(rows: GraphRows) -> ReccomenderGraph:
+    """Creates a ReccomenderGraph from the rows returned by parse_files.
+    Preconditions:
+            - rows was returned by parse_files (or loaded from a snapshot of it)
+    """
+    graph = ReccomenderGraph()
+    animes, users, reviews = rows
+    # Every object created here lives as long as the graph, so the cyclic garbage collector would only rescan the
+    # growing graph over and over while it is loaded
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for uid, title, genres, start, end, num_episodes in animes:
+            air_dates = (datetime.date.fromordinal(start), datetime.date.fromordinal(end))
+            graph.insert_anime(aau.Anime(title, num_episodes, set(genres), air_dates, uid))
+
+        for username, favorite_uids in users:
+            graph.insert_user(aau.User(username=username, fav_animes=graph.get_favorite_animes(favorite_uids)))
+
+        # The graph is empty, so the dense ids of the anime and users are the indexes of their rows
+        review_users, review_animes, ratings = reviews
+        store = graph.review_store
+        start = store.extend(review_users, review_animes, ratings)
+        for index, user, anime in zip(itertools.count(start), map(store.user_nodes.__getitem__, review_users),
+                                      map(store.anime_nodes.__getitem__, review_animes)):
+            Review(user, anime, None, index)
+    finally:
+        if gc_was_enabled:
+            gc.enable()
 
     return graph
 
 
+def hash_file(file: str) -> str:
+    """Return the sha256 hex digest of the decompressed contents of file, read in chunks so large files are not held in
+    memory. file can be any path accepted by dataset_files.open_binary.
+    """
+    digest = hashlib.sha256()
+    with dataset_files.open_binary(file) as reader:
+        chunk = reader.read(1 << 20)
+        while chunk != b'':
+            digest.update(chunk)
+            chunk = reader.read(1 << 20)
+    return digest.hexdigest()
+
+
+def load_snapshot(snapshot_file: str, digests: list[str]) -> Optional[GraphRows]:
+    """Return the rows stored in snapshot_file, or None if there is no usable snapshot.
+    A snapshot is only usable if it was written with the current SNAPSHOT_VERSION from files whose hashes are
+    digests. Missing, stale, truncated or otherwise unreadable snapshots all return None.
+    """
+    try:
+        with open(snapshot_file, 'rb') as reader:
+            header = pickle.load(reader)
+            if header != (SNAPSHOT_VERSION, digests):
+                return None
+            return pickle.load(reader)
+    except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ValueError, TypeError):
+        return None
+
+
+def write_snapshot(snapshot_file: str, digests: list[str], rows: GraphRows) -> None:
+    """Write rows to snapshot_file, keyed by SNAPSHOT_VERSION and the digests of the files they were parsed from.
+    The snapshot is written to a temporary file that then replaces snapshot_file, so a crash or a concurrent reader
+    never sees a half-written snapshot. Failing to write the snapshot is not an error, the next read_file call just
+    parses the CSV files again.
+    """
+    directory = os.path.dirname(os.path.abspath(snapshot_file))
+    try:
+        descriptor, temp_file = tempfile.mkstemp(suffix='.tmp', dir=directory)
+    except OSError:
+        return
+    try:
+        with os.fdopen(descriptor, 'wb') as writer:
+            pickle.dump((SNAPSHOT_VERSION, digests), writer, protocol=pickle.HIGHEST_PROTOCOL)
+            pickle.dump(rows, writer, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_file, snapshot_file)
+    except OSError:
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+
+
 def import_profile(file: str, graph: ReccomenderGraph) -> aau.User:
     """loads a user from a csv file and adds them into the graph
     Preconditions:
@@ -360,27 +1461,44 @@ def save_profile(user: aau.User, file_name: str) -> None:
     Preconditions:
         - user is a valid User object
     """
-    with open(file_name, 'w', encoding='utf-8') as writer:
-        writer.write(f"{user.username},\n")
-
-        for anime in user.favorite_animes:
-            writer.write(f"{str(anime.get_uid())},")
-        writer.write('\n')
-
-        for friend in user.friends_list:
-            writer.write(f"{friend.username},")
-        writer.write('\n')
-
-        writer.write(f"{user.favorite_era[0].month}/{user.favorite_era[0].day}/{user.favorite_era[0].year},")
-        writer.write(f"{user.favorite_era[1].month}/{user.favorite_era[1].day}/{user.favorite_era[1].year},\n")
+    write_profile(format_profile(user), file_name)
 
-        writer.write(f"{user.priorities['story']},{user.priorities['animation']},{user.priorities['sound']},"
-                     f"{user.priorities['character']}\n")
 
-        for review in user.reviews:
-            rating = user.reviews[review].ratings
-            writer.write(f"{review.get_uid()},{rating['story']},{rating['animation']},{rating['sound']},"
-                         f"{rating['character']},{rating['enjoyment']},{rating['overall']}\n")
+def format_profile(user: aau.User) -> str:
+    """Return the contents of the csv file that save_profile saves the user's profile into.
+    Formatting the profile on its own lets it be written to disk later, or from another thread, without reading the
+    user while they are being changed.
+    Preconditions:
+        - user is a valid User object
+    """
+    lines = [f"{user.username},\n",
+             ''.join(f"{str(anime.get_uid())}," for anime in user.favorite_animes) + '\n',
+             ''.join(f"{friend.username}," for friend in user.friends_list) + '\n',
+             f"{user.favorite_era[0].month}/{user.favorite_era[0].day}/{user.favorite_era[0].year},"
+             f"{user.favorite_era[1].month}/{user.favorite_era[1].day}/{user.favorite_era[1].year},\n",
+             f"{user.priorities['story']},{user.priorities['animation']},{user.priorities['sound']},"
+             f"{user.priorities['character']}\n"]
+
+    for review in user.reviews:
+        rating = user.reviews[review].ratings
+        lines.append(f"{review.get_uid()},{rating['story']},{rating['animation']},{rating['sound']},"
+                     f"{rating['character']},{rating['enjoyment']},{rating['overall']}\n")
+    return ''.join(lines)
+
+
+def write_profile(contents: str, file_name: str) -> None:
+    """Write a profile returned by format_profile into a csv file, replacing it in one step so that the file never
+    holds half of a profile.
+    """
+    descriptor, temp_file = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(os.path.abspath(file_name)))
+    try:
+        with os.fdopen(descriptor, 'w', encoding='utf-8') as writer:
+            writer.write(contents)
+        os.replace(temp_file, file_name)
+    except OSError:
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+        raise
 
 
 if __name__ == '__main__':
@@ -388,8 +1506,12 @@ if __name__ == '__main__':
 
     doctest.testmod(verbose=True)
     python_ta.check_all(config={
-        'extra-imports': ['anime_and_users', 'datetime', 're'],
-        'allowed-io': ['import_profile', 'save_profile', 'read_file', 'search', 'import_profile_to_user'],
+        'extra-imports': ['anime_and_users', 'dataset_files', 'abc', 'array', 'bisect', 'collections',
+                          'concurrent.futures', 'datetime', 'gc', 'hashlib', 'heapq', 'itertools', 'math', 'os',
+                          'pickle', 're', 'tempfile', 'threading', 'time', 'typing'],
+        'allowed-io': ['import_profile', 'write_profile', 'read_file', 'search', 'import_profile_to_user',
+                       'parse_files', 'hash_file', 'load_snapshot', 'write_snapshot', 'parse_review_chunk',
+                       'find_chunk_offsets'],
         'disable': ['too-many-nested-blocks', 'too-many-locals'],
         'max-line-length': 120
     })
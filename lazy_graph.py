@@ -0,0 +1,372 @@
+"""
+CSC111 Project: Lazily loaded ReccomenderGraph
+
+This module contains a ReccomenderGraph that only loads its animes up front. Users and their reviews are read from
+the profiles and reviews files the first time they are needed, using a byte offset index over those files, and the
+least recently used users are unloaded again once too many of them are in memory.
+
+This file is Copyright (c) 2023 Hai Shi, Liam Alexander Maguire, Amelia Wu, and Sanya Chawla.
+"""
+from __future__ import annotations
+import array
+import collections
+import datetime
+from typing import Iterator, Optional, Sequence
+
+import python_ta
+
+import anime_and_users as aau
+import graph as g
+
+LAZY_INDEX_FILE = 'lazy_index.pickle'
+DEFAULT_MAX_RESIDENT_USERS = 5000
+
+# (profile line offsets by username, review line offsets by username, review line offsets by anime uid,
+#  (number of reviews, rating sums in the order of g.RATING_CATEGORIES) by anime uid)
+OffsetIndex = tuple[dict[str, int], dict[str, array.array], dict[int, array.array],
+                    dict[int, tuple[int, tuple[int, ...]]]]
+
+
+class LazyAnime(aau.Anime):
+    """An anime node of a LazyReccomenderGraph, whose reviews are loaded the first time they are used.
+
+    Instance Attributes
+    - is_complete: whether every user who reviewed this anime is loaded, so that reviews holds all of its reviews
+    """
+    __slots__ = ('_graph', 'is_complete')
+    _graph: LazyReccomenderGraph
+    is_complete: bool
+
+    def __init__(self, graph: LazyReccomenderGraph, title: str, num_episodes: int, genres: set[str],
+                 air_dates: tuple[datetime.date, datetime.date], uid: int) -> None:
+        """Initialize a new anime of graph that has none of its reviews loaded yet"""
+        self._graph = graph
+        self.is_complete = False
+        super().__init__(title, num_episodes, genres, air_dates, uid)
+
+    @property
+    def reviews(self) -> dict[aau.User, g.Review]:
+        """The reviews for this anime, loading every user who reviewed it first if they are not all loaded"""
+        if not self.is_complete and not self._graph.is_loading():
+            self._graph.load_anime_reviews(self)
+        return aau.Anime.reviews.__get__(self)
+
+    @reviews.setter
+    def reviews(self, reviews: dict[aau.User, g.Review]) -> None:
+        """Set the reviews for this anime"""
+        aau.Anime.reviews.__set__(self, reviews)
+
+    def get_rating_totals(self) -> tuple[int, Sequence[int]]:
+        """Return the number of reviews of this anime and the sums of their ratings in the order of
+        g.RATING_CATEGORIES.
+        If this anime's reviews are not all loaded, the totals are those of the reviews in the reviews file, read
+        from the graph's offset index, and of the reviews by users who are not in it, and do not load any users.
+        """
+        if self.is_complete:
+            return super().get_rating_totals()
+        extra_rows = [review.get_ratings_row() for user, review in aau.Anime.reviews.__get__(self).items()
+                      if not self._graph.has_profile(user.username)]
+        return self._graph.get_indexed_rating_totals(self.get_uid(), extra_rows)
+
+
+class LazyUserTable(collections.OrderedDict):
+    """The users of a LazyReccomenderGraph by username, ordered from least to most recently used.
+    Looking up a user who is not loaded loads them, and every username in the profiles file is in the table.
+    """
+    _graph: LazyReccomenderGraph
+
+    def __init__(self, graph: LazyReccomenderGraph) -> None:
+        """Initialize an empty user table for graph"""
+        super().__init__()
+        self._graph = graph
+
+    def __missing__(self, username: str) -> aau.User:
+        """Load the user called username, raising KeyError if they are not in the profiles file"""
+        return self._graph.load_user(username)
+
+    def __getitem__(self, username: str) -> aau.User:
+        """Return the user called username, loading them if needed, and mark them as the most recently used"""
+        user = super().__getitem__(username)
+        self.move_to_end(username)
+        return user
+
+    def __contains__(self, username: object) -> bool:
+        """Return whether username is a loaded user or a user in the profiles file"""
+        return super().__contains__(username) or self._graph.has_profile(username)
+
+    def get(self, username: str, default: Optional[aau.User] = None) -> Optional[aau.User]:
+        """Return the user called username, loading them if needed, or default if there is no such user"""
+        try:
+            return self[username]
+        except KeyError:
+            return default
+
+    def is_loaded(self, username: str) -> bool:
+        """Return whether the user called username is currently loaded"""
+        return super().__contains__(username)
+
+
+class LazyReccomenderGraph(g.ReccomenderGraph):
+    """A ReccomenderGraph that loads its users and reviews on demand.
+
+    Every anime is loaded when the graph is created. A user is loaded with all of their reviews the first time they
+    are looked up in users, and an anime's reviews are loaded the first time they are used. Once more than
+    max_resident_users users read from the profiles file are loaded, the least recently used one is unloaded. Users
+    added with insert_user are never unloaded. Reviews that are changed on a user read from the profiles file are kept
+    when the user is unloaded, but changes to their favorite animes or friends are not.
+
+    Iterating over users only gives the users that are currently loaded. This graph is not safe to use from more
+    than one thread at a time.
+
+    Instance Attributes
+    - max_resident_users: the most users read from the profiles file that are kept loaded at the same time
+    """
+    users: LazyUserTable
+    max_resident_users: int
+    _profiles_file: str
+    _reviews_file: str
+    _index: OffsetIndex
+    _pinned: set[str]
+    _user_rows: dict[str, tuple[int, array.array]]
+    _loading: int
+
+    def __init__(self, files: list[str], max_resident_users: int = DEFAULT_MAX_RESIDENT_USERS,
+                 index_file: Optional[str] = LAZY_INDEX_FILE) -> None:
+        """Load the animes in files[0] and index the profiles and reviews in files[1] and files[2].
+        The offset index is cached in index_file the same way that read_file caches its snapshot, unless index_file
+        is None.
+        Preconditions:
+            - files are formatted correctly in the format specified in g.read_file
+            - files[1] and files[2] are plain, uncompressed files
+            - max_resident_users > 0
+        """
+        super().__init__()
+        self.users = LazyUserTable(self)
+        self.max_resident_users = max_resident_users
+        self._profiles_file = files[1]
+        self._reviews_file = files[2]
+        self._pinned = set()
+        self._user_rows = {}
+        self._loading = 0
+
+        with g.dataset_files.open_text(files[0]) as reader:
+            for line in reader:
+                uid, title, genres, start, end, num_episodes = g.parse_anime_line(line)
+                air_dates = (datetime.date.fromordinal(start), datetime.date.fromordinal(end))
+                self.insert_anime(LazyAnime(self, title, num_episodes, set(genres), air_dates, uid))
+
+        if index_file is None:
+            self._index = build_offset_index(files[1], files[2])
+        else:
+            digests = [g.hash_file(files[1]), g.hash_file(files[2])]
+            index = g.load_snapshot(index_file, digests)
+            if index is None:
+                index = build_offset_index(files[1], files[2])
+                g.write_snapshot(index_file, digests, index)
+            self._index = index
+
+    def insert_user(self, user: aau.User) -> None:
+        """Add a user into the graph. Users added this way are never unloaded.
+        Preconditions:
+            - user is a valid User object
+        """
+        self._pinned.add(user.username)
+        super().insert_user(user)
+
+    def find_first_paths(self, user: aau.User, added_ends: set[aau.Anime], deadline: Optional[float] = None,
+                         path_budget: Optional[int] = None) -> Iterator[list[g.Review]]:
+        """Yield the first path of 3 reviews from user to each anime not in added_ends, in the order that
+        aau.User.get_all_path_scores_helper finds them, adding each anime to added_ends as its path is found, and
+        stopping early at deadline or path_budget like g.ReccomenderGraph.find_first_paths.
+        The review store's adjacency arrays do not follow users being loaded and unloaded, so the paths are found by
+        walking the nodes' reviews dicts instead, which loads the users along them.
+        """
+        explored = 0
+        for first_anime, first_review in user.reviews.items():
+            for second_user, second_review in first_anime.reviews.items():
+                if second_user is user:
+                    continue
+                if g.is_out_of_budget(explored, deadline, path_budget):
+                    return
+                explored += len(second_user.reviews)
+                for end_anime, end_review in second_user.reviews.items():
+                    if end_anime is not first_anime and end_anime not in added_ends:
+                        added_ends.add(end_anime)
+                        yield [first_review, second_review, end_review]
+
+    def is_loading(self) -> bool:
+        """Return whether the graph is in the middle of loading or unloading users"""
+        return self._loading > 0
+
+    def has_profile(self, username: object) -> bool:
+        """Return whether username is in the profiles file"""
+        return username in self._index[0]
+
+    def load_user(self, username: str, unload: bool = True) -> aau.User:
+        """Load the user called username from the profiles file together with all of their reviews and return the
+        new user. If unload is True, the least recently used users are then unloaded if there are too many loaded.
+        Raises KeyError if username is not in the profiles file.
+        Preconditions:
+            - not self.users.is_loaded(username)
+        """
+        profile_offsets, user_review_offsets = self._index[0], self._index[1]
+        if username not in profile_offsets:
+            raise KeyError(username)
+
+        self._loading += 1
+        try:
+            _, favorite_uids = g.parse_profile_line(read_lines(self._profiles_file, [profile_offsets[username]])[0])
+            user = aau.User(username=username, fav_animes=self.get_favorite_animes(favorite_uids))
+            self.users[username] = user
+
+            if username in self._user_rows:
+                # the user was loaded before, so their review rows are still in the review store
+                user_id, rows = self._user_rows[username]
+                self.review_store.bind_user(user_id, user)
+                for index in rows:
+                    g.Review(user, self.review_store.get_anime(index), None, index)
+            elif username in user_review_offsets:
+                for line in read_lines(self._reviews_file, user_review_offsets[username]):
+                    _, anime_id, ratings = g.parse_review_line(line)
+                    g.Review(user, self.animes[anime_id], ratings)
+
+            if unload:
+                self._unload_least_recently_used(set())
+        finally:
+            self._loading -= 1
+        return user
+
+    def load_anime_reviews(self, anime: LazyAnime) -> None:
+        """Load every user who reviewed anime and is not loaded yet, so that anime is complete.
+        Only users who did not review anime are unloaded to make room, so an anime with more reviewers than
+        max_resident_users keeps more users than that loaded until the next user is loaded.
+        """
+        offsets = self._index[2].get(anime.get_uid(), array.array('q'))
+        reviewers = list(dict.fromkeys(line.split(',')[0] for line in read_lines(self._reviews_file, offsets)))
+        for username in reviewers:
+            if not self.users.is_loaded(username):
+                self.load_user(username, unload=False)
+        anime.is_complete = True
+
+        # put the reviews back in the order g.read_file adds them, since the path scores depend on it
+        reviews = aau.Anime.reviews.__get__(anime)
+        ordered = {}
+        for username in reviewers:
+            user = self.users.get(username)
+            ordered[user] = reviews[user]
+        ordered.update(reviews)
+        aau.Anime.reviews.__set__(anime, ordered)
+        self._unload_least_recently_used(set(reviewers))
+
+    def unload_user(self, username: str) -> None:
+        """Unload the user called username, disconnecting them from the animes they reviewed. Their review rows stay in
+        the review store and are reused if the user is loaded again.
+        Preconditions:
+            - self.users.is_loaded(username)
+            - username not in self._pinned
+        """
+        self._loading += 1
+        try:
+            user = collections.OrderedDict.pop(self.users, username)
+            for anime in user.reviews:
+                if anime.reviews.get(user) is user.reviews[anime]:
+                    del anime.reviews[user]
+                anime.is_complete = False
+            if user.reviews != {}:
+                rows = array.array('i', [review.get_index() for review in user.reviews.values()])
+                self._user_rows[username] = (self.review_store.release_user(user), rows)
+        finally:
+            self._loading -= 1
+
+    def get_indexed_rating_totals(self, uid: int,
+                                  extra_rows: Sequence[Sequence[int]] = ()) -> tuple[int, Sequence[int]]:
+        """Return the number of reviews of the anime with the given uid in the reviews file and in extra_rows, and
+        the sums of their ratings in the order of g.RATING_CATEGORIES.
+        """
+        count, sums = self._index[3].get(uid, (0, (0,) * len(g.RATING_CATEGORIES)))
+        for row in extra_rows:
+            count += 1
+            sums = tuple(total + rating for total, rating in zip(sums, row))
+        return count, sums
+
+    def _unload_least_recently_used(self, keep: set[str]) -> None:
+        """Unload the least recently used users read from the profiles file until at most max_resident_users of
+        them are loaded, without unloading any of the users in keep.
+        """
+        excess = len(self.users) - len(self._pinned.intersection(self.users.keys())) - self.max_resident_users
+        oldest = []
+        for username in self.users.keys():
+            if len(oldest) >= excess:
+                break
+            if username not in self._pinned and username not in keep:
+                oldest.append(username)
+        for username in oldest:
+            self.unload_user(username)
+
+
+def read_lines(file: str, offsets: array.array | list[int]) -> list[str]:
+    """Return the lines of file that start at each of the byte offsets in offsets"""
+    lines = []
+    with open(file, 'rb') as reader:
+        for offset in offsets:
+            reader.seek(offset)
+            lines.append(decode_line(reader.readline()))
+    return lines
+
+
+def decode_line(line: bytes) -> str:
+    """Decode a line read from a file opened in binary mode the same way a file opened in text mode would, turning
+    a Windows line ending into a single newline.
+
+    >>> decode_line(b'gorki,30,1\\r\\n')
+    'gorki,30,1\\n'
+    """
+    text = line.decode('utf-8')
+    if text.endswith('\r\n'):
+        return text[:-2] + '\n'
+    return text
+
+
+def build_offset_index(profiles_file: str, reviews_file: str) -> OffsetIndex:
+    """Scan the profiles and reviews files once and return their OffsetIndex.
+    The rating sums only count the last review of a user for an anime, the same review that g.read_file keeps.
+    Preconditions:
+        - profiles_file and reviews_file are formatted correctly in the format specified in g.read_file
+    """
+    profile_offsets = {}
+    with open(profiles_file, 'rb') as reader:
+        offset = 0
+        for line in reader:
+            profile_offsets[g.parse_profile_line(decode_line(line))[0]] = offset
+            offset += len(line)
+
+    user_review_offsets = {}
+    anime_review_offsets = {}
+    latest_ratings = {}
+    with open(reviews_file, 'rb') as reader:
+        offset = 0
+        for line in reader:
+            username, anime_id, ratings = g.parse_review_line(decode_line(line))
+            user_review_offsets.setdefault(username, array.array('q')).append(offset)
+            anime_review_offsets.setdefault(anime_id, array.array('q')).append(offset)
+            latest_ratings[(username, anime_id)] = ratings
+            offset += len(line)
+
+    anime_totals = {}
+    for (_, anime_id), ratings in latest_ratings.items():
+        count, sums = anime_totals.get(anime_id, (0, (0,) * len(g.RATING_CATEGORIES)))
+        anime_totals[anime_id] = (count + 1, tuple(total + rating for total, rating in zip(sums, ratings)))
+
+    return profile_offsets, user_review_offsets, anime_review_offsets, anime_totals
+
+
+if __name__ == '__main__':
+    import doctest
+
+    doctest.testmod(verbose=True)
+    python_ta.check_all(config={
+        'extra-imports': ['anime_and_users', 'graph', 'array', 'collections', 'datetime', 'typing'],
+        'allowed-io': ['read_lines', 'build_offset_index', '__init__'],
+        'disable': ['protected-access'],
+        'max-line-length': 120
+    })
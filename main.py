@@ -6,18 +6,25 @@ This module contains the functions required to run the Reccomendation System.
 This file is Copyright (c) 2023 Hai Shi, Liam Alexander Maguire, Amelia Wu, and Sanya Chawla.
 """
 
+import atexit
 import sys
 import datetime
-from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, Optional
 
 import pygame
 import python_ta
 
 from ui_classes import AnimeSpotlight, RecommendationDisplay, PreferenceMeterDisplay, Button, AirDateFilterDisplay, \
     Text, InputBox2
-from anime_and_users import Anime, User
-from graph import ReccomenderGraph, read_file, save_profile, import_profile, import_profile_to_user, Review
+from anime_and_users import Anime, User, DEFAULT_PRIORITIES, DEFAULT_FAVORITE_ERA
+from graph import ReccomenderGraph, read_file, save_profile, import_profile, import_profile_to_user, Review, \
+    format_profile, write_profile
 from graph import search
+from dataset_files import DATASET_FILES, find_dataset_file
+from recommendation_cache import RecommendationCache
+from recommendation_worker import RecommendationWorker
+from taste_index import TasteIndex, get_index_digests, load_taste_index, save_taste_index
 
 Coord = int | float
 Colour = tuple[int, int, int]
@@ -26,10 +33,29 @@ Colour = tuple[int, int, int]
 
 game_state = 'main'
 
-rec_graph = read_file(
-    ['anime_formatted_no_duplicates.csv',
-     'profiles_formatted_no_duplicates.csv',
-     'reviews_formatted_no_duplicates.csv'])
+# The dataset is read from the extracted CSV files if there are any, and straight out of database.zip otherwise
+DATASET_PATHS = [find_dataset_file(name) for name in DATASET_FILES]
+
+rec_graph = read_file(DATASET_PATHS)
+
+# Finds the users with the most similar taste to a user for the friend suggestions. It takes a couple of seconds to
+# load, so it is only loaded the first time suggestions are asked for, with the digests it is saved with. Profiles
+# created or rated before then are kept in pending_taste_users and added to it once it is loaded, and it is saved
+# when the program exits if it changed.
+taste_index: Optional[TasteIndex] = None
+taste_index_digests: list[str] = []
+taste_index_changed = False
+pending_taste_users: dict[str, User] = {}
+
+# The latest path and friend recommendations of each user, reused until their preferences, ratings, friends or
+# neighbourhood change
+RECOMMENDATION_CACHE = RecommendationCache()
+
+# Saves profiles one at a time, in the order they are submitted, off of the pygame loop
+PROFILE_WRITER = ThreadPoolExecutor(max_workers=1)
+
+# Works out the recommendations of the recommendation screens off of the pygame loop
+RECOMMENDATION_WORKER = RecommendationWorker()
 
 # Screen Constants
 # 46, 81, 162
@@ -121,6 +147,18 @@ ACCOUNT_BUTTON_TEXT_COLOUR = (0, 0, 0)
 ACCOUNT_BUTTON_BORDER_COLOUR = (255, 255, 255)
 SINGLE_BUTTON_BORDER_RADIUS = 10
 
+# Recommendation Screen Constants
+
+# The recommendation screens redraw at most this many times a second, which leaves the rest of the time to the worker
+RECOMMENDATION_FRAME_RATE = 30
+PROGRESS_MESSAGE = 'Finding recommendations'
+NO_RECOMMENDATIONS_MESSAGE = 'No recommendations found'
+
+# Friend Suggestion Constants
+
+FRIEND_SUGGESTIONS = 3
+FRIEND_SUGGESTION_MESSAGE = 'Finding users with similar taste...'
+
 
 def get_user(username: str) -> None:
     """Sets global user to user login"""
@@ -142,6 +180,7 @@ def add_anime(anime_name: int, ratings: list[int]) -> None:
     user.calculate_genre_match_avg()
 
     save_user_profile(user)
+    update_taste_index(user)
 
 
 #  reviews: dict[Anime, g.Review]
@@ -252,13 +291,60 @@ def create_profile(username: str, fav_animes: set[Anime]):
     user = User(
         username=username,
         fav_animes=fav_animes,
-        favorite_era=(datetime.date(1961, 1, 1), datetime.date(2021, 1, 1)),
+        favorite_era=DEFAULT_FAVORITE_ERA,
         review=None,
         friend_list=[],
-        priority={'story': 1, 'animation': 1, 'sound': 1, 'character': 1}
+        priority=dict(DEFAULT_PRIORITIES)
     )
     filename = f"{username}.csv"
     save_profile(user, filename)
+    update_taste_index(user)
+
+
+def update_taste_index(user: User) -> None:
+    """Add the user to the taste index or update their taste in it, or do so once it is loaded if it is not yet"""
+    global taste_index_changed
+    if taste_index is None:
+        pending_taste_users[user.username] = user
+    else:
+        taste_index.insert_user(user)
+        taste_index_changed = True
+
+
+def get_taste_index() -> TasteIndex:
+    """Return the taste index of the users in rec_graph, loading it and adding the pending users to it the first time.
+    This runs on RECOMMENDATION_WORKER's thread, and the screens that change the taste of users wait for it.
+    """
+    global taste_index, taste_index_digests
+    if taste_index is None:
+        taste_index_digests = get_index_digests(DATASET_PATHS)
+        index = load_taste_index(rec_graph, taste_index_digests)
+        taste_index = index
+        for pending_user in pending_taste_users.values():
+            update_taste_index(pending_user)
+        pending_taste_users.clear()
+    return taste_index
+
+
+def save_changed_taste_index() -> None:
+    """Save the taste index if users were added to it or changed since it was loaded"""
+    if taste_index is not None and taste_index_changed:
+        save_taste_index(taste_index.get_rows(), taste_index_digests)
+
+
+atexit.register(save_changed_taste_index)
+
+
+def find_friend_suggestions(user: User) -> list[tuple[str, float]]:
+    """Return the usernames of the FRIEND_SUGGESTIONS users with the most similar taste to user who are not their
+    friends yet, with their similarity
+    """
+    index = get_taste_index()
+    update_taste_index(user)
+    friends = {friend.username for friend in user.friends_list}
+    similar_users = index.find_similar_users(user, FRIEND_SUGGESTIONS + len(friends))
+    return [(username, similarity) for username, similarity in similar_users if username not in friends][
+        :FRIEND_SUGGESTIONS]
 
 
 def save_user_profile(user: User):
@@ -266,6 +352,51 @@ def save_user_profile(user: User):
     save_profile(user, filename)
 
 
+def save_user_profile_in_background(user: User) -> None:
+    """Save the user's profile on PROFILE_WRITER's thread. The profile is formatted right away, so later changes to
+    the user do not change what is saved."""
+    PROFILE_WRITER.submit(write_profile, format_profile(user), f"{user.username}.csv")
+
+
+def find_path_recommendations(user: User, priority: Optional[dict[str, int]] = None,
+                              favorite_era: Optional[tuple[datetime.date, datetime.date]] = None) \
+        -> Iterator[list[tuple[Anime, float]]]:
+    """Yield better and better path recommendations of user while the graph is searched, after changing their
+    priorities and favorite era and saving their profile if they are given. This runs on RECOMMENDATION_WORKER's
+    thread, so that the preferences are never changed while an earlier request is searching the graph.
+    """
+    if priority is not None:
+        # Update the user already in rec_graph instead of reloading the dataset and re-importing their profile
+        user.update_preferences(priority, favorite_era)
+        save_user_profile_in_background(user)
+    yield from RECOMMENDATION_CACHE.generate_top_path_scores(rec_graph, user)
+
+
+def find_friend_recommendations(user: User) -> list[tuple[Anime, float]]:
+    """Return the friend recommendations of user, from RECOMMENDATION_CACHE if neither they nor their friends have
+    changed since they were last worked out. This runs on RECOMMENDATION_WORKER's thread.
+    """
+    return RECOMMENDATION_CACHE.recommend_from_friend_graph(rec_graph, user)
+
+
+def show_recommendation_progress(recommendation_display: RecommendationDisplay, anime_spotlight: AnimeSpotlight,
+                                 recommendations: dict) -> dict:
+    """Show the recommendations from RECOMMENDATION_WORKER if new ones have just arrived, or the progress message if
+    none have arrived since the request was submitted, and return the recommendation buttons on the display.
+    recommendations is the buttons returned last time, which are empty from when a request is submitted.
+    """
+    rec = RECOMMENDATION_WORKER.poll()
+    if rec is not None:
+        if len(rec) == 0:
+            recommendation_display.show_message(NO_RECOMMENDATIONS_MESSAGE)
+            return {}
+        return recommendation_display.update([anime[0] for anime in rec], anime_spotlight)
+    if RECOMMENDATION_WORKER.is_busy() and len(recommendations) == 0:
+        recommendation_display.show_message(PROGRESS_MESSAGE + '.' * (pygame.time.get_ticks() // 400 % 4))
+        return {}
+    return recommendations
+
+
 def run_reccomendations(screen: pygame.Surface) -> None:
     """Visualize the project"""
     global game_state
@@ -279,15 +410,18 @@ def run_reccomendations(screen: pygame.Surface) -> None:
     # episode_range_filter = draw_episode_range_filter(screen)
     year_filter = draw_year_filter(screen)
 
-    # Import user into graph
-    import_profile(f"{user.username}.csv", rec_graph)
+    # Import user into graph, once, since importing them again would add their reviews to the graph again
+    if user.username not in rec_graph.users:
+        import_profile(f"{user.username}.csv", rec_graph)
 
-    rec = rec_graph.get_all_path_scores(user)
-    rec_anime = [anime[0] for anime in rec]
-    recommendations = recommendation_display.update(rec_anime, anime_spotlight)
+    RECOMMENDATION_WORKER.submit_progressive(find_path_recommendations, user)
+    recommendations = {}
+    clock = pygame.time.Clock()
 
     while True:
+        recommendations = show_recommendation_progress(recommendation_display, anime_spotlight, recommendations)
         pygame.display.flip()
+        clock.tick(RECOMMENDATION_FRAME_RATE)
         events = pygame.event.get()
         mouse_pos = pygame.mouse.get_pos()
         is_clicking = any(e.type == pygame.MOUSEBUTTONDOWN for e in events)
@@ -308,21 +442,13 @@ def run_reccomendations(screen: pygame.Surface) -> None:
                 year_filter.input_box_start.update_activity()
             if year_filter.input_box_end.is_active:
                 year_filter.input_box_end.update_activity()
-            new_rec_graph = read_file([
-                'anime_formatted_no_duplicates.csv',
-                'profiles_formatted_no_duplicates.csv',
-                'reviews_formatted_no_duplicates.csv'])
             d1 = datetime.date(year_filter.get_year_range()[0], 1, 1)
             d2 = datetime.date(year_filter.get_year_range()[1], 1, 1)
             date_range = (d1, d2)
-            user.favorite_era = date_range
             prio = preference_display.get_preferences()
-            user.priorities = prio
-            save_profile(user, f"{user.username}.csv")
-            import_profile(f"{user.username}.csv", new_rec_graph)
-            rec = new_rec_graph.get_all_path_scores(user)
-            rec_anime = [anime[0] for anime in rec]
-            recommendations = recommendation_display.update(rec_anime, anime_spotlight)
+            # Supersedes the request still being worked out, if there is one
+            RECOMMENDATION_WORKER.submit_progressive(find_path_recommendations, user, prio, date_range)
+            recommendations = {}
 
         # Account button
         if account_button.update_colour(mouse_pos):
@@ -386,6 +512,8 @@ def run_reccomendations(screen: pygame.Surface) -> None:
             sys.exit()
 
         if game_state != 'get_rec':
+            # Other screens change the graph, so they wait for any search of it still running
+            RECOMMENDATION_WORKER.cancel(wait=True)
             break
 
 
@@ -399,24 +527,26 @@ def run_recommendations_based_on_friends(screen: pygame.Surface) -> None:
     recommendation_display = draw_recommendation_display(screen)
     generate_button = recommendation_display.generate_button
 
-    # Import user into graph
-    import_profile(f"{user.username}.csv", rec_graph)
+    # Import user into graph, once, since importing them again would add their reviews to the graph again
+    if user.username not in rec_graph.users:
+        import_profile(f"{user.username}.csv", rec_graph)
 
-    rec = user.reccomend_based_on_friends()
-    rec_anime = [anime[0] for anime in rec]
-    recommendations = recommendation_display.update(rec_anime, anime_spotlight)
+    RECOMMENDATION_WORKER.submit(find_friend_recommendations, user)
+    recommendations = {}
+    clock = pygame.time.Clock()
 
     while True:
+        recommendations = show_recommendation_progress(recommendation_display, anime_spotlight, recommendations)
         pygame.display.flip()
+        clock.tick(RECOMMENDATION_FRAME_RATE)
         events = pygame.event.get()
         mouse_pos = pygame.mouse.get_pos()
         is_clicking = any(event.type == pygame.MOUSEBUTTONDOWN for event in events)
 
         generate_button.update_colour(mouse_pos)
         if generate_button.is_clicked(is_clicking, mouse_pos):
-            rec = user.reccomend_based_on_friends()
-            rec_anime = [anime[0] for anime in rec]
-            recommendations = recommendation_display.update(rec_anime, anime_spotlight)
+            RECOMMENDATION_WORKER.submit(find_friend_recommendations, user)
+            recommendations = {}
 
         # Account button
         if account_button.update_colour(mouse_pos):
@@ -439,6 +569,7 @@ def run_recommendations_based_on_friends(screen: pygame.Surface) -> None:
             sys.exit()
 
         if game_state != 'get_rec_friends':
+            RECOMMENDATION_WORKER.cancel(wait=True)
             break
 
 
@@ -568,9 +699,14 @@ def run_add_friends(screen: pygame.Surface):
                             (255, 255, 255))
     add_friend_btn.draw()
     account_button = draw_account_button(screen)
+    Text(screen, 30, "Suggested friends:", 60, 430).draw()
+    suggestion_btns = []
+    RECOMMENDATION_WORKER.submit(find_friend_suggestions, user)
 
+    clock = pygame.time.Clock()
     while True:
         pygame.display.flip()
+        clock.tick(RECOMMENDATION_FRAME_RATE)
         events = pygame.event.get()
         mouse_pos = pygame.mouse.get_pos()
         is_clicking = any(e.type == pygame.MOUSEBUTTONDOWN for e in events)
@@ -581,6 +717,25 @@ def run_add_friends(screen: pygame.Surface):
         pygame.draw.rect(screen, (255, 255, 255), (175, 295, 400, 32))
         username_btn.draw(screen)
 
+        suggestions = RECOMMENDATION_WORKER.poll()
+        if suggestions is not None:
+            pygame.draw.rect(screen, (255, 255, 255), (60, 465, 400, 40 * FRIEND_SUGGESTIONS))
+            suggestion_btns = [(Button(screen, 35, 400, (60, 470 + 40 * i), f'{username} ({similarity:.0%} similar)',
+                                       (51, 51, 51), SECTION_TITLE_COLOUR, (255, 255, 255)), username)
+                               for i, (username, similarity) in enumerate(suggestions)]
+            for suggestion_btn, _ in suggestion_btns:
+                suggestion_btn.draw()
+            if len(suggestions) == 0:
+                Text(screen, 24, "No suggestions found", 60, 470).draw()
+        elif RECOMMENDATION_WORKER.is_busy():
+            pygame.draw.rect(screen, (255, 255, 255), (60, 465, 400, 40))
+            Text(screen, 24, FRIEND_SUGGESTION_MESSAGE, 60, 470).draw()
+
+        for suggestion_btn, username in suggestion_btns:
+            suggestion_btn.update_colour(mouse_pos)
+            if suggestion_btn.is_clicked(is_clicking, mouse_pos):
+                username_btn.set_text(username)
+
         add_friend_btn.update_colour(mouse_pos)
         if add_friend_btn.is_clicked(is_clicking, mouse_pos):
             friend_username = username_btn.text
@@ -612,6 +767,7 @@ def run_add_friends(screen: pygame.Surface):
             sys.exit()
 
         if game_state != 'add_friends':
+            RECOMMENDATION_WORKER.cancel(wait=True)
             break
 
 
@@ -855,7 +1011,9 @@ if __name__ == "__main__":
 
     doctest.testmod(verbose=True)
     python_ta.check_all(config={
-        'extra-imports': ['pygame', 'sys', 'ui_classes', 'anime_and_users', 'graph', 'datetime', 'typing'],
+        'extra-imports': ['atexit', 'pygame', 'sys', 'ui_classes', 'anime_and_users', 'graph', 'dataset_files',
+                          'datetime', 'recommendation_cache', 'recommendation_worker', 'taste_index',
+                          'concurrent.futures', 'typing'],
         'allowed-io': ['import_profile', 'save_profile'],
         'disable': ['E1101', 'E9992', 'E9997', 'too-many-locals', 'possibly-undefined', 'too-many-nested-blocks',
                     'too-many-branches', 'too-many-statements', 'C0103', 'C0116', 'E9970', 'E9971', 'E9928', 'W0621',
@@ -0,0 +1,147 @@
+"""
+CSC111 Project: Memory mapped ReccomenderGraph files
+
+This module contains the functions for saving the read-only core of a ReccomenderGraph as a directory of
+fixed-width array files, and for opening such a directory again by mapping each file into memory read-only. Only
+the pages of the files that are actually used are read from disk, every process that opens the same directory
+shares them through the operating system's page cache, and a graph does not need to fit in memory to be queried.
+
+This file is Copyright (c) 2023 Hai Shi, Liam Alexander Maguire, Amelia Wu, and Sanya Chawla.
+"""
+from __future__ import annotations
+import array
+import json
+import mmap
+import os
+import shutil
+import sys
+import tempfile
+
+import python_ta
+
+import graph as g
+import shared_graph as sg
+
+# Increased whenever the layout of the files in a mapped graph directory changes
+MAPPED_FORMAT_VERSION = 1
+MAPPED_GRAPH_DIRECTORY = 'graph_mapped'
+MANIFEST_FILE = 'manifest.json'
+
+
+class MappedGraphCore(sg.GraphCore):
+    """A GraphCore whose arrays are the files of a directory written by write_mapped_graph, mapped into memory
+    read-only.
+
+    Instance Attributes
+    - directory: the directory that the arrays are mapped from
+    """
+    directory: str
+    _maps: list[mmap.mmap]
+
+    def __init__(self, directory: str) -> None:
+        """Initialize the core saved in directory.
+        Raises FileNotFoundError if directory or one of its files does not exist, and ValueError if the files were
+        written with a different layout or on a machine with a different byte order.
+        """
+        self.directory = directory
+        self._maps = []
+        lengths = read_manifest(directory)
+        for section, typecode in sg.SECTIONS:
+            path = os.path.join(directory, section_file(section))
+            if os.path.getsize(path) != lengths[section] * array.array(typecode).itemsize:
+                raise ValueError(f'{path} is not the length given in the manifest')
+
+        views = {}
+        for section, typecode in sg.SECTIONS:
+            if lengths[section] == 0:
+                # empty files can not be mapped
+                views[section] = memoryview(array.array(typecode)).toreadonly()
+            else:
+                with open(os.path.join(directory, section_file(section)), 'rb') as reader:
+                    mapped = mmap.mmap(reader.fileno(), 0, access=mmap.ACCESS_READ)
+                self._maps.append(mapped)
+                views[section] = memoryview(mapped).cast(typecode)
+        super().__init__(views)
+
+    def close(self) -> None:
+        """Unmap the core's files. The core can not be used afterwards."""
+        self.release()
+        for mapped in self._maps:
+            mapped.close()
+        self._maps = []
+
+
+def section_file(section: str) -> str:
+    """Return the name of the file that holds the array called section
+
+    >>> section_file('review_ratings')
+    'review_ratings.bin'
+    """
+    return section + '.bin'
+
+
+def read_manifest(directory: str) -> dict[str, int]:
+    """Return the length of each array saved in directory, by the names in sg.SECTIONS.
+    Raises FileNotFoundError if directory has no manifest, and ValueError if its arrays were written with a different
+    layout or on a machine with a different byte order.
+    """
+    with open(os.path.join(directory, MANIFEST_FILE), 'r', encoding='utf-8') as reader:
+        manifest = json.load(reader)
+    if manifest.get('version') != MAPPED_FORMAT_VERSION or manifest.get('byteorder') != sys.byteorder:
+        raise ValueError(f'{directory} was written with a different layout or byte order')
+
+    lengths = {}
+    for section, typecode in sg.SECTIONS:
+        saved_typecode, itemsize, length = manifest['sections'][section]
+        if saved_typecode != typecode or itemsize != array.array(typecode).itemsize:
+            raise ValueError(f'{section} in {directory} does not hold {typecode} arrays of this machine')
+        lengths[section] = length
+    return lengths
+
+
+def write_mapped_graph(graph: g.ReccomenderGraph, directory: str = MAPPED_GRAPH_DIRECTORY) -> None:
+    """Save the core of graph as a directory of array files that read_mapped_graph can open, replacing directory if
+    it exists. The files are written to a temporary directory first, so directory is never left half written.
+    """
+    sections = sg.build_core_sections(graph)
+    parent = os.path.dirname(os.path.abspath(directory))
+    temp_directory = tempfile.mkdtemp(suffix='.tmp', dir=parent)
+    try:
+        for section, _ in sg.SECTIONS:
+            with open(os.path.join(temp_directory, section_file(section)), 'wb') as writer:
+                sections[section].tofile(writer)
+        manifest = {'version': MAPPED_FORMAT_VERSION, 'byteorder': sys.byteorder,
+                    'sections': {section: [typecode, sections[section].itemsize, len(sections[section])]
+                                 for section, typecode in sg.SECTIONS}}
+        with open(os.path.join(temp_directory, MANIFEST_FILE), 'w', encoding='utf-8') as writer:
+            json.dump(manifest, writer, indent=1)
+
+        if os.path.exists(directory):
+            # a directory can not be replaced in one step, so the old one is moved aside first
+            old_directory = tempfile.mkdtemp(suffix='.old', dir=parent)
+            os.replace(directory, os.path.join(old_directory, 'graph'))
+            os.replace(temp_directory, directory)
+            shutil.rmtree(old_directory)
+        else:
+            os.replace(temp_directory, directory)
+    except OSError:
+        shutil.rmtree(temp_directory, ignore_errors=True)
+        raise
+
+
+def read_mapped_graph(directory: str = MAPPED_GRAPH_DIRECTORY) -> sg.SharedReccomenderGraph:
+    """Return a graph that reads from the core saved in directory by write_mapped_graph.
+    Raises FileNotFoundError if directory does not exist, and ValueError if it was written with a different layout.
+    """
+    return sg.SharedReccomenderGraph(MappedGraphCore(directory))
+
+
+if __name__ == '__main__':
+    import doctest
+
+    doctest.testmod(verbose=True)
+    python_ta.check_all(config={
+        'extra-imports': ['graph', 'shared_graph', 'array', 'json', 'mmap', 'os', 'shutil', 'sys', 'tempfile'],
+        'allowed-io': ['__init__', 'read_manifest', 'write_mapped_graph'],
+        'max-line-length': 120
+    })
@@ -0,0 +1,434 @@
+"""
+CSC111 Project: Matrix factorisation
+
+This module contains a recommender trained offline by alternating least squares on the ratings of every review in a
+ReccomenderGraph, and a path engine that serves it. Every user and anime is given a short vector of factors, so that
+the rating a user would give an anime in each category is about the dot product of their factors. Unlike the path
+walk, it recommends to users who only reviewed anime that few others have, since the factors of those anime are
+learned from everyone who reviewed them.
+
+This file is Copyright (c) 2023 Hai Shi, Liam Alexander Maguire, Amelia Wu, and Sanya Chawla.
+"""
+from __future__ import annotations
+import array
+import concurrent.futures
+import itertools
+import math
+import operator
+import random
+from typing import Iterator, Optional, Sequence
+
+import python_ta
+
+import anime_and_users as aau
+import graph as g
+
+MATRIX_FACTORS_FILE = 'matrix_factors.pickle'
+
+# The number of factors of each user and anime, the number of times the user and anime factors are each solved for,
+# and how strongly factors are pulled towards 0, for each rating they are fitted to
+NUM_FACTORS = 10
+ALS_ITERATIONS = 6
+REGULARISATION = 0.5
+
+# train_matrix_factors gives each worker about this many chunks of users or anime to solve for in each iteration
+CHUNKS_PER_WORKER = 4
+
+# The ratings that a favorite anime without a review counts as when fitting a user's factors
+FAVORITE_RATINGS = (10,) * len(g.RATING_CATEGORIES)
+
+# The reviews that solve_users and solve_animes fit factors to, set in each worker process by set_training_data
+_training_data: Optional[TrainingData] = None
+
+FactorRows = tuple[array.array, array.array, int, float, list[array.array]]
+
+
+class TrainingData:
+    """The reviews of a graph, by user and by anime, with each rating minus the mean rating of its category.
+
+    The anime reviewed by the user with dense id i are user_animes[user_offsets[i]:user_offsets[i + 1]], and the
+    ratings of those reviews are at the same positions of user_ratings times len(g.RATING_CATEGORIES). anime_users
+    and anime_ratings are laid out the same way by anime.
+
+    Instance Attributes
+    - category_means: the mean rating in each category of g.RATING_CATEGORIES over every review
+    - user_offsets: where each user's reviews start in user_animes
+    - user_animes: the dense id of the anime of each review, by user
+    - user_ratings: the ratings of each review minus the category means, by user
+    - anime_offsets: where each anime's reviews start in anime_users
+    - anime_users: the dense id of the user of each review, by anime
+    - anime_ratings: the ratings of each review minus the category means, by anime
+    """
+    category_means: list[float]
+    user_offsets: array.array
+    user_animes: array.array
+    user_ratings: array.array
+    anime_offsets: array.array
+    anime_users: array.array
+    anime_ratings: array.array
+
+    def __init__(self, store: g.ReviewStore) -> None:
+        """Initialize the training data of the reviews in store"""
+        adjacency = store.get_adjacency()
+        self.category_means = store.statistics.get_category_means()
+
+        self.user_offsets, self.user_animes = adjacency.user_offsets, adjacency.user_animes
+        self.anime_offsets, self.anime_users = adjacency.anime_offsets, adjacency.anime_users
+        self.user_ratings = self.get_centred_ratings(store.ratings, adjacency.user_rows)
+        self.anime_ratings = self.get_centred_ratings(store.ratings, adjacency.anime_rows)
+
+    def get_centred_ratings(self, ratings: Sequence[int], rows: Sequence[int]) -> array.array:
+        """Return the ratings of the given rows of a review store's ratings, one row after the other, each minus the
+        mean rating of its category
+        """
+        num_categories = len(g.RATING_CATEGORIES)
+        centred = array.array('d')
+        for row in rows:
+            centred.extend(map(operator.sub, ratings[row * num_categories:(row + 1) * num_categories],
+                               self.category_means))
+        return centred
+
+
+class MatrixFactors:
+    """The anime factors learned by train_matrix_factors, and the user factors fitted to any user's ratings from them.
+
+    The predicted rating of a user with factors p and bias b in category c of an anime is
+    category_means[c] + b + the dot product of p and the factors of the anime in category c, plus the anime's bias in
+    category c. The factors of an anime in each category are different, but a user has the same factors for all of
+    them, so every rating of a user helps to fit the ratings they would give in the other categories too.
+
+    The factors are stored by column: columns[j][i * len(g.RATING_CATEGORIES) + c] is factor j of the anime at
+    position i of anime_uids in category c, and the last column holds the anime biases. That way the predicted
+    ratings of every anime are one matrix-vector product of the columns with a user's factors.
+
+    Instance Attributes
+    - anime_uids: the uid of each anime that has factors, which are the anime with a review
+    - category_means: the mean rating in each category of g.RATING_CATEGORIES
+    - num_factors: the number of factors of each user and anime
+    - regularisation: how strongly user factors are pulled towards 0 when they are fitted
+    - columns: the factors of every anime in every category, and their biases, by column
+    Representation Invariants:
+        - len(self.columns) == self.num_factors + 1
+        - all(len(column) == len(self.anime_uids) * len(g.RATING_CATEGORIES) for column in self.columns)
+    """
+    anime_uids: array.array
+    category_means: array.array
+    num_factors: int
+    regularisation: float
+    columns: list[array.array]
+    _positions: dict[int, int]
+
+    def __init__(self, rows: FactorRows) -> None:
+        """Initialize the factors from the rows returned by get_rows"""
+        self.anime_uids, self.category_means, self.num_factors, self.regularisation, self.columns = rows
+        self._positions = {uid: position for position, uid in enumerate(self.anime_uids)}
+
+    def get_rows(self) -> FactorRows:
+        """Return the contents of the factors, in the order that __init__ takes them"""
+        return self.anime_uids, self.category_means, self.num_factors, self.regularisation, self.columns
+
+    def get_position(self, uid: int) -> Optional[int]:
+        """Return the position in anime_uids of the anime with the given uid, or None if it has no factors"""
+        return self._positions.get(uid)
+
+    def fit_user(self, ratings: dict[int, Sequence[int]]) -> Optional[list[float]]:
+        """Return the factors and then the bias of a user who gave the anime at each position in ratings the ratings
+        it maps to, in the order of g.RATING_CATEGORIES, or None if none of the positions have factors. This is the
+        same least squares fit that train_matrix_factors makes for each user.
+        """
+        num_categories = len(g.RATING_CATEGORIES)
+        rows = []
+        targets = []
+        for position, row_ratings in ratings.items():
+            for column in range(num_categories):
+                row = position * num_categories + column
+                # the anime's bias is part of the rating the user's factors are fitted to, like in solve_users
+                rows.append([factors[row] for factors in self.columns[:-1]] + [1.0])
+                targets.append(row_ratings[column] - self.category_means[column] - self.columns[-1][row])
+        if len(rows) == 0:
+            return None
+        return solve_factors(rows, [targets], self.regularisation)[0]
+
+    def predict(self, user_factors: Sequence[float]) -> list[float]:
+        """Return the predicted rating of every anime in every category by a user with the factors and bias
+        user_factors, in the order of the columns
+        Preconditions:
+            - len(user_factors) == self.num_factors + 1
+        """
+        bias = user_factors[-1]
+        predictions = [mean + bias for mean in self.category_means] * len(self.anime_uids)
+        # the anime biases have a factor of 1
+        for factor, column in zip(itertools.chain(user_factors[:-1], [1.0]), self.columns):
+            predictions = list(map(operator.add, predictions, map(operator.mul, column, itertools.repeat(factor))))
+        return predictions
+
+
+class FactorisationPathEngine(g.PathEngine):
+    """Recommends every anime that has factors by the ratings a user is predicted to give it.
+
+    The user's factors are fitted to their current reviews, and their favorite anime they have not reviewed as if
+    they rated them FAVORITE_RATINGS, so new profiles and new reviews are used straight away without training again.
+    The predicted ratings of every anime are then scored like a path of one review with those ratings, so the user's
+    priorities and preferences are used the same way as for the path walk.
+
+    Instance Attributes
+    - factors: the anime factors that recommendations are predicted from
+    """
+    factors: MatrixFactors
+
+    def __init__(self, factors: MatrixFactors) -> None:
+        """Initialize an engine that recommends from factors"""
+        self.factors = factors
+
+    def get_path_scores(self, graph: g.ReccomenderGraph, user: aau.User) -> Iterator[tuple[aau.Anime, float]]:
+        """Yield every anime with factors in graph that user has not watched, with its score, in the order of the
+        factors' anime_uids. Nothing is yielded if none of user's reviewed or favorite anime have factors.
+        """
+        factors = self.factors
+        ratings = {}
+        for anime in user.favorite_animes:
+            position = factors.get_position(anime.get_uid())
+            if position is not None:
+                ratings[position] = FAVORITE_RATINGS
+        for anime, review in user.reviews.items():
+            position = factors.get_position(anime.get_uid())
+            if position is not None:
+                ratings[position] = review.get_ratings_row()
+        user_factors = factors.fit_user(ratings)
+        if user_factors is None:
+            return
+
+        predictions = factors.predict(user_factors)
+        watched = user.favorite_animes.union(set(user.reviews))
+        animes = []
+        positions = []
+        for position, uid in enumerate(factors.anime_uids):
+            anime = graph.animes.get(uid)
+            if anime is not None and anime not in watched:
+                animes.append(anime)
+                positions.append(position)
+
+        num_categories = len(g.RATING_CATEGORIES)
+        store = graph.review_store
+        sim_ratings = user.calculate_similarity_ratings(store.get_catalogue(),
+                                                        [store.get_anime_id(anime) for anime in animes])
+        for anime, position, sim_rating in zip(animes, positions, sim_ratings):
+            predicted = predictions[position * num_categories:(position + 1) * num_categories]
+            yield anime, graph.calculate_rating_sums_score(anime, predicted, 1, user, sim_rating)
+
+
+def load_matrix_factors(graph: g.ReccomenderGraph, files: list[str],
+                        factors_file: Optional[str] = MATRIX_FACTORS_FILE,
+                        workers: Optional[int] = None) -> MatrixFactors:
+    """Return the matrix factors of graph, which was read from files by g.read_file.
+    The factors are cached in factors_file next to the dataset together with the sha256 hash of every file, and are
+    only trained again with train_matrix_factors when one of the files has changed. If factors_file is None, the
+    factors are always trained and never saved.
+    Preconditions:
+        - graph was read from files, and every review in graph is in graph.review_store
+    """
+    if factors_file is None:
+        return train_matrix_factors(graph, workers=workers)
+
+    digests = [g.hash_file(file) for file in files]
+    rows = g.load_snapshot(factors_file, digests)
+    if rows is not None:
+        return MatrixFactors(rows)
+    factors = train_matrix_factors(graph, workers=workers)
+    g.write_snapshot(factors_file, digests, factors.get_rows())
+    return factors
+
+
+def train_matrix_factors(graph: g.ReccomenderGraph, num_factors: int = NUM_FACTORS,
+                         iterations: int = ALS_ITERATIONS, regularisation: float = REGULARISATION,
+                         seed: int = 0, workers: Optional[int] = None) -> MatrixFactors:
+    """Learn the factors of every user and reviewed anime in graph from the ratings of its reviews by alternating
+    least squares, and return the anime factors.
+
+    Each iteration fits the factors of every user to their ratings with the anime factors fixed, and then the factors
+    of every anime with the user factors fixed. Each of those fits is a small least squares problem with a penalty of
+    regularisation times the number of ratings it fits, so every iteration makes the total error smaller. If workers
+    is greater than 1, the users and anime are split into chunks which that many processes solve for.
+    Preconditions:
+        - every review in graph is in graph.review_store, which is not true of the subclasses of ReccomenderGraph
+          that load or share their reviews
+        - num_factors > 0 and iterations > 0 and regularisation > 0
+    """
+    store = graph.review_store
+    data = TrainingData(store)
+    num_users, num_animes = len(store.user_nodes), len(store.anime_nodes)
+    generator = random.Random(seed)
+    anime_vectors = [[generator.gauss(0, 0.1) for _ in range(num_factors)] + [0.0]
+                     for _ in range(num_animes * len(g.RATING_CATEGORIES))]
+
+    if workers is None or workers <= 1:
+        set_training_data(data)
+        try:
+            for _ in range(iterations):
+                user_vectors = solve_users(0, num_users, anime_vectors, regularisation)
+                anime_vectors = solve_animes(0, num_animes, user_vectors, regularisation)
+        finally:
+            set_training_data(None)
+    else:
+        num_chunks = workers * CHUNKS_PER_WORKER
+        user_bounds = [num_users * i // num_chunks for i in range(num_chunks + 1)]
+        anime_bounds = [num_animes * i // num_chunks for i in range(num_chunks + 1)]
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=set_training_data,
+                                                    initargs=(data,)) as executor:
+            for _ in range(iterations):
+                user_vectors = list(itertools.chain.from_iterable(executor.map(
+                    solve_users, user_bounds[:-1], user_bounds[1:], [anime_vectors] * num_chunks,
+                    [regularisation] * num_chunks)))
+                anime_vectors = list(itertools.chain.from_iterable(executor.map(
+                    solve_animes, anime_bounds[:-1], anime_bounds[1:], [user_vectors] * num_chunks,
+                    [regularisation] * num_chunks)))
+
+    # only the anime with a review have learned factors
+    reviewed = [anime_id for anime_id in range(num_animes) if data.anime_offsets[anime_id + 1] >
+                data.anime_offsets[anime_id]]
+    rows = [anime_vectors[anime_id * len(g.RATING_CATEGORIES) + column]
+            for anime_id in reviewed for column in range(len(g.RATING_CATEGORIES))]
+    columns = [array.array('d', column) for column in zip(*rows)] if len(rows) > 0 else \
+        [array.array('d') for _ in range(num_factors + 1)]
+    return MatrixFactors((array.array('i', [store.anime_nodes[anime_id].get_uid() for anime_id in reviewed]),
+                          array.array('d', data.category_means), num_factors, regularisation, columns))
+
+
+def set_training_data(data: Optional[TrainingData]) -> None:
+    """Set the reviews that solve_users and solve_animes fit factors to in this process"""
+    global _training_data
+    _training_data = data
+
+
+def solve_users(start: int, end: int, anime_vectors: list[list[float]],
+                regularisation: float) -> list[list[float]]:
+    """Return the factors and then the bias of each user with a dense id from start up to but not including end,
+    fitted to their ratings with the factors and biases of each anime in each category fixed to anime_vectors.
+    Users without reviews get all zeros.
+    Preconditions:
+        - set_training_data has been called with the training data of a graph in this process
+    """
+    data = _training_data
+    num_categories = len(g.RATING_CATEGORIES)
+    num_factors = len(anime_vectors[0]) - 1
+    user_vectors = [[0.0] * (num_factors + 1) for _ in range(start, end)]
+
+    # users who reviewed the same anime share one least squares matrix, and most users only reviewed one anime
+    groups = {}
+    for user_id in range(start, end):
+        first, last = data.user_offsets[user_id], data.user_offsets[user_id + 1]
+        if first < last:
+            groups.setdefault(tuple(data.user_animes[first:last]), []).append(user_id)
+
+    for anime_ids, user_ids in groups.items():
+        rows = [anime_vectors[anime_id * num_categories + column]
+                for anime_id in anime_ids for column in range(num_categories)]
+        # the anime biases are part of the rating the factors are fitted to, and the user bias has a factor of 1
+        biases = [row[-1] for row in rows]
+        targets = [list(map(operator.sub, data.user_ratings[data.user_offsets[user_id] * num_categories:
+                                                            data.user_offsets[user_id + 1] * num_categories], biases))
+                   for user_id in user_ids]
+        solutions = solve_factors([row[:-1] + [1.0] for row in rows], targets, regularisation)
+        for user_id, solution in zip(user_ids, solutions):
+            user_vectors[user_id - start] = solution
+    return user_vectors
+
+
+def solve_animes(start: int, end: int, user_vectors: list[list[float]],
+                 regularisation: float) -> list[list[float]]:
+    """Return the factors and then the bias of each anime with a dense id from start up to but not including end in
+    each category, one category after the other, fitted to their ratings with the factors and biases of each user
+    fixed to user_vectors. Anime without reviews get all zeros.
+    Preconditions:
+        - set_training_data has been called with the training data of a graph in this process
+    """
+    data = _training_data
+    num_categories = len(g.RATING_CATEGORIES)
+    num_factors = len(user_vectors[0]) - 1
+    anime_vectors = []
+    for anime_id in range(start, end):
+        first, last = data.anime_offsets[anime_id], data.anime_offsets[anime_id + 1]
+        if first == last:
+            anime_vectors.extend([0.0] * (num_factors + 1) for _ in range(num_categories))
+            continue
+        rows = [user_vectors[user_id] for user_id in data.anime_users[first:last]]
+        biases = [row[-1] for row in rows]
+        ratings = data.anime_ratings[first * num_categories:last * num_categories]
+        # every category is fitted to the same users, so they share one least squares matrix
+        targets = [list(map(operator.sub, ratings[column::num_categories], biases))
+                   for column in range(num_categories)]
+        anime_vectors.extend(solve_factors([row[:-1] + [1.0] for row in rows], targets, regularisation))
+    return anime_vectors
+
+
+def solve_factors(rows: list[list[float]], targets: list[list[float]], regularisation: float) -> list[list[float]]:
+    """Return the x that minimises |rows x - target| ** 2 + regularisation * len(rows) * |x| ** 2 for each target in
+    targets, by solving the normal equations.
+
+    >>> [[round(x, 6) for x in solution] for solution in solve_factors([[1.0, 0.0], [0.0, 2.0]], [[3.0, 4.0]], 0.5)]
+    [[1.5, 1.6]]
+
+    Preconditions:
+        - len(rows) > 0
+        - all(len(target) == len(rows) for target in targets)
+        - regularisation > 0
+    """
+    columns = list(zip(*rows))
+    penalty = regularisation * len(rows)
+    gram = [[0.0] * len(columns) for _ in columns]
+    for i, column in enumerate(columns):
+        for j in range(i + 1):
+            gram[i][j] = gram[j][i] = sum(map(operator.mul, column, columns[j]))
+        gram[i][i] += penalty
+    lower = cholesky(gram)
+    return [cholesky_solve(lower, [sum(map(operator.mul, column, target)) for column in columns])
+            for target in targets]
+
+
+def cholesky(matrix: list[list[float]]) -> list[list[float]]:
+    """Return the lower triangular matrix L with L L^T == matrix
+
+    >>> cholesky([[4.0, 2.0], [2.0, 5.0]])
+    [[2.0, 0.0], [1.0, 2.0]]
+
+    Preconditions:
+        - matrix is symmetric and positive definite
+    """
+    size = len(matrix)
+    lower = [[0.0] * size for _ in range(size)]
+    for i in range(size):
+        for j in range(i + 1):
+            total = matrix[i][j] - sum(map(operator.mul, lower[i][:j], lower[j][:j]))
+            lower[i][j] = math.sqrt(total) if i == j else total / lower[j][j]
+    return lower
+
+
+def cholesky_solve(lower: list[list[float]], vector: list[float]) -> list[float]:
+    """Return the x with L L^T x == vector, where L is lower
+
+    >>> cholesky_solve([[2.0, 0.0], [1.0, 2.0]], [6.0, 7.0])
+    [1.0, 1.0]
+    """
+    size = len(lower)
+    forward = [0.0] * size
+    for i in range(size):
+        forward[i] = (vector[i] - sum(map(operator.mul, lower[i][:i], forward[:i]))) / lower[i][i]
+    # row i of the transpose of lower is column i of lower
+    upper = list(zip(*lower))
+    solution = [0.0] * size
+    for i in reversed(range(size)):
+        solution[i] = (forward[i] - sum(map(operator.mul, upper[i][i + 1:], solution[i + 1:]))) / lower[i][i]
+    return solution
+
+
+if __name__ == '__main__':
+    import doctest
+
+    doctest.testmod(verbose=True)
+    python_ta.check_all(config={
+        'extra-imports': ['anime_and_users', 'graph', 'array', 'concurrent.futures', 'itertools', 'math', 'operator',
+                          'random', 'typing'],
+        'allowed-io': [],
+        'disable': ['global-statement', 'too-many-arguments'],
+        'max-line-length': 120
+    })
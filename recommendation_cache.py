@@ -0,0 +1,308 @@
+"""
+CSC111 Project: Recommendation cache
+
+This module contains a bounded cache of the results of ReccomenderGraph.get_all_path_scores and
+User.recommend_from_friend_graph, so that opening a recommendation screen again or generating with the same
+preferences does not search the graph again. A cached result is only used while nothing that it depends on has
+changed: the user's preferences, favorite anime and reviews, and the reviews of the anime and users within three
+reviews of the user, or of the friends within the radius and the anime they watched.
+
+This file is Copyright (c) 2023 Hai Shi, Liam Alexander Maguire, Amelia Wu, and Sanya Chawla.
+"""
+from __future__ import annotations
+import array
+import collections
+from typing import Iterator, Optional
+
+import python_ta
+
+import anime_and_users as aau
+import graph as g
+
+# The number of users whose recommendations are kept
+RECOMMENDATION_CACHE_SIZE = 128
+
+UserFingerprint = tuple[Optional[int], tuple, tuple, frozenset[int], tuple]
+FriendFingerprint = tuple[UserFingerprint, int, float, tuple]
+Recommendations = list[tuple[aau.Anime, float]]
+
+
+class CacheEntry:
+    """The recommendations of one user, and what they were worked out from.
+
+    Instance Attributes
+    - k: the number of recommendations asked for
+    - fingerprint: the fingerprint of the user when the recommendations were worked out, and for friend
+      recommendations, the radius, support weight and friends they were worked out with
+    - anime_ids: the dense ids of the anime the recommendations depend on the reviews of
+    - user_ids: the dense ids of the users the recommendations depend on the reviews of
+    - stamp: the sum of the review store's versions of those anime and users when the recommendations were worked out
+    - recommendations: the recommended anime with their path scores
+    """
+    k: int
+    fingerprint: UserFingerprint | FriendFingerprint
+    anime_ids: array.array
+    user_ids: array.array
+    stamp: int
+    recommendations: Recommendations
+
+    def __init__(self, k: int, fingerprint: UserFingerprint | FriendFingerprint, anime_ids: array.array,
+                 user_ids: array.array, stamp: int, recommendations: Recommendations) -> None:
+        """Initialize a new cache entry"""
+        self.k = k
+        self.fingerprint = fingerprint
+        self.anime_ids = anime_ids
+        self.user_ids = user_ids
+        self.stamp = stamp
+        self.recommendations = recommendations
+
+
+class RecommendationCache:
+    """A least recently used cache of the top k path recommendations and of the top k friend recommendations of at
+    most capacity users each.
+
+    The review store counts every change to the reviews of each anime and user. An entry keeps the dense ids of the
+    anime the user reviewed, the users who reviewed them and the anime those users reviewed, which are every review
+    a depth 3 path to a recommendation goes through or is scored from, and the sum of their counts. The entry is
+    thrown away as soon as that sum is different, so a review anywhere in the user's neighbourhood invalidates it
+    and reviews anywhere else do not. A friend recommendation entry keeps the friends within the radius instead, and
+    the anime they reviewed or favorited, which are every anime that can be recommended and every review that
+    decides their scores, and it is also thrown away when the friends within the radius change.
+
+    >>> import datetime
+    >>> graph = g.ReccomenderGraph()
+    >>> dates = (datetime.date(2000, 1, 1), datetime.date(2000, 6, 1))
+    >>> for uid, num_episodes in enumerate([12, 1, 24]):
+    ...     graph.insert_anime(aau.Anime(f'Anime {uid}', num_episodes, {'Action'}, dates, uid))
+    >>> for username in ['amy', 'bo']:
+    ...     graph.insert_user(aau.User(username=username, fav_animes=set()))
+    >>> amy, bo = graph.users['amy'], graph.users['bo']
+    >>> _ = g.Review(amy, graph.animes[0], [8] * 6)
+    >>> _ = g.Review(bo, graph.animes[1], [9] * 6)
+    >>> amy.update_preferences(aau.DEFAULT_PRIORITIES, aau.DEFAULT_FAVORITE_ERA)
+    >>> amy.friends_list.append(bo)
+    >>> cache = RecommendationCache()
+    >>> [(anime.get_uid(), score) for anime, score in cache.recommend_from_friend_graph(graph, amy)]
+    [(1, 8.75)]
+    >>> _ = cache.recommend_from_friend_graph(graph, amy)
+    >>> cache.hits, cache.misses
+    (1, 1)
+    >>> _ = g.Review(bo, graph.animes[2], [2] * 6)
+    >>> [(anime.get_uid(), score) for anime, score in cache.recommend_from_friend_graph(graph, amy)]
+    [(1, 8.75), (2, 7.0)]
+    >>> cache.invalidations
+    1
+
+    Instance Attributes
+    - capacity: the greatest number of users whose recommendations are kept
+    - hits: the number of lookups answered from the cache
+    - misses: the number of lookups that had to search the graph
+    - invalidations: the number of entries thrown away because the user or their neighbourhood changed
+    Representation Invariants:
+        - self.capacity > 0
+        - len(self._entries) <= self.capacity
+    """
+    capacity: int
+    hits: int
+    misses: int
+    invalidations: int
+    _entries: collections.OrderedDict[str, CacheEntry]
+    _friend_entries: collections.OrderedDict[str, CacheEntry]
+
+    def __init__(self, capacity: int = RECOMMENDATION_CACHE_SIZE) -> None:
+        """Initialize an empty cache that keeps the recommendations of at most capacity users"""
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._entries = collections.OrderedDict()
+        self._friend_entries = collections.OrderedDict()
+
+    def __len__(self) -> int:
+        """Return the number of users whose path recommendations are cached"""
+        return len(self._entries)
+
+    def get_all_path_scores(self, graph: g.ReccomenderGraph, user: aau.User, k: int = 10) -> Recommendations:
+        """Return graph.get_all_path_scores(user, k=k), from the cache if nothing it depends on has changed since
+        it was last worked out.
+        Preconditions:
+            - every review in graph is in graph.review_store, which is not true of the subclasses of ReccomenderGraph
+              that load or share their reviews
+            - k >= 0
+        """
+        recommendations = self._lookup(self._entries, graph.review_store, user, k,
+                                       fingerprint_user(graph.review_store, user))
+        if recommendations is not None:
+            return recommendations
+
+        entry = self._start_entry(graph, user, k)
+        entry.recommendations = graph.get_all_path_scores(user, k=k)
+        self._add_entry(self._entries, user, entry)
+        return list(entry.recommendations)
+
+    def recommend_from_friend_graph(self, graph: g.ReccomenderGraph, user: aau.User, radius: int = aau.FRIEND_RADIUS,
+                                    k: int = 10,
+                                    support_weight: float = aau.FRIEND_SUPPORT_WEIGHT) -> Recommendations:
+        """Return user.recommend_from_friend_graph(radius, k, support_weight), from the cache if nothing it depends
+        on has changed since it was last worked out.
+        Preconditions:
+            - user and every user up to radius friendships away from them are in graph.review_store
+            - radius >= 1 and k >= 0
+            - 0 <= support_weight <= 1
+        """
+        store = graph.review_store
+        friends, anime_ids, user_ids = find_friend_neighbourhood(store, user, radius)
+        fingerprint = (fingerprint_user(store, user), radius, support_weight, friends)
+        recommendations = self._lookup(self._friend_entries, store, user, k, fingerprint)
+        if recommendations is not None:
+            return recommendations
+
+        entry = CacheEntry(k, fingerprint, anime_ids, user_ids, get_stamp(store, anime_ids, user_ids), [])
+        entry.recommendations = user.recommend_from_friend_graph(radius, k, support_weight)
+        self._add_entry(self._friend_entries, user, entry)
+        return list(entry.recommendations)
+
+    def generate_top_path_scores(self, graph: g.ReccomenderGraph, user: aau.User,
+                                 k: int = 10) -> Iterator[Recommendations]:
+        """Yield the cached recommendations of user if nothing they depend on has changed since they were last worked
+        out, and otherwise yield the snapshots of graph.generate_top_path_scores(user, k=k) and cache the last one.
+        Nothing is cached if the snapshots are not all taken.
+        Preconditions:
+            - every review in graph is in graph.review_store
+            - k >= 0
+        """
+        recommendations = self._lookup(self._entries, graph.review_store, user, k,
+                                       fingerprint_user(graph.review_store, user))
+        if recommendations is not None:
+            yield recommendations
+            return
+
+        entry = self._start_entry(graph, user, k)
+        for recommendations in graph.generate_top_path_scores(user, k=k):
+            entry.recommendations = recommendations
+            yield list(recommendations)
+        self._add_entry(self._entries, user, entry)
+
+    def _lookup(self, entries: collections.OrderedDict[str, CacheEntry], store: g.ReviewStore, user: aau.User,
+                k: int, fingerprint: UserFingerprint | FriendFingerprint) -> Optional[Recommendations]:
+        """Return the top k recommendations of user cached in entries, or None and count a miss if they are not
+        cached or if fingerprint or something else they depend on has changed since they were worked out
+        """
+        entry = entries.get(user.username)
+        if entry is not None:
+            if entry.k == k and entry.fingerprint == fingerprint and \
+                    get_stamp(store, entry.anime_ids, entry.user_ids) == entry.stamp:
+                entries.move_to_end(user.username)
+                self.hits += 1
+                return list(entry.recommendations)
+            del entries[user.username]
+            self.invalidations += 1
+        self.misses += 1
+        return None
+
+    def _start_entry(self, graph: g.ReccomenderGraph, user: aau.User, k: int) -> CacheEntry:
+        """Return an entry with no recommendations yet for the top k recommendations of user, which records what
+        they depend on before the graph is searched for them
+        """
+        store = graph.review_store
+        anime_ids, user_ids = find_neighbourhood(store, user)
+        return CacheEntry(k, fingerprint_user(store, user), anime_ids, user_ids, get_stamp(store, anime_ids, user_ids),
+                          [])
+
+    def _add_entry(self, entries: collections.OrderedDict[str, CacheEntry], user: aau.User,
+                   entry: CacheEntry) -> None:
+        """Cache entry in entries as the recommendations of user, throwing away those of the least recently used
+        user if entries is full
+        """
+        entries[user.username] = entry
+        if len(entries) > self.capacity:
+            entries.popitem(last=False)
+
+    def invalidate(self, username: str) -> None:
+        """Throw away the cached recommendations of the user called username, if there are any"""
+        for entries in (self._entries, self._friend_entries):
+            if entries.pop(username, None) is not None:
+                self.invalidations += 1
+
+    def clear(self) -> None:
+        """Throw away every cached recommendation, keeping the counters"""
+        self._entries.clear()
+        self._friend_entries.clear()
+
+
+def fingerprint_user(store: g.ReviewStore, user: aau.User) -> UserFingerprint:
+    """Return everything about user that their path recommendations depend on: their id in store, priorities,
+    favorite era, favorite anime and reviews. The reviews are kept in order, since the order they are searched in
+    decides which paths are scored.
+    """
+    return (store.get_user_id(user), tuple(user.priorities.items()), tuple(user.favorite_era),
+            frozenset(anime.get_uid() for anime in user.favorite_animes),
+            tuple((anime.get_uid(), tuple(review.get_ratings_row())) for anime, review in user.reviews.items()))
+
+
+def find_neighbourhood(store: g.ReviewStore, user: aau.User) -> tuple[array.array, array.array]:
+    """Return the dense ids in store of the anime user reviewed and the anime reviewed by the users who reviewed
+    them, and of those users and user
+    """
+    adjacency = store.get_adjacency()
+    anime_ids = {store.get_anime_id(anime) for anime in user.reviews}
+    user_ids = set()
+    if store.get_user_id(user) is not None:
+        user_ids.add(store.get_user_id(user))
+    for anime_id in list(anime_ids):
+        user_ids.update(adjacency.anime_users[adjacency.anime_offsets[anime_id]:adjacency.anime_offsets[anime_id + 1]])
+    for user_id in user_ids:
+        anime_ids.update(adjacency.user_animes[adjacency.user_offsets[user_id]:adjacency.user_offsets[user_id + 1]])
+    return array.array('i', sorted(anime_ids)), array.array('i', sorted(user_ids))
+
+
+def find_friend_neighbourhood(store: g.ReviewStore, user: aau.User,
+                              radius: int) -> tuple[tuple, array.array, array.array]:
+    """Return the usernames of the users up to radius friendships away from user with how many friendships away
+    they are and the uids of their favorite anime, in the order User.find_friend_support visits them, and the dense
+    ids in store of the anime those users reviewed or favorited and of those users
+    Preconditions:
+        - every user up to radius friendships away from user is in store
+    """
+    adjacency = store.get_adjacency()
+    friends = []
+    anime_ids = set()
+    user_ids = set()
+    visited = {user}
+    frontier = [user]
+    for distance in range(1, radius + 1):
+        next_frontier = []
+        for friend_of in frontier:
+            for friend in friend_of.friends_list:
+                if friend not in visited:
+                    visited.add(friend)
+                    next_frontier.append(friend)
+        for friend in next_frontier:
+            favorite_uids = frozenset(anime.get_uid() for anime in friend.favorite_animes)
+            friends.append((friend.username, distance, favorite_uids))
+            anime_ids.update(store.get_anime_id(anime) for anime in friend.favorite_animes)
+            user_id = store.get_user_id(friend)
+            user_ids.add(user_id)
+            anime_ids.update(adjacency.user_animes[adjacency.user_offsets[user_id]:adjacency.user_offsets[user_id + 1]])
+        frontier = next_frontier
+    return tuple(friends), array.array('i', sorted(anime_ids)), array.array('i', sorted(user_ids))
+
+
+def get_stamp(store: g.ReviewStore, anime_ids: array.array, user_ids: array.array) -> int:
+    """Return the sum of the versions in store of the anime and users with the given dense ids. Versions only ever
+    go up, so the sum changes exactly when a review of one of the anime or by one of the users is added or changed.
+    """
+    return sum(store.anime_versions[anime_id] for anime_id in anime_ids) + \
+        sum(store.user_versions[user_id] for user_id in user_ids)
+
+
+if __name__ == '__main__':
+    import doctest
+
+    doctest.testmod(verbose=True)
+    python_ta.check_all(config={
+        'extra-imports': ['anime_and_users', 'graph', 'array', 'collections', 'typing'],
+        'allowed-io': [],
+        'disable': ['too-many-arguments'],
+        'max-line-length': 120
+    })
@@ -0,0 +1,124 @@
+"""
+CSC111 Project: Recommendation worker
+
+This module contains a worker that works out recommendations on a background thread, so that the pygame loop of
+the recommendation screens keeps drawing and handling events while the graph is searched, instead of the window
+freezing until the search is done.
+
+This file is Copyright (c) 2023 Hai Shi, Liam Alexander Maguire, Amelia Wu, and Sanya Chawla.
+"""
+from __future__ import annotations
+import concurrent.futures
+from typing import Any, Callable, Iterable, Optional
+
+import python_ta
+
+import anime_and_users as aau
+
+Recommendations = list[tuple[aau.Anime, float]]
+
+
+class RecommendationWorker:
+    """Runs one recommendation request at a time on a background thread, and hands the result of the latest request
+    back to the pygame loop when the loop polls for it.
+
+    Submitting a request supersedes the one before it. A superseded request that has not started is cancelled, and
+    one that is already running is left to finish, since a search cannot be stopped part of the way through, but its
+    result is thrown away. Requests run in the order they are submitted, so a request never runs at the same time as
+    another one, and anything a request changes before searching, like the user's preferences, is changed in order.
+
+    A progressive request yields better and better recommendations as it goes, and the latest ones are polled for
+    while it runs. It stops at the next recommendations it yields once it is superseded.
+
+    Results are polled for instead of being handed to a callback, since a callback would run on the worker's thread
+    and pygame surfaces should only be drawn on from the loop's thread.
+    """
+    _executor: concurrent.futures.ThreadPoolExecutor
+    _future: Optional[concurrent.futures.Future]
+    _superseded: list[concurrent.futures.Future]
+    # The number of requests submitted or cancelled so far, which a progressive request checks to see if it has been
+    # superseded, and that request's latest recommendations that have not been polled yet
+    _request: int
+    _latest: Optional[tuple[int, Recommendations]]
+
+    def __init__(self) -> None:
+        """Initialize a worker with no requests"""
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self._future = None
+        self._superseded = []
+        self._request = 0
+        self._latest = None
+
+    def submit(self, function: Callable[..., Recommendations], *args: Any) -> None:
+        """Run function(*args) on the worker's thread once every earlier request is done, superseding the latest
+        request
+        """
+        self.cancel()
+        self._future = self._executor.submit(function, *args)
+
+    def submit_progressive(self, function: Callable[..., Iterable[Recommendations]], *args: Any) -> None:
+        """Run function(*args) on the worker's thread once every earlier request is done like submit, where it
+        returns better and better recommendations, the last of which are the result of the request
+        """
+        self.cancel()
+        self._future = self._executor.submit(self._run_progressive, self._request, function, args)
+
+    def _run_progressive(self, request: int, function: Callable[..., Iterable[Recommendations]],
+                         args: tuple) -> Optional[Recommendations]:
+        """Keep each of the recommendations returned by function(*args) as the latest ones of the request numbered
+        request, and return the last of them, an empty list if there were none, or None if the request was superseded
+        """
+        recommendations = []
+        for recommendations in function(*args):
+            if self._request != request:
+                return None
+            self._latest = (request, recommendations)
+        return recommendations
+
+    def is_busy(self) -> bool:
+        """Return whether the latest request has been submitted and its result has not been polled yet"""
+        return self._future is not None
+
+    def poll(self) -> Optional[Recommendations]:
+        """Return the result of the latest request if it is done and has not been polled yet, or the latest
+        recommendations of a progressive request that have not been polled yet, and None otherwise.
+        If the request raised an exception, it is raised again here, as if the request had been run by the loop.
+        """
+        if self._future is None:
+            return None
+        if self._future.done():
+            future, self._future = self._future, None
+            self._latest = None
+            return future.result()
+        latest = self._latest
+        if latest is None or latest[0] != self._request:
+            return None
+        self._latest = None
+        return latest[1]
+
+    def cancel(self, wait: bool = False) -> None:
+        """Supersede the latest request without submitting a new one, so that its result is never polled.
+        If wait is True, return only once the worker's thread has finished every superseded request that already
+        started, so that the caller can change what they search afterwards.
+        """
+        self._request += 1
+        self._latest = None
+        if self._future is not None:
+            if not self._future.cancel():
+                self._superseded.append(self._future)
+            self._future = None
+        if wait:
+            concurrent.futures.wait(self._superseded)
+        self._superseded = [future for future in self._superseded if not future.done()]
+
+
+if __name__ == '__main__':
+    import doctest
+
+    doctest.testmod(verbose=True)
+    python_ta.check_all(config={
+        'extra-imports': ['anime_and_users', 'concurrent.futures', 'typing'],
+        'allowed-io': [],
+        'disable': [],
+        'max-line-length': 120
+    })
@@ -0,0 +1,514 @@
+"""
+CSC111 Project: Shared memory ReccomenderGraph
+
+This module contains the functions for publishing the read-only core of a ReccomenderGraph (its anime and user
+tables, the adjacency between them and the ratings of every review) into one block of shared memory, and a
+ReccomenderGraph that other processes attach to it with. Attached graphs read the shared arrays in place instead of
+copying them, and only the users imported into them and their reviews are private to each process.
+
+This file is Copyright (c) 2023 Hai Shi, Liam Alexander Maguire, Amelia Wu, and Sanya Chawla.
+"""
+from __future__ import annotations
+import array
+import bisect
+import datetime
+import multiprocessing
+import sys
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from typing import Iterator, Optional, Sequence
+
+import python_ta
+
+import anime_and_users as aau
+import graph as g
+
+# Increased whenever the layout of the shared memory block changes
+SHARED_FORMAT_VERSION = 1
+
+# The arrays in the shared memory block in order, with their array typecodes. Each *_offsets array holds where the
+# rows of every anime or user start in the array after it, plus the end of the last row.
+SECTIONS = (('anime_uids', 'i'), ('anime_episodes', 'i'), ('anime_air_dates', 'i'),
+            ('anime_title_offsets', 'i'), ('anime_titles', 'B'),
+            ('anime_genre_offsets', 'i'), ('anime_genres', 'B'),
+            ('anime_rating_sums', 'i'), ('anime_review_offsets', 'i'), ('anime_reviews', 'i'),
+            ('user_name_offsets', 'i'), ('user_names', 'B'), ('user_order', 'i'),
+            ('user_favorite_offsets', 'i'), ('user_favorites', 'i'),
+            ('user_review_offsets', 'i'), ('user_reviews', 'i'),
+            ('review_users', 'i'), ('review_animes', 'i'), ('review_ratings', 'b'))
+
+# Separates the genres of one anime in anime_genres
+GENRE_SEPARATOR = '\x1f'
+
+# The names of the shared memory blocks published by publish_graph_core in this process that have not been unlinked,
+# which this process's resource tracker is tracking
+PUBLISHED_NAMES = set()
+
+
+class GraphCore:
+    """The read-only arrays of a ReccomenderGraph, which SharedReccomenderGraph reads from. Every array in SECTIONS
+    is an attribute holding a read-only memoryview.
+
+    Anime, users and reviews are numbered from 0 in the core. Row i of the review arrays is one review, rows
+    anime_review_offsets[a] to anime_review_offsets[a + 1] of anime_reviews are the review rows of anime a in the
+    order of its reviews dict, and user_reviews is laid out the same way for users.
+
+    Instance Attributes
+    - num_animes: the number of anime in the core
+    - num_users: the number of users in the core
+    """
+    num_animes: int
+    num_users: int
+    anime_uids: memoryview
+    anime_episodes: memoryview
+    anime_air_dates: memoryview
+    anime_title_offsets: memoryview
+    anime_titles: memoryview
+    anime_genre_offsets: memoryview
+    anime_genres: memoryview
+    anime_rating_sums: memoryview
+    anime_review_offsets: memoryview
+    anime_reviews: memoryview
+    user_name_offsets: memoryview
+    user_names: memoryview
+    user_order: memoryview
+    user_favorite_offsets: memoryview
+    user_favorites: memoryview
+    user_review_offsets: memoryview
+    user_reviews: memoryview
+    review_users: memoryview
+    review_animes: memoryview
+    review_ratings: memoryview
+    _views: list[memoryview]
+
+    def __init__(self, views: dict[str, memoryview]) -> None:
+        """Initialize a core from a read-only view of each array in SECTIONS, by name"""
+        self._views = []
+        for section, _ in SECTIONS:
+            self._views.append(views[section])
+            setattr(self, section, views[section])
+        self.num_animes = len(self.anime_uids)
+        self.num_users = len(self.user_order)
+
+    def release(self) -> None:
+        """Release the core's views of its arrays. The core can not be used afterwards."""
+        for view in self._views:
+            view.release()
+        self._views = []
+
+    def get_title(self, anime: int) -> str:
+        """Return the title of anime"""
+        return get_text(self.anime_title_offsets, self.anime_titles, anime)
+
+    def get_genres(self, anime: int) -> set[str]:
+        """Return the genres of anime"""
+        genres = get_text(self.anime_genre_offsets, self.anime_genres, anime)
+        return set(genres.split(GENRE_SEPARATOR)) if genres != '' else set()
+
+    def get_air_dates(self, anime: int) -> tuple[datetime.date, datetime.date]:
+        """Return the dates that anime aired between"""
+        return (datetime.date.fromordinal(self.anime_air_dates[2 * anime]),
+                datetime.date.fromordinal(self.anime_air_dates[2 * anime + 1]))
+
+    def get_anime_reviews(self, anime: int) -> memoryview:
+        """Return the review rows of anime"""
+        return self.anime_reviews[self.anime_review_offsets[anime]:self.anime_review_offsets[anime + 1]]
+
+    def get_username(self, user: int) -> str:
+        """Return the username of user"""
+        return get_text(self.user_name_offsets, self.user_names, user)
+
+    def find_user(self, username: str) -> Optional[int]:
+        """Return the number of the user called username, or None if there is no such user in the core"""
+        position = bisect.bisect_left(self.user_order, username, key=self.get_username)
+        if position < self.num_users and self.get_username(self.user_order[position]) == username:
+            return self.user_order[position]
+        return None
+
+    def get_favorites(self, user: int) -> memoryview:
+        """Return the numbers of the favorite anime of user"""
+        return self.user_favorites[self.user_favorite_offsets[user]:self.user_favorite_offsets[user + 1]]
+
+    def get_user_reviews(self, user: int) -> memoryview:
+        """Return the review rows of user"""
+        return self.user_reviews[self.user_review_offsets[user]:self.user_review_offsets[user + 1]]
+
+    def get_ratings(self, review: int) -> array.array:
+        """Return a copy of the ratings of review in the order of g.RATING_CATEGORIES"""
+        start = review * len(g.RATING_CATEGORIES)
+        return array.array('b', self.review_ratings[start:start + len(g.RATING_CATEGORIES)])
+
+
+class SharedGraphCore(GraphCore):
+    """A GraphCore kept in a block of shared memory that several processes can read at once.
+
+    Instance Attributes
+    - name: the name of the shared memory block, which other processes pass to attach_graph_core
+    """
+    name: str
+    _memory: SharedMemory
+
+    def __init__(self, memory: SharedMemory) -> None:
+        """Initialize the core stored in memory, which was filled in by publish_graph_core
+        Raises ValueError if memory holds a different version of the layout.
+        """
+        self._memory = memory
+        self.name = memory.name
+        with memory.buf[:header_size()].cast('q') as header:
+            if header[0] != SHARED_FORMAT_VERSION:
+                version = header[0]
+                header.release()
+                memory.close()
+                raise ValueError(f'{memory.name} holds version {version} of the shared graph layout')
+
+            views = {}
+            for i, (section, typecode) in enumerate(SECTIONS):
+                start, length = header[1 + 2 * i], header[2 + 2 * i]
+                views[section] = memory.buf[start:start + length * array.array(typecode).itemsize].cast(typecode)
+        super().__init__({section: view.toreadonly() for section, view in views.items()})
+
+    def close(self) -> None:
+        """Stop using the shared memory block in this process. The core can not be used afterwards."""
+        self.release()
+        self._memory.close()
+
+    def unlink(self) -> None:
+        """Free the shared memory block once every process has closed it. Only the process that published the core
+        should call this.
+        """
+        PUBLISHED_NAMES.discard(self.name)
+        self._memory.unlink()
+
+
+class SharedReview:
+    """A review in the core of a SharedReccomenderGraph. It has the same methods as g.Review, but is only created
+    when it is used and is not stored in the anime or user it connects.
+    """
+    __slots__ = ('_graph', '_index')
+    _graph: SharedReccomenderGraph
+    _index: int
+
+    def __init__(self, graph: SharedReccomenderGraph, index: int) -> None:
+        """Initialize a view of row index of graph's core"""
+        self._graph = graph
+        self._index = index
+
+    @property
+    def endpoints(self) -> tuple[aau.User, aau.Anime]:
+        """The user and anime linked by this review"""
+        core = self._graph.core
+        return (self._graph.get_core_user(core.review_users[self._index]),
+                self._graph.get_core_anime(core.review_animes[self._index]))
+
+    @property
+    def ratings(self) -> dict[str, int]:
+        """A new dictionary of the ratings the user gave for each category"""
+        return dict(zip(g.RATING_CATEGORIES, self.get_ratings_row()))
+
+    def get_rating(self, category: str) -> int:
+        """Return the rating the user gave for category
+        Preconditions:
+            - category in g.RATING_CATEGORIES
+        """
+        return self._graph.core.review_ratings[self._index * len(g.RATING_CATEGORIES) + g.CATEGORY_COLUMNS[category]]
+
+    def get_ratings_row(self) -> array.array:
+        """Return a copy of the ratings of this review in the order of g.RATING_CATEGORIES"""
+        return self._graph.core.get_ratings(self._index)
+
+    def get_index(self) -> int:
+        """Return the row of the core that this review is a view of"""
+        return self._index
+
+
+class SharedAnime(aau.Anime):
+    """An anime node of a SharedReccomenderGraph. Its reviews dict only holds the reviews of users imported into
+    the graph, and the reviews in the graph's core are read from there.
+    """
+    __slots__ = ('_core', '_index')
+    _core: GraphCore
+    _index: int
+
+    def __init__(self, core: GraphCore, index: int) -> None:
+        """Initialize anime number index of core"""
+        self._core = core
+        self._index = index
+        super().__init__(core.get_title(index), core.anime_episodes[index], core.get_genres(index),
+                         core.get_air_dates(index), core.anime_uids[index])
+
+    def get_index(self) -> int:
+        """Return the number of this anime in the core"""
+        return self._index
+
+    def get_rating_totals(self) -> tuple[int, Sequence[int]]:
+        """Return the number of reviews of this anime in the core and its private reviews, and the sums of their
+        ratings in the order of g.RATING_CATEGORIES. The rating sums of both are kept up to date, so this does not
+        read any reviews.
+        """
+        num_categories = len(g.RATING_CATEGORIES)
+        sums = list(self._core.anime_rating_sums[self._index * num_categories:(self._index + 1) * num_categories])
+        count = self._core.anime_review_offsets[self._index + 1] - self._core.anime_review_offsets[self._index]
+        private_count, private_sums = super().get_rating_totals()
+        return count + private_count, [total + private_total for total, private_total in zip(sums, private_sums)]
+
+
+class SharedUser(aau.User):
+    """A user in the core of a SharedReccomenderGraph. Its reviews are read from the core the first time they are
+    used. Shared users have no priorities, era or friends, the same as the users read by g.read_file.
+    """
+    __slots__ = ('_graph', '_index', '_has_reviews')
+    _graph: SharedReccomenderGraph
+    _index: int
+    _has_reviews: bool
+
+    def __init__(self, graph: SharedReccomenderGraph, index: int) -> None:
+        """Initialize user number index of graph's core"""
+        self._graph = graph
+        self._index = index
+        self._has_reviews = False
+        favorite_uids = tuple(graph.core.anime_uids[anime] for anime in graph.core.get_favorites(index))
+        super().__init__(username=graph.core.get_username(index), fav_animes=graph.get_favorite_animes(favorite_uids))
+
+    @property
+    def reviews(self) -> dict[aau.Anime, SharedReview]:
+        """The reviews of this user, read from the core the first time they are used"""
+        if not self._has_reviews:
+            self._has_reviews = True
+            core = self._graph.core
+            reviews = {self._graph.get_core_anime(core.review_animes[row]): SharedReview(self._graph, row)
+                       for row in core.get_user_reviews(self._index)}
+            aau.User.reviews.__set__(self, reviews)
+        return aau.User.reviews.__get__(self)
+
+    @reviews.setter
+    def reviews(self, reviews: dict[aau.Anime, SharedReview]) -> None:
+        """Set the reviews of this user"""
+        aau.User.reviews.__set__(self, reviews)
+
+    def get_index(self) -> int:
+        """Return the number of this user in the core"""
+        return self._index
+
+
+class SharedUserTable(dict):
+    """The users of a SharedReccomenderGraph by username. Only the users inserted into the graph are stored in the
+    table, and looking up any other user reads a new SharedUser from the core.
+    """
+    _graph: SharedReccomenderGraph
+
+    def __init__(self, graph: SharedReccomenderGraph) -> None:
+        """Initialize a user table for graph with no inserted users"""
+        super().__init__()
+        self._graph = graph
+
+    def __missing__(self, username: str) -> SharedUser:
+        """Read the user called username from the core.
+        Raises KeyError if there is no such user.
+        """
+        index = self._graph.core.find_user(username)
+        if index is None:
+            raise KeyError(username)
+        return SharedUser(self._graph, index)
+
+    def __contains__(self, username: object) -> bool:
+        """Return whether the user called username was inserted into the graph or is in its core"""
+        return super().__contains__(username) or (isinstance(username, str)
+                                                   and self._graph.core.find_user(username) is not None)
+
+    def get(self, username: str, default: Optional[aau.User] = None) -> Optional[aau.User]:
+        """Return the user called username, or default if there is no such user"""
+        try:
+            return self[username]
+        except KeyError:
+            return default
+
+
+class SharedReccomenderGraph(g.ReccomenderGraph):
+    """A ReccomenderGraph whose anime, users and reviews are read from a GraphCore, either in shared memory or mapped
+    from disk by mapped_graph.
+    The anime nodes are built when the graph is created. The users in the core are read from it when they are looked
+    up, so iterating over users only gives the users inserted into this graph, and their reviews are private to it.
+
+    Instance Attributes
+    - core: the read-only arrays that this graph reads from
+    """
+    core: GraphCore
+    _anime_nodes: list[SharedAnime]
+
+    def __init__(self, core: GraphCore) -> None:
+        """Initialize a graph that reads from core"""
+        super().__init__()
+        self.core = core
+        self.users = SharedUserTable(self)
+        self._anime_nodes = [SharedAnime(core, index) for index in range(core.num_animes)]
+        for anime in self._anime_nodes:
+            self.insert_anime(anime)
+
+    def get_core_anime(self, index: int) -> SharedAnime:
+        """Return anime number index of the core"""
+        return self._anime_nodes[index]
+
+    def get_core_user(self, index: int) -> aau.User:
+        """Return user number index of the core"""
+        return SharedUser(self, index)
+
+    def find_first_paths(self, user: aau.User, added_ends: set[aau.Anime], deadline: Optional[float] = None,
+                         path_budget: Optional[int] = None) -> Iterator[list]:
+        """Yield the first path of 3 reviews from user to each anime not in added_ends, in the order that
+        aau.User.get_all_path_scores_helper finds them, adding each anime to added_ends as its path is found, and
+        stopping early at deadline or path_budget like g.ReccomenderGraph.find_first_paths.
+        Paths through the core are walked over its arrays.
+        """
+        core = self.core
+        user_index = user.get_index() if isinstance(user, SharedUser) else -1
+        explored = 0
+        for first_anime, first_review in user.reviews.items():
+            for row in core.get_anime_reviews(first_anime.get_index()):
+                if core.review_users[row] == user_index:
+                    continue
+                if g.is_out_of_budget(explored, deadline, path_budget):
+                    return
+                end_rows = core.get_user_reviews(core.review_users[row])
+                explored += len(end_rows)
+                for end_row in end_rows:
+                    end_anime = self._anime_nodes[core.review_animes[end_row]]
+                    if end_anime is not first_anime and end_anime not in added_ends:
+                        added_ends.add(end_anime)
+                        yield [first_review, SharedReview(self, row), SharedReview(self, end_row)]
+
+            # the reviews of inserted users come after the core's, as they were added to the anime later
+            for second_user, second_review in first_anime.reviews.items():
+                if second_user is user:
+                    continue
+                if g.is_out_of_budget(explored, deadline, path_budget):
+                    return
+                explored += len(second_user.reviews)
+                for end_anime, end_review in second_user.reviews.items():
+                    if end_anime is not first_anime and end_anime not in added_ends:
+                        added_ends.add(end_anime)
+                        yield [first_review, second_review, end_review]
+
+
+def header_size() -> int:
+    """Return the number of bytes at the start of a shared memory block that describe its sections
+
+    >>> header_size() == 8 * (1 + 2 * len(SECTIONS))
+    True
+    """
+    return array.array('q').itemsize * (1 + 2 * len(SECTIONS))
+
+
+def get_text(offsets: memoryview, blob: memoryview, index: int) -> str:
+    """Return the text number index stored in blob, where offsets holds where each text starts
+
+    >>> get_text(memoryview(array.array('i', [0, 3, 5])), memoryview(b'abcde'), 1)
+    'de'
+    """
+    return bytes(blob[offsets[index]:offsets[index + 1]]).decode('utf-8')
+
+
+def build_core_sections(graph: g.ReccomenderGraph) -> dict[str, array.array]:
+    """Return the arrays of the core of graph, by the names in SECTIONS.
+    Only reviews between the users and anime in graph are included, and the friends of users are not.
+    """
+    sections = {section: array.array(typecode) for section, typecode in SECTIONS}
+    for section in ('anime_title_offsets', 'anime_genre_offsets', 'anime_review_offsets', 'user_name_offsets',
+                    'user_favorite_offsets', 'user_review_offsets'):
+        sections[section].append(0)
+
+    animes = list(graph.animes.values())
+    anime_ids = {anime: i for i, anime in enumerate(animes)}
+    users = list(graph.users.values())
+    user_ids = {user: i for i, user in enumerate(users)}
+    review_rows = {}
+
+    for i, anime in enumerate(animes):
+        sections['anime_uids'].append(anime.get_uid())
+        sections['anime_episodes'].append(anime.get_num_episodes())
+        sections['anime_air_dates'].extend(date.toordinal() for date in anime.get_air_dates())
+        append_text(sections['anime_title_offsets'], sections['anime_titles'], anime.get_title())
+        append_text(sections['anime_genre_offsets'], sections['anime_genres'],
+                    GENRE_SEPARATOR.join(sorted(anime.get_genres())))
+        sums = [0] * len(g.RATING_CATEGORIES)
+        for user, review in anime.reviews.items():
+            if user in user_ids:
+                review_rows[review] = len(sections['review_users'])
+                sections['anime_reviews'].append(len(sections['review_users']))
+                sections['review_users'].append(user_ids[user])
+                sections['review_animes'].append(i)
+                row = review.get_ratings_row()
+                sections['review_ratings'].extend(row)
+                for column in range(len(g.RATING_CATEGORIES)):
+                    sums[column] += row[column]
+        sections['anime_rating_sums'].extend(sums)
+        sections['anime_review_offsets'].append(len(sections['anime_reviews']))
+
+    for user in users:
+        append_text(sections['user_name_offsets'], sections['user_names'], user.username)
+        sections['user_favorites'].extend(anime_ids[anime] for anime in user.favorite_animes if anime in anime_ids)
+        sections['user_favorite_offsets'].append(len(sections['user_favorites']))
+        sections['user_reviews'].extend(review_rows[review] for review in user.reviews.values()
+                                        if review in review_rows)
+        sections['user_review_offsets'].append(len(sections['user_reviews']))
+    sections['user_order'].extend(sorted(range(len(users)), key=lambda u: users[u].username))
+
+    return sections
+
+
+def append_text(offsets: array.array, blob: array.array, text: str) -> None:
+    """Add text to the end of blob and record where it ends in offsets"""
+    blob.frombytes(text.encode('utf-8'))
+    offsets.append(len(blob))
+
+
+def publish_graph_core(graph: g.ReccomenderGraph, name: Optional[str] = None) -> SharedGraphCore:
+    """Copy the core of graph into a new block of shared memory and return it. Other processes attach to the block
+    with attach_graph_core(core.name). The block stays in memory until the returned core's unlink method is called.
+    Raises FileExistsError if there is already a shared memory block called name.
+    """
+    sections = build_core_sections(graph)
+    header = array.array('q', [SHARED_FORMAT_VERSION])
+    end = header_size()
+    for section, _ in SECTIONS:
+        # every array starts on an 8 byte boundary, so that its memoryview is aligned
+        start = end + -end % 8
+        header.extend((start, len(sections[section])))
+        end = start + len(sections[section]) * sections[section].itemsize
+
+    memory = SharedMemory(name=name, create=True, size=end)
+    memory.buf[:header_size()] = header.tobytes()
+    for i, (section, _) in enumerate(SECTIONS):
+        start = header[1 + 2 * i]
+        data = sections[section].tobytes()
+        memory.buf[start:start + len(data)] = data
+    PUBLISHED_NAMES.add(memory.name)
+    return SharedGraphCore(memory)
+
+
+def attach_graph_core(name: str) -> SharedGraphCore:
+    """Return the core published under name by publish_graph_core in another process, without copying it.
+    Raises FileNotFoundError if there is no shared memory block called name.
+    """
+    # A process's resource tracker frees every block it tracks once the process exits, which would free the core out
+    # from under the publisher and the other workers. Processes started by multiprocessing share their parent's
+    # tracker instead, which already tracks the core if their parent published it, and the publisher's own tracker
+    # has to keep tracking it until unlink unregisters it.
+    if sys.version_info >= (3, 13):
+        memory = SharedMemory(name=name, track=False)
+    else:
+        memory = SharedMemory(name=name)
+        if multiprocessing.parent_process() is None and memory.name not in PUBLISHED_NAMES:
+            resource_tracker.unregister(memory._name, 'shared_memory')
+    return SharedGraphCore(memory)
+
+
+if __name__ == '__main__':
+    import doctest
+
+    doctest.testmod(verbose=True)
+    python_ta.check_all(config={
+        'extra-imports': ['anime_and_users', 'graph', 'array', 'bisect', 'datetime', 'sys', 'multiprocessing',
+                          'multiprocessing.shared_memory', 'typing'],
+        'disable': ['protected-access'],
+        'max-line-length': 120
+    })
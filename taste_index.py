@@ -0,0 +1,316 @@
+"""
+CSC111 Project: User taste index
+
+This module contains a summary of each user's taste as a vector of their mean ratings and how often each genre is in
+the anime they like, and an approximate nearest neighbour index of those vectors that finds the users with the most
+similar taste to anyone in about a millisecond, instead of comparing them to all of the users. The index hashes every
+vector with random hyperplanes, so that similar vectors usually land in the same bucket of at least one of its tables,
+and only a few of the users in those buckets are compared exactly.
+
+This file is Copyright (c) 2023 Hai Shi, Liam Alexander Maguire, Amelia Wu, and Sanya Chawla.
+"""
+from __future__ import annotations
+import array
+import heapq
+import itertools
+import math
+import operator
+import random
+from typing import Optional, Sequence
+
+import python_ta
+
+import anime_and_users as aau
+import graph as g
+
+TASTE_INDEX_FILE = 'taste_index.pickle'
+
+# Every vector is hashed to a sketch of TASTE_SKETCH_BITS bits, one for each random hyperplane, that is 1 where the
+# vector is on the positive side of the hyperplane. The sketch is cut into TASTE_KEY_PARTS parts of TASTE_KEY_BITS
+# bits, and every pair of parts is the key of a vector in one hash table, so users whose sketches agree on any two
+# parts are found without hashing the query once for every table.
+TASTE_SKETCH_BITS = 96
+TASTE_KEY_BITS = 8
+TASTE_KEY_PARTS = 10
+
+# find_similar compares this many times as many candidates as it returns exactly, picking the candidates whose
+# sketches are the least different from the query's. Comparing more finds more of the most similar users but is slower.
+TASTE_SHORTLIST_FACTOR = 4
+
+TasteRows = tuple[list[str], array.array, int, list[str], array.array, list[int]]
+
+
+class TasteIndex:
+    """A locality-sensitive hashing index of user taste vectors under cosine similarity.
+
+    Vectors are centred on the mean vector of the users the index was built from, since every rating and genre
+    frequency is positive and uncentred vectors would all point the same way. The number of bits where the sketches
+    of two centred vectors differ is about proportional to the angle between them, so a query finds every user who
+    shares a bucket with it in some table, keeps the ones with the closest sketches and ranks those by their exact
+    cosine similarity.
+
+    Instance Attributes
+    - genre_words: the genre that each vector position after the first len(g.RATING_CATEGORIES) is the frequency of
+    - mean: the mean vector that vectors are centred on
+    - seed: the seed of the random hyperplanes
+    - usernames: the username of each user in the index, by position
+    - unit_vectors: the centred vector of each user in the index scaled to length 1, one after the other
+    - sketches: the sketch of each user in the index, by position
+    Representation Invariants:
+        - len(self.mean) == len(g.RATING_CATEGORIES) + len(self.genre_words)
+        - len(self.unit_vectors) == len(self.usernames) * len(self.mean)
+        - len(self.sketches) == len(self.usernames)
+        - TASTE_KEY_BITS * TASTE_KEY_PARTS <= TASTE_SKETCH_BITS
+    """
+    genre_words: list[str]
+    mean: array.array
+    seed: int
+    usernames: list[str]
+    unit_vectors: array.array
+    sketches: list[int]
+    _positions: dict[str, int]
+    _plane_columns: list[list[float]]
+    _mean_projections: list[float]
+    _tables: list[dict[int, list[int]]]
+
+    def __init__(self, rows: TasteRows) -> None:
+        """Initialize an index from the rows returned by get_rows"""
+        self.genre_words, self.mean, self.seed, self.usernames, self.unit_vectors, self.sketches = rows
+        generator = random.Random(self.seed)
+        planes = [[generator.gauss(0, 1) for _ in self.mean] for _ in range(TASTE_SKETCH_BITS)]
+        # the hyperplanes by vector position, so that a vector is projected onto all of them by adding up only the
+        # columns of its nonzero positions, and most genre frequencies are zero
+        self._plane_columns = [[plane[position] for plane in planes] for position in range(len(self.mean))]
+        self._mean_projections = [sum(map(operator.mul, plane, self.mean)) for plane in planes]
+
+        self._positions = {username: position for position, username in enumerate(self.usernames)}
+        parts = [[get_key_part(sketch, part) for sketch in self.sketches] for part in range(TASTE_KEY_PARTS)]
+        self._tables = []
+        for first, second in itertools.combinations(range(TASTE_KEY_PARTS), 2):
+            table = {}
+            for position, (first_part, second_part) in enumerate(zip(parts[first], parts[second])):
+                table.setdefault(first_part << TASTE_KEY_BITS | second_part, []).append(position)
+            self._tables.append(table)
+
+    def __len__(self) -> int:
+        """Return the number of users in the index"""
+        return len(self.usernames)
+
+    def __contains__(self, username: str) -> bool:
+        """Return whether the user called username is in the index"""
+        return username in self._positions
+
+    def get_rows(self) -> TasteRows:
+        """Return a copy of the contents of the index, in the order that __init__ takes them, which later inserts do
+        not change
+        """
+        return (list(self.genre_words), array.array('d', self.mean), self.seed, list(self.usernames),
+                array.array('d', self.unit_vectors), list(self.sketches))
+
+    def insert_user(self, user: aau.User) -> None:
+        """Add user to the index, or update their vector if they are already in it. Users without a taste vector are
+        left out.
+        """
+        vector = taste_vector(user, self.genre_words)
+        if vector is not None:
+            self.insert(user.username, vector)
+
+    def insert(self, username: str, vector: Sequence[float]) -> None:
+        """Add the user called username with the taste vector vector to the index, replacing their old vector if they
+        are already in it
+        Preconditions:
+            - len(vector) == len(self.mean)
+        """
+        dimensions = len(self.mean)
+        sketch = self.get_sketch(vector)
+        if username in self._positions:
+            position = self._positions[username]
+            for table, key in zip(self._tables, get_keys(self.sketches[position])):
+                table[key].remove(position)
+            self.unit_vectors[position * dimensions:(position + 1) * dimensions] = array.array('d', self.centre(vector))
+            self.sketches[position] = sketch
+        else:
+            position = len(self.usernames)
+            self._positions[username] = position
+            self.usernames.append(username)
+            self.unit_vectors.extend(self.centre(vector))
+            self.sketches.append(sketch)
+        for table, key in zip(self._tables, get_keys(sketch)):
+            table.setdefault(key, []).append(position)
+
+    def find_similar_users(self, user: aau.User, n: int = 10) -> list[tuple[str, float]]:
+        """Return the usernames of about the n other users whose taste is most like user's, with their similarity,
+        from most to least similar, or an empty list if user has no taste vector
+        """
+        vector = taste_vector(user, self.genre_words)
+        if vector is None:
+            return []
+        return self.find_similar(vector, n, exclude=user.username)
+
+    def find_similar(self, vector: Sequence[float], n: int = 10,
+                     exclude: Optional[str] = None) -> list[tuple[str, float]]:
+        """Return the usernames of about the n users whose taste is most like vector, with the cosine similarity of
+        their vectors to it, from most to least similar. The user called exclude is never returned.
+        Only the users who share a bucket with vector are compared, so a similar user is sometimes missed.
+        Preconditions:
+            - len(vector) == len(self.mean)
+            - n >= 0
+        """
+        sketch = self.get_sketch(vector)
+        candidates = set()
+        for table, key in zip(self._tables, get_keys(sketch)):
+            candidates.update(table.get(key, ()))
+        if exclude in self._positions:
+            candidates.discard(self._positions[exclude])
+        if len(candidates) == 0 or n == 0:
+            return []
+        sketches = self.sketches
+        shortlist = heapq.nsmallest(n * TASTE_SHORTLIST_FACTOR, candidates,
+                                    key=lambda position: (sketch ^ sketches[position]).bit_count())
+
+        unit_vector = self.centre(vector)
+        dimensions = len(self.mean)
+        vectors = self.unit_vectors
+        similarities = ((sum(map(operator.mul, vectors[position * dimensions:(position + 1) * dimensions],
+                                 unit_vector)), position) for position in shortlist)
+        return [(self.usernames[position], similarity)
+                for similarity, position in heapq.nlargest(n, similarities)]
+
+    def centre(self, vector: Sequence[float]) -> list[float]:
+        """Return vector centred on the index's mean and scaled to length 1, or all zeros if it is the mean.
+        Positions of vector that are nan are taken to be the mean.
+        """
+        centred = [0.0 if math.isnan(value) else value - mean for value, mean in zip(vector, self.mean)]
+        length = math.sqrt(sum(value * value for value in centred))
+        if length == 0:
+            return centred
+        return [value / length for value in centred]
+
+    def get_sketch(self, vector: Sequence[float]) -> int:
+        """Return the sketch of vector once it is centred. Positions of vector that are nan are taken to be the
+        mean.
+        """
+        # the projection of the centred vector onto a hyperplane is the projection of vector minus that of the mean
+        projections = [-total for total in self._mean_projections]
+        for position, value in enumerate(vector):
+            if math.isnan(value):
+                value = self.mean[position]
+            if value != 0:
+                projections = [total + value * coefficient
+                               for total, coefficient in zip(projections, self._plane_columns[position])]
+        return sum(1 << bit for bit, total in enumerate(projections) if total > 0)
+
+
+def get_keys(sketch: int) -> list[int]:
+    """Return the key of a vector with the given sketch in each hash table of a TasteIndex, which is a different
+    pair of the parts of its sketch for each table
+    """
+    parts = [get_key_part(sketch, part) for part in range(TASTE_KEY_PARTS)]
+    return [parts[first] << TASTE_KEY_BITS | parts[second]
+            for first, second in itertools.combinations(range(TASTE_KEY_PARTS), 2)]
+
+
+def get_key_part(sketch: int, part: int) -> int:
+    """Return the given part of sketch, which is TASTE_KEY_BITS bits long
+
+    >>> get_key_part(0b1010011, 0) == 0b1010011 & (2 ** TASTE_KEY_BITS - 1)
+    True
+    >>> get_key_part(5 << TASTE_KEY_BITS, 1)
+    5
+    """
+    return sketch >> (part * TASTE_KEY_BITS) & ((1 << TASTE_KEY_BITS) - 1)
+
+
+def taste_vector(user: aau.User, genre_words: Sequence[str]) -> Optional[list[float]]:
+    """Return user's taste vector, or None if they have no reviews and no favorite or highly rated anime.
+    The vector holds the user's mean rating in each of g.RATING_CATEGORIES divided by 10, followed by the fraction of
+    the anime that aau.User.calculate_genre_match_avg bases their matching genres on which have each genre in
+    genre_words. A user without reviews gets the rating means of an average user once the vector is centred.
+    """
+    animes = user.favorite_animes.union({anime for anime in user.reviews
+                                         if user.reviews[anime].get_rating('overall') > 4})
+    if len(animes) == 0 and len(user.reviews) == 0:
+        return None
+
+    vector = [0.0] * (len(g.RATING_CATEGORIES) + len(genre_words))
+    if len(user.reviews) == 0:
+        vector[:len(g.RATING_CATEGORIES)] = [math.nan] * len(g.RATING_CATEGORIES)
+    for review in user.reviews.values():
+        for column, rating in enumerate(review.get_ratings_row()):
+            vector[column] += rating / (10 * len(user.reviews))
+
+    positions = {word: len(g.RATING_CATEGORIES) + i for i, word in enumerate(genre_words)}
+    for anime in animes:
+        for genre in anime.get_genres():
+            if genre in positions:
+                vector[positions[genre]] += 1 / len(animes)
+    return vector
+
+
+def build_taste_index(users: Sequence[aau.User], seed: int = 0) -> TasteIndex:
+    """Build a taste index of the users with a taste vector in users, over every genre in aau.GENRES"""
+    genre_words = list(aau.GENRES.words)
+    usernames = []
+    vectors = []
+    for user in users:
+        vector = taste_vector(user, genre_words)
+        if vector is not None:
+            usernames.append(user.username)
+            vectors.append(vector)
+
+    mean = array.array('d')
+    for column in range(len(g.RATING_CATEGORIES) + len(genre_words)):
+        known = [vector[column] for vector in vectors if not math.isnan(vector[column])]
+        mean.append(sum(known) / len(known) if len(known) > 0 else 0.0)
+
+    index = TasteIndex((genre_words, mean, seed, [], array.array('d'), []))
+    for username, vector in zip(usernames, vectors):
+        index.insert(username, vector)
+    return index
+
+
+def load_taste_index(graph: g.ReccomenderGraph, digests: list[str],
+                     index_file: Optional[str] = TASTE_INDEX_FILE) -> TasteIndex:
+    """Return the taste index of the users in graph, where digests is get_index_digests of the files graph was read
+    from by g.read_file, which callers work out once and pass to save_taste_index too.
+    The index is cached in index_file together with digests, and is only built again when one of the files or the
+    shape of the hash tables has changed. Users inserted and saved with save_taste_index since it was built are kept.
+    If index_file is None, the index is always built and never saved.
+    """
+    index = None
+    if index_file is not None:
+        rows = g.load_snapshot(index_file, digests)
+        if rows is not None:
+            index = TasteIndex(rows)
+    if index is None:
+        index = build_taste_index(list(graph.users.values()))
+        if index_file is not None:
+            save_taste_index(index.get_rows(), digests, index_file)
+    return index
+
+
+def save_taste_index(rows: TasteRows, digests: list[str], index_file: str = TASTE_INDEX_FILE) -> None:
+    """Save the rows of a taste index to index_file with digests, the same get_index_digests it was loaded with, for
+    load_taste_index. Inserting a user and then saving TasteIndex.get_rows on another thread is safe, since the rows
+    are a copy.
+    """
+    g.write_snapshot(index_file, digests, rows)
+
+
+def get_index_digests(files: list[str]) -> list[str]:
+    """Return the sha256 hash of every file in files and the shape of the hash tables, which a saved taste index
+    must have been saved with to be used
+    """
+    return [g.hash_file(file) for file in files] + [f'{TASTE_SKETCH_BITS}x{TASTE_KEY_BITS}x{TASTE_KEY_PARTS}']
+
+
+if __name__ == '__main__':
+    import doctest
+
+    doctest.testmod(verbose=True)
+    python_ta.check_all(config={
+        'extra-imports': ['anime_and_users', 'graph', 'array', 'heapq', 'itertools', 'math', 'operator', 'random',
+                          'typing'],
+        'allowed-io': [],
+        'max-line-length': 120
+    })
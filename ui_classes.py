@@ -497,6 +497,16 @@ class RecommendationDisplay:
         spotlight.update(animes[0])
         return anime_buttons
 
+    def show_message(self, message: str) -> None:
+        """Clear the recommendations and show message in their place, like while recommendations are being worked
+        out or when there are none.
+        """
+        list_rect = pygame.Rect(self.position[0] + self.margin, self.position[1] + self.margin + self.title_height,
+                                self.width - 2 * self.margin, self.height - 2 * self.margin - self.title_height)
+        pygame.draw.rect(self.screen, self.anime_button_colour, list_rect)
+        img = self.anime_font.render(message, True, self.recommendation_text_colour)
+        self.screen.blit(img, (list_rect.x + 10, list_rect.y + 10))
+
     def shorten_title(self, text) -> str:
         """A method that shortens the title displayed in pygame.
         """
@@ -915,6 +925,11 @@ class InputBox2:
                 self.txt_surface = pygame.font.Font(None, 32).render(self.text, True, (51, 51, 51))
                 return rv
 
+    def set_text(self, text: str) -> None:
+        """Replace the text in the box with text, like when a suggestion is clicked"""
+        self.text = text
+        self.txt_surface = pygame.font.Font(None, 32).render(self.text, True, (51, 51, 51))
+
     def update(self):
         # Resize the box if the text is too long.
         width = max(200, self.txt_surface.get_width() + 10)